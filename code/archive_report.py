@@ -0,0 +1,124 @@
+import tempfile
+import time
+import warnings
+from pathlib import Path
+
+import numpy as np
+import xarray as xr
+
+from cmfd_io import ARCHIVE_PROFILES, PACKING_MAX_ERROR, archive_encoding
+from vic_forcing import valid_cells, huai_file_year
+
+# ====================================================================
+# --- 0. 配置 ---
+# ====================================================================
+# forcing.py 输出的 _huai.nc 文件所在文件夹
+INPUT_DATA_DIR = Path(r"H:\CMFD\huai\Data_forcing_01dy_010deg")
+# 参与比较的变量
+VARIABLES = ["wind", "temp", "pres", "shum", "rhum", "srad", "lrad", "prec"]
+# 用哪一年的文件做样本；None 表示最新的一年
+SAMPLE_YEAR = None
+# 随机读取多少个格网的整年时间序列 (模拟 process_forcing.py 等逐格网读取)
+N_CELL_READS = 50
+# 报告输出文件
+REPORT_PATH = INPUT_DATA_DIR / "archive_report.txt"
+
+
+def sample_files(input_dir, variables, year=None):
+    """返回 (年份, {变量: [该年的文件]})。year 为 None 时取所有变量都有文件的最新年份。
+
+    3 小时产品按月一个文件，一年有 12 个文件，都计入样本。
+    """
+    by_var = {}
+    for var in variables:
+        for f in sorted(input_dir.glob(f"{var}_*_huai.nc")):
+            by_var.setdefault(var, {}).setdefault(huai_file_year(f), []).append(f)
+    by_var = {var: files for var, files in by_var.items() if files}
+    if not by_var:
+        return None, {}
+    if year is None:
+        common = set.intersection(*(set(files) for files in by_var.values())) - {None}
+        year = max(common) if common else None
+    return year, {var: files[year] for var, files in by_var.items() if year in files}
+
+
+def measure(path, var, cells, reference):
+    """返回 (整文件读取耗时, 逐格网读取耗时, 最大绝对误差)。
+
+    注意操作系统的文件缓存会使第二次及以后的读取偏快，这里比较的是解码和解压本身的开销。
+    """
+    t0 = time.perf_counter()
+    with xr.open_dataset(path) as ds:
+        values = ds[var].transpose('time', 'y', 'x').values
+    t_full = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    with xr.open_dataset(path) as ds:
+        for iy, ix in cells:
+            ds[var].isel(y=int(iy), x=int(ix)).values
+    t_cells = time.perf_counter() - t0
+
+    with np.errstate(invalid='ignore'):
+        max_error = float(np.nanmax(np.abs(values.astype(np.float64) - reference)))
+    return t_full, t_cells, max_error
+
+
+if __name__ == "__main__":
+    warnings.simplefilter(action='ignore', category=FutureWarning)
+    year, files = sample_files(INPUT_DATA_DIR, VARIABLES, SAMPLE_YEAR)
+    if not files:
+        print(f"错误: 在 {INPUT_DATA_DIR} 中没有找到可用的 _huai.nc 文件。"); exit()
+    n_years = len({huai_file_year(f) for f in INPUT_DATA_DIR.glob("*_huai.nc")} - {None})
+    n_files = sum(len(nc_files) for nc_files in files.values())
+    print(f"以 {year} 年的 {n_files} 个文件为样本，比较归档编码 {ARCHIVE_PROFILES}...\n")
+
+    rng = np.random.default_rng(0)
+    rows = []
+    totals = {profile: [0, 0.0, 0.0] for profile in ARCHIVE_PROFILES}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for var, nc_files in files.items():
+            # 每个变量在各编码下的 [大小, 整读耗时, 逐格网耗时, 最大误差, 是否打包]，按该年的所有文件累计
+            stats = {profile: [0, 0.0, 0.0, 0.0, False] for profile in ARCHIVE_PROFILES}
+            cells = None
+            for nc_file in nc_files:
+                with xr.open_dataset(nc_file) as ds:
+                    ds = ds.load()
+                reference = ds[var].transpose('time', 'y', 'x').values.astype(np.float64)
+                if cells is None:
+                    # 同一变量的各文件读取相同的格网，逐格网耗时即为这些格网整年的读取耗时
+                    iy, ix, _, _ = valid_cells(ds[var].isel(time=0))
+                    pick = rng.choice(len(iy), size=min(N_CELL_READS, len(iy)), replace=False)
+                    cells = list(zip(iy[pick], ix[pick]))
+                base_encoding = {var: {'_FillValue': ds[var].encoding.get('_FillValue', -9999)}}
+                for profile in ARCHIVE_PROFILES:
+                    path = Path(tmp_dir) / f"{var}_{profile}.nc"
+                    encoding = archive_encoding(ds, base_encoding, profile)
+                    ds.to_netcdf(path, encoding=encoding)
+                    t_full, t_cells, max_error = measure(path, var, cells, reference)
+                    s = stats[profile]
+                    s[0] += path.stat().st_size
+                    s[1] += t_full
+                    s[2] += t_cells
+                    s[3] = max(s[3], max_error)
+                    s[4] |= encoding[var].get('dtype') == 'int16'
+            for profile, (size, t_full, t_cells, max_error, packed) in stats.items():
+                rows.append((var, profile, size, t_full, t_cells, max_error, packed))
+                totals[profile][0] += size
+                totals[profile][1] += t_full
+                totals[profile][2] += t_cells
+
+    lines = [f"归档编码比较 (样本: {year} 年, {len(files)} 个变量共 {n_files} 个文件, 每个变量随机读取 {N_CELL_READS} 个格网)", ""]
+    lines.append(f"{'变量':<6}{'编码':<12}{'大小(MB)':>10}{'整读(s)':>10}{'逐格网(s)':>11}{'最大误差':>12}  误差上限")
+    for var, profile, size, t_full, t_cells, max_error, packed in rows:
+        bound = f"{PACKING_MAX_ERROR[var]:g}" if packed else ("0 (无损)" if profile != 'packed' else "0 (范围超出 int16, 未打包)")
+        lines.append(f"{var:<6}{profile:<12}{size / 1024 ** 2:>10.2f}{t_full:>10.3f}{t_cells:>11.3f}{max_error:>12.3g}  {bound}")
+    lines += ["", f"合计 (按 {n_years} 年估算整个归档):"]
+    plain_size = totals['plain'][0]
+    for profile, (size, t_full, t_cells) in totals.items():
+        lines.append(f"  {profile:<12} 每年 {size / 1024 ** 2:8.2f} MB, 全部约 {size * n_years / 1024 ** 3:7.2f} GB "
+                     f"({size / plain_size:6.1%}), 整读 {t_full:.3f} s, 逐格网 {t_cells:.3f} s")
+    report = "\n".join(lines)
+    print(report)
+    with open(REPORT_PATH, 'w', encoding='utf-8') as f:
+        f.write(report + "\n")
+    print(f"\n报告已写入: {REPORT_PATH}")
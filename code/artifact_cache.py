@@ -0,0 +1,95 @@
+import hashlib
+import json
+import os
+import threading
+from pathlib import Path
+
+# 小于该大小的输入文件按内容计算 SHA-256；更大的文件 (如全国 CMFD 原始数据)
+# 只用 (大小, 修改时间) 标识，避免为判断是否需要重算而把整个文件读一遍
+CONTENT_HASH_MAX_BYTES = 256 * 1024 ** 2
+
+MANIFEST_NAME = ".artifact_manifest.jsonl"
+
+
+def shapefile_parts(shp_path):
+    """shapefile 的所有组成文件 (.shp/.shx/.dbf/.prj/.cpg)，用作缓存键的输入。"""
+    shp_path = Path(shp_path)
+    parts = [shp_path.with_suffix(s) for s in ('.shp', '.shx', '.dbf', '.prj', '.cpg')]
+    return [p for p in parts if p.exists()]
+
+
+class ArtifactCache:
+    """基于清单文件的产物缓存。
+
+    每个产物 (输出文件) 记录其输入和配置的哈希键，以及写出时的大小和修改时间。
+    再次运行时，只要键相同且输出文件未被改动，就可以跳过该产物。
+    清单是只追加的 JSON Lines 文件，每完成一个产物追加一行，
+    因此中途崩溃的运行重新启动时可以从上次完成的位置继续。
+    """
+
+    def __init__(self, manifest_path):
+        self.manifest_path = Path(manifest_path)
+        self._artifacts = {}
+        self._fingerprints = {}
+        self._lock = threading.Lock()
+        if self.manifest_path.exists():
+            with open(self.manifest_path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue  # 崩溃时写了一半的最后一行
+                    if 'artifact' in entry:
+                        self._artifacts[entry['artifact']] = entry
+                    elif 'file' in entry:
+                        self._fingerprints[entry['file']] = entry
+
+    def _append(self, entry):
+        with self._lock:
+            self.manifest_path.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.manifest_path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+
+    def fingerprint(self, path):
+        """输入文件的指纹。按内容哈希的结果会按 (大小, 修改时间) 记入清单，同一版本的文件只哈希一次。"""
+        path = Path(path)
+        st = path.stat()
+        if st.st_size > CONTENT_HASH_MAX_BYTES:
+            return f"stat:{st.st_size}:{st.st_mtime_ns}"
+        cached = self._fingerprints.get(str(path))
+        if cached and cached['size'] == st.st_size and cached['mtime_ns'] == st.st_mtime_ns:
+            return cached['sha256']
+        h = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1024 ** 2), b''):
+                h.update(block)
+        entry = {'file': str(path), 'size': st.st_size, 'mtime_ns': st.st_mtime_ns, 'sha256': h.hexdigest()}
+        self._fingerprints[str(path)] = entry
+        self._append(entry)
+        return entry['sha256']
+
+    def key(self, inputs=(), config=None):
+        """由输入文件指纹和配置 (可 JSON 序列化) 计算产物的缓存键。"""
+        h = hashlib.sha256()
+        for path in inputs:
+            h.update(f"{Path(path).name}={self.fingerprint(path)}\n".encode())
+        h.update(json.dumps(config, sort_keys=True, default=str).encode())
+        return h.hexdigest()
+
+    def is_fresh(self, artifact, key):
+        """产物存在、未被改动，且上次生成时的键与 key 相同。"""
+        entry = self._artifacts.get(str(artifact))
+        if entry is None or entry['key'] != key:
+            return False
+        try:
+            st = os.stat(artifact)
+        except OSError:
+            return False
+        return st.st_size == entry['size'] and st.st_mtime_ns == entry['mtime_ns']
+
+    def record(self, artifact, key):
+        """在产物成功写出后调用。"""
+        st = os.stat(artifact)
+        entry = {'artifact': str(artifact), 'key': key, 'size': st.st_size, 'mtime_ns': st.st_mtime_ns}
+        self._artifacts[str(artifact)] = entry
+        self._append(entry)
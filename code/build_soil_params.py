@@ -0,0 +1,174 @@
+import os
+import time
+import warnings
+from pathlib import Path
+from artifact_cache import ArtifactCache, MANIFEST_NAME
+from soil_params import SoilParamTable, GRID_FORMATS, SOIL_FORMATS, ROUNDED_FORMATS, FINAL_FORMATS, column_formats, is_binary
+from soil_steps import (grid_table, fill_elevation, fill_constants, fill_annual_prec, fill_avg_temp, interpolate_global_params,
+                        dominant_texture, fill_ptf_params, shift_coordinates)
+
+# 一次生成最终土壤参数文件: 在同一张内存中的土壤参数表上依次执行
+# framework.py -> (fill_parameters.py 高程) -> fill_parameters2 -> 3 -> 4 -> 5 -> 9 -> 10.5 -> 11 -> 12 的计算，
+# 只解析输入数据一次、只写出最终文件一次，不再经由 soil_param_with_constants.txt 等中间文本文件传递。
+
+# --- 0. 忽略不必要的警告 ---
+warnings.filterwarnings("ignore", category=FutureWarning)
+
+# --- 1. 配置路径 ---
+# 主格网 (framework.py 的 NC_FILE_PATH，也是 fill_parameters.py 高程重采样的模板)
+GRID_NC = Path(r"H:\CMFD\huai\Data_forcing_01dy_010deg\wind_CMFD_V0200_B-01_01dy_025deg_202001-202012_huai.nc")
+ELEV_NC_IN = Path(r"H:\CMFD\Data_ancillary\elev_CMFD_V0200_B-00_fx_010deg.nc")
+MET_DATA_DIR = Path(r"H:\CMFD\huai\Data_forcing_01dy_010deg")
+PREC_FILES_PATTERN = "prec_*_huai.nc"
+# forcing.py 写出的气候统计文件：存在时年平均降水和 avg_T (CMFD 多年平均气温) 都由它直接得到，
+# 不再扫描全部降水文件、avg_T 也不再从全球土壤数据插值；None 表示不使用
+CLIMATOLOGY_FILE = MET_DATA_DIR / "climatology.nc"
+GLOBAL_SOIL_FILE = Path(r"C:\Users\yc\Desktop\vic\coach\spaw土壤计算等多个文件\土壤5分数据\global_soil_param_new.txt")
+ARCGIS_SOIL_OUTPUT = Path(r"C:\Users\yc\Desktop\vic\huaihe\source_data\soil\arcgis_output_soil.txt")
+
+# 输出文件：与 fill_parameters12.py 的输出相同
+SOIL_PARAM_OUT = Path(r"C:\Users\yc\Desktop\vic\huaihe\F_F\vic\param\SOIL_PARAM_FINAL_shifted.txt")
+
+# 调试用: 设为文件夹路径时，每一步之后都按原脚本的文件名写出中间文件；None 表示只写最终文件
+CHECKPOINT_DIR = None
+# 中间文件的格式: ".txt" 按原脚本的文本格式写出；".npz" 或 ".parquet" 写成带列名的二进制列存储，
+# 读取几乎不耗时，且保存的是内存中表的原值 (不经过文本格式化)
+CHECKPOINT_SUFFIX = ".txt"
+# 从某一步重新开始 (如 "fill_parameters10.5.py")：读取 CHECKPOINT_DIR 中上一步的中间文件，只执行该步及之后的步骤
+RESUME_FROM = None
+
+# True: 每一步之后都按原脚本写出文件的精度取整，结果与逐个运行脚本时逐字节相同；
+# False: 全程保留 float64 精度，只在写最终文件时格式化一次
+MATCH_FILE_CHAIN = True
+
+# --- 2. 各步骤的参数 (与对应脚本中的配置相同) ---
+# fill_parameters2.py: 模型常量
+CONSTANTS_TO_FILL = {
+    'depth_1': 0.1, 'depth_2': 1.0, 'depth_3': 1.5, 'dp': 3.0, 'off_gmt': 8, 'fs_active': 1,
+}
+# fill_parameters3.py: 更新的参数值
+UPDATES = {
+    'dp': 4.00, 'soil_density_1': 2685, 'soil_density_2': 2685, 'soil_density_3': 2685,
+    'fs_active': 0, 'depth_1': 0.1, 'depth_2': -9999, 'depth_3': -9999,
+}
+# fill_parameters5.py: 各层残余含水量
+RESID_MOIST = {'resid_moist_1': 0, 'resid_moist_2': 0, 'resid_moist_3': 0}
+# fill_parameters9.py: 全球土壤数据的列索引 (从0开始) 和要填充的目标列
+SOURCE_COLS = {
+    'lat': 2, 'lon': 3,
+    'AVG_T': 25, 'init_moist_1': 18, 'init_moist_2': 19, 'init_moist_3': 20,
+    'QUARTZ_1': 30, 'QUARTZ_2': 31, 'QUARTZ_3': 32,
+}
+TARGET_COLS = {
+    'AVG_T': 'avg_T', 'init_moist_1': 'init_moist_1', 'init_moist_2': 'init_moist_2', 'init_moist_3': 'init_moist_3',
+    'QUARTZ_1': 'quartz_1', 'QUARTZ_2': 'quartz_2', 'QUARTZ_3': 'quartz_3',
+}
+# fill_parameters12.py: 坐标偏移量
+LAT_SHIFT = 0.0050
+LON_SHIFT = -0.0050
+
+# fill_parameters2.py 的写出格式: 整数常量写成整数，小数常量原样写出
+CONSTANTS_FORMATS = column_formats(SOIL_FORMATS, **{column: '%d' if isinstance(value, int) else '%s'
+                                                    for column, value in CONSTANTS_TO_FILL.items()})
+
+
+def warn_param(param_name, e):
+    print(f"    - 警告：处理参数 {param_name} 时出错，该列将保持-9999。错误: {e}")
+
+
+def use_climatology():
+    return CLIMATOLOGY_FILE is not None and CLIMATOLOGY_FILE.exists()
+
+
+def fill_global_params(soil):
+    """fill_parameters9.py: 全球土壤数据插值；有气候统计文件时 avg_T 改用 CMFD 多年平均气温。"""
+    if not use_climatology():
+        return interpolate_global_params(soil, GLOBAL_SOIL_FILE, SOURCE_COLS, TARGET_COLS, on_error=warn_param)
+    target_cols = {name: column for name, column in TARGET_COLS.items() if column != 'avg_T'}
+    interpolate_global_params(soil, GLOBAL_SOIL_FILE, SOURCE_COLS, target_cols, on_error=warn_param)
+    return fill_avg_temp(soil, CLIMATOLOGY_FILE)
+
+
+# --- 3. 步骤列表 ---
+# (原脚本, 变换函数, 原脚本的写出格式, 原脚本写出的文件名)；变换函数接收上一步的表并返回本步的表
+STEPS = [
+    ("framework.py", lambda soil: grid_table(GRID_NC), GRID_FORMATS, "vic_soil_param.txt"),
+    ("fill_parameters.py (高程)", lambda soil: fill_elevation(soil, ELEV_NC_IN, GRID_NC), SOIL_FORMATS, "soil_param_final.txt"),
+    ("fill_parameters2.py", lambda soil: fill_constants(soil, CONSTANTS_TO_FILL), CONSTANTS_FORMATS, "soil_param_with_constants.txt"),
+    ("fill_parameters3.py", lambda soil: fill_constants(soil, UPDATES), SOIL_FORMATS, "soil_param_updated.txt"),
+    ("fill_parameters4.py", lambda soil: fill_annual_prec(soil, MET_DATA_DIR, PREC_FILES_PATTERN, CLIMATOLOGY_FILE), SOIL_FORMATS,
+     "soil_param_with_met.txt"),
+    ("fill_parameters5.py", lambda soil: fill_constants(soil, RESID_MOIST), SOIL_FORMATS, "soil_param_with_resid.txt"),
+    ("fill_parameters9.py", fill_global_params, ROUNDED_FORMATS, "SOIL_PARAM_FINAL_COMPLETE.txt"),
+    ("fill_parameters10.5.py", lambda soil: fill_ptf_params(soil, dominant_texture(ARCGIS_SOIL_OUTPUT)), ROUNDED_FORMATS, "SOIL_PARAM_FINAL.txt"),
+    ("fill_parameters11.py", lambda soil: soil, FINAL_FORMATS, "SOIL_PARAM_FINAL_formatted.txt"),
+    ("fill_parameters12.py", lambda soil: shift_coordinates(soil, LAT_SHIFT, LON_SHIFT), FINAL_FORMATS, "SOIL_PARAM_FINAL_shifted.txt"),
+]
+
+
+def checkpoint_path(checkpoint_dir, filename, suffix=".txt"):
+    return Path(checkpoint_dir) / Path(filename).with_suffix(suffix)
+
+
+def run_steps(steps, checkpoint_dir=None, match_file_chain=True, checkpoint_suffix=".txt", resume_from=None):
+    """依次执行各步骤，返回最终的土壤参数表。"""
+    soil = None
+    if resume_from is not None:
+        names = [step[0] for step in steps]
+        if resume_from not in names[1:]:
+            raise ValueError(f"无法从 {resume_from!r} 重新开始，可选的步骤为: {names[1:]}")
+        start_index = names.index(resume_from)
+        previous = checkpoint_path(checkpoint_dir, steps[start_index - 1][3], checkpoint_suffix)
+        print(f"  - 从中间文件 {previous.name} 重新开始")
+        soil = SoilParamTable.read(previous)
+        if match_file_chain and is_binary(previous):
+            # 二进制中间文件保存的是取整前的值，在这里按上一步的格式取整 (同时得到写出的字符串)
+            soil.quantize(steps[start_index - 1][2])
+        steps = steps[start_index:]
+    for name, transform, formats, filename in steps:
+        start = time.perf_counter()
+        soil = transform(soil)
+        checkpoint = checkpoint_path(checkpoint_dir, filename, checkpoint_suffix) if checkpoint_dir is not None else None
+        # 中间文件都保存取整前的值: 文本文件与原脚本写出的文件相同；二进制文件读回后再按本步的格式取整，
+        # 从中继续执行的结果与不间断运行相同
+        if checkpoint is not None:
+            soil.write(checkpoint, formats)
+        if match_file_chain:
+            soil.quantize(formats)
+        print(f"  - {name}: 完成 ({time.perf_counter() - start:.2f} 秒)")
+    return soil
+
+
+def main():
+    print("土壤参数一体化生成脚本开始...")
+    for path in [GRID_NC, ELEV_NC_IN, MET_DATA_DIR, GLOBAL_SOIL_FILE, ARCGIS_SOIL_OUTPUT]:
+        if not path.exists():
+            print(f"错误: 找不到输入 {path}"); exit()
+    os.makedirs(SOIL_PARAM_OUT.parent, exist_ok=True)
+    if CHECKPOINT_DIR is not None:
+        os.makedirs(CHECKPOINT_DIR, exist_ok=True)
+    elif RESUME_FROM is not None:
+        print("错误: 设置 RESUME_FROM 时需要同时设置 CHECKPOINT_DIR。"); exit()
+
+    # --- 增量缓存: 输入文件、步骤代码和配置都未变化时直接跳过 ---
+    cache = ArtifactCache(SOIL_PARAM_OUT.parent / MANIFEST_NAME)
+    code_files = [Path(__file__), *(Path(__file__).with_name(name) for name in ['soil_steps.py', 'soil_params.py', 'climatology.py'])]
+    met_inputs = [CLIMATOLOGY_FILE] if use_climatology() else sorted(MET_DATA_DIR.glob(PREC_FILES_PATTERN))
+    cache_key = cache.key(
+        inputs=[GRID_NC, ELEV_NC_IN, *met_inputs, GLOBAL_SOIL_FILE, ARCGIS_SOIL_OUTPUT, *code_files],
+        config={'avg_T_from_climatology': use_climatology(), 'constants': CONSTANTS_TO_FILL, 'updates': UPDATES, 'resid_moist': RESID_MOIST,
+                'source': SOURCE_COLS, 'target': TARGET_COLS, 'shift': [LAT_SHIFT, LON_SHIFT],
+                'match_file_chain': MATCH_FILE_CHAIN})
+    if CHECKPOINT_DIR is None and cache.is_fresh(SOIL_PARAM_OUT, cache_key):
+        print(f"输入未变化，{SOIL_PARAM_OUT.name} 已是最新，跳过。"); exit()
+
+    soil = run_steps(STEPS, CHECKPOINT_DIR, MATCH_FILE_CHAIN, CHECKPOINT_SUFFIX, RESUME_FROM)
+
+    print(f"\n正在写入最终文件: {SOIL_PARAM_OUT.name}")
+    soil.write(SOIL_PARAM_OUT, STEPS[-1][2])
+    cache.record(SOIL_PARAM_OUT, cache_key)
+    print(f"\n所有任务成功完成！共 {len(soil)} 个格网，已生成: {SOIL_PARAM_OUT}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+import os
+import tempfile
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from disaggregation import iter_subdaily_blocks, write_with_subdaily, cell_lat_lon
+from vic_forcing import FORCING_COLUMNS, WRITE_BLOCK_ROWS, convert_to_vic, write_forcing_file
+
+# 次日尺度拆分的回归检查 (不需要任何输入数据):
+# 1. 各种天数 (含只有一天的块，如 1 天的增量追加、天数除以每块天数余 1) 下均匀拆分的结果；
+# 2. process_forcing.py 一次生成日尺度与次日尺度文件 (write_with_subdaily) 的结果，
+#    与 disaggregate_forcing.py 读入日尺度文本文件再拆分的结果是否逐字节相同 (含逐年追加)。
+
+STEPS_PER_DAY = [4, 8, 24]
+N_DAYS = 800
+START_DATE = '1991-01-01'
+UTC_OFFSET = 8
+FILE_NAME = "huai_01dy_025deg_32.1250_116.3750"
+
+
+def synthetic_daily(n_days, rng):
+    """换算后的 (天, 7) float32 日尺度驱动数据。"""
+    raw = {'temp': rng.uniform(250, 310, n_days), 'prec': rng.exponential(2e-5, n_days) * (rng.random(n_days) < 0.4),
+           'pres': rng.uniform(8e4, 1.03e5, n_days), 'srad': rng.uniform(0, 350, n_days),
+           'lrad': rng.uniform(150, 450, n_days), 'shum': rng.uniform(1e-3, 2e-2, n_days),
+           'wind': rng.uniform(0, 10, n_days)}
+    converted = convert_to_vic({k: v.astype(np.float32) for k, v in raw.items()})
+    return np.stack([converted[col] for col in FORCING_COLUMNS], axis=1)
+
+
+def check_uniform(rng):
+    """均匀拆分: 降水除以时段数，其余变量重复日值；块的天数为 1 时也不能出错。"""
+    failed = False
+    prec = FORCING_COLUMNS.index('prec')
+    for steps in STEPS_PER_DAY:
+        block_days = WRITE_BLOCK_ROWS // steps
+        for n_days in (1, 2, block_days + 1, 2 * block_days + 1):
+            for dtype in (np.float32, np.float64):
+                daily = synthetic_daily(n_days, rng).astype(dtype)
+                try:
+                    result = np.concatenate(list(iter_subdaily_blocks(daily, steps)))
+                except Exception as e:
+                    print(f"均匀拆分 {steps} 时段 {n_days} 天 ({np.dtype(dtype).name}): {type(e).__name__}: {e}")
+                    failed = True
+                    continue
+                expected = np.repeat(daily.astype(np.float64), steps, axis=0)
+                expected[:, prec] /= steps
+                if not np.array_equal(result, expected):
+                    print(f"均匀拆分 {steps} 时段 {n_days} 天 ({np.dtype(dtype).name}): 结果不一致")
+                    failed = True
+    print(f"均匀拆分 (含只有一天的块): {'不一致' if failed else '一致'}")
+    return failed
+
+
+def text_disaggregation(daily_path, output_path, steps, method):
+    """disaggregate_forcing.py 的做法: 读入日尺度文本文件再拆分写出。"""
+    daily = pd.read_csv(daily_path, sep='\t', header=None, names=FORCING_COLUMNS, dtype=np.float64).to_numpy()[:, None, :]
+    lat, lon = cell_lat_lon(daily_path)
+    dates = pd.date_range(START_DATE, periods=len(daily), freq='D')
+    blocks = iter_subdaily_blocks(daily, steps, method, np.array([lat]), np.array([lon]), dates, UTC_OFFSET)
+    for b, block in enumerate(blocks):
+        write_forcing_file(output_path, block[:, 0, :], append=b > 0)
+
+
+def check_fused(rng):
+    """write_with_subdaily 一次写出 (最后追加 1 天) 与读入文本文件再拆分的结果比较。"""
+    failed = False
+    daily = synthetic_daily(N_DAYS + 1, rng)
+    for method in ('uniform', 'diurnal'):
+        for steps in STEPS_PER_DAY:
+            with tempfile.TemporaryDirectory() as tmp:
+                tmp = Path(tmp)
+                os.makedirs(tmp / 'sub')
+                path = tmp / FILE_NAME
+                # 先写前 N_DAYS 天，再像增量运行那样追加最后一天
+                for start, stop in ((0, N_DAYS), (N_DAYS, N_DAYS + 1)):
+                    write_with_subdaily(path, daily[start:stop], append=start > 0, subdaily_dir=tmp / 'sub',
+                                        steps_per_day=steps, method=method,
+                                        start_date=str(pd.Timestamp(START_DATE) + pd.Timedelta(days=start)),
+                                        utc_offset=UTC_OFFSET)
+                text_disaggregation(path, tmp / 'expected', steps, method)
+                ok = (tmp / 'sub' / FILE_NAME).read_bytes() == (tmp / 'expected').read_bytes()
+                failed |= not ok
+                print(f"一次生成 ({method}, {steps} 时段): {'一致' if ok else '不一致'}")
+    return failed
+
+
+def main():
+    rng = np.random.default_rng(0)
+    failed = check_uniform(rng)
+    failed |= check_fused(rng)
+    if failed:
+        exit(1)
+    print("\n次日尺度拆分检查通过。")
+
+
+if __name__ == "__main__":
+    main()
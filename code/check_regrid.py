@@ -0,0 +1,90 @@
+import warnings
+
+import numpy as np
+import xarray as xr
+import geopandas as gpd
+import rioxarray
+from rasterio.enums import Resampling
+from shapely.geometry import Polygon
+
+from regrid import RegridOperator
+
+# 稀疏重采样算子的回归检查 (不需要任何输入数据): 在人工构造的 0.1° 全国格网上，
+# 对若干随机流域比较 RegridOperator 与 forcing.py 原来的 rio.clip + rio.reproject(Resampling.average)，
+# 包括裁剪后范围边缘的格网、纬度递增/递减的源数据、_FillValue 和缺测值。
+# 窗口内有缺测 (NaN) 的格网，rio 路径会把 _FillValue (-9999) 当作数值计入平均，算子则按缺测剔除，
+# 这些格网单独计数，不参与比较。
+
+N_BASINS = 12
+N_STEPS = 4
+RESOLUTION = 0.25
+# float32 数据的允许误差
+TOLERANCE = 1e-5
+
+
+def source_dataset(rng, lat_ascending):
+    lat = np.round(np.arange(25.05, 40.0, 0.1), 2)
+    lon = np.round(np.arange(105.05, 125.0, 0.1), 2)
+    if not lat_ascending:
+        lat = lat[::-1]
+    data = rng.uniform(0, 1, (N_STEPS, len(lat), len(lon))).astype(np.float32)
+    # 随机的缺测块
+    for _ in range(20):
+        r, c = rng.integers(0, len(lat) - 5), rng.integers(0, len(lon) - 5)
+        data[rng.integers(0, N_STEPS), r:r + 5, c:c + 5] = np.nan
+    da = xr.DataArray(data, dims=('time', 'lat', 'lon'),
+                      coords={'time': np.arange(N_STEPS), 'lat': lat, 'lon': lon}, name='v')
+    da.attrs['_FillValue'] = -9999.0
+    return da.to_dataset()
+
+
+def random_basin(rng):
+    """中心随机、顶点按角度排序的多边形 (顶点不落在格网线上)。"""
+    cx, cy = rng.uniform(110, 120), rng.uniform(29, 36)
+    angles = np.sort(rng.uniform(0, 2 * np.pi, 7))
+    radii = rng.uniform(1.0, 3.5, 7)
+    return gpd.GeoDataFrame(geometry=[Polygon(zip(cx + radii * np.cos(angles), cy + radii * np.sin(angles)))],
+                            crs='EPSG:4326')
+
+
+def rio_regrid(ds, basin_gdf):
+    xds = ds.rio.set_spatial_dims('lon', 'lat').rio.write_crs("EPSG:4326")
+    clipped = xds.rio.clip(basin_gdf.geometry.values, basin_gdf.crs, drop=True, all_touched=True)
+    result = clipped.rio.reproject(dst_crs=clipped.rio.crs, resolution=RESOLUTION, resampling=Resampling.average)
+    values = result['v'].values
+    nodata = result['v'].rio.nodata
+    return np.where(values == nodata, np.nan, values) if nodata is not None and not np.isnan(nodata) else values
+
+
+def main():
+    warnings.simplefilter(action='ignore', category=FutureWarning)
+    rng = np.random.default_rng(0)
+    failed = False
+    for i in range(N_BASINS):
+        ds = source_dataset(rng, lat_ascending=bool(i % 2))
+        basin_gdf = random_basin(rng)
+        expected = rio_regrid(ds, basin_gdf)
+        operator = RegridOperator.build(ds['lat'].values, ds['lon'].values, basin_gdf, resolution=RESOLUTION)
+        result = operator.regrid_array(ds['v'].values)
+        if result.shape != expected.shape:
+            print(f"流域 {i + 1}: 输出形状不同 {result.shape} / {expected.shape}")
+            failed = True
+            continue
+        # 窗口内有缺测、且 rio 把 _FillValue 计入平均的格网
+        touches_missing = operator.regrid_array(np.isnan(ds['v'].values).astype(np.float64)) > 0
+        fill_averaged = touches_missing & (expected < -1)
+        compared = ~fill_averaged
+        nan_mismatch = int((np.isnan(result) != np.isnan(expected))[compared].sum())
+        both = compared & ~np.isnan(result) & ~np.isnan(expected)
+        max_diff = float(np.abs(result - expected)[both].max()) if both.any() else 0.0
+        ok = nan_mismatch == 0 and max_diff <= TOLERANCE
+        failed |= not ok
+        print(f"流域 {i + 1}: {result.shape[1]}×{result.shape[2]} 格网, 缺测不一致 {nan_mismatch} 个, "
+              f"最大差值 {max_diff:.2e}, rio 计入 _FillValue 的格网 {int(fill_averaged.sum())} 个 -> {'一致' if ok else '不一致'}")
+    if failed:
+        exit(1)
+    print("\n重采样算子检查通过。")
+
+
+if __name__ == "__main__":
+    main()
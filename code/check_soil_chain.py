@@ -0,0 +1,88 @@
+import tempfile
+from pathlib import Path
+
+import numpy as np
+
+from soil_params import SoilParamTable, SOIL_COLUMNS, ROUNDED_FORMATS
+from build_soil_params import STEPS, LAT_SHIFT, LON_SHIFT, run_steps
+
+# 土壤参数链的回归检查 (不需要任何输入数据): 用一张人工构造的土壤参数表，
+# 比较 fill_parameters10.5.py -> 11 -> 12 逐个脚本写出/读入文件的结果、原脚本的字符串写法，
+# 以及 build_soil_params.py 在内存中执行 (MATCH_FILE_CHAIN = True，含从二进制中间文件继续) 的结果。
+# 表中特意包含按 2 位小数格式化后为整数的值 (如 2345.9999 -> "2346.00")。
+
+# 各列轮流取用的测试值: 整数、普通小数、格式化后进位为整数的小数、负数和 -9999
+TEST_VALUES = [2345.9999, 0.999, 12.5, -0.004, 3.0, -9999.0, 0.125, 99.995, 1.0049999, 7.0]
+N_CELLS = 40
+
+
+def synthetic_table(n_cells=N_CELLS):
+    rng = np.random.default_rng(0)
+    values = rng.choice(TEST_VALUES, size=(n_cells, len(SOIL_COLUMNS)))
+    table = SoilParamTable(values)
+    table['run_cell'] = 1
+    table['gridcel'] = np.arange(1, n_cells + 1)
+    table['lat'] = 30 + rng.integers(0, 100, n_cells) * 0.25 + 0.125
+    table['lon'] = 110 + rng.integers(0, 100, n_cells) * 0.25 + 0.125
+    return table
+
+
+def reference_lines(table):
+    """按原脚本的写法生成 12 的输出: 10.5 逐值 "整数或 2 位小数"，11、12 只改写经纬度、其余字符串原样保留。"""
+    lines = []
+    for row in table.values.tolist():
+        tokens = [str(int(num)) if num == int(num) else f"{num:.2f}" for num in row]
+        tokens[2] = f"{float(tokens[2]):.4f}"
+        tokens[3] = f"{float(tokens[3]):.4f}"
+        tokens[2] = f"{float(tokens[2]) + LAT_SHIFT:.4f}"
+        tokens[3] = f"{float(tokens[3]) + LON_SHIFT:.4f}"
+        lines.append(" ".join(tokens) + "\n")
+    return "".join(lines)
+
+
+def file_chain(table, work_dir):
+    """逐个脚本的做法: 每一步读入上一步写出的文本文件。"""
+    path = table.write(work_dir / "SOIL_PARAM_FINAL.txt", ROUNDED_FORMATS)
+    for name, transform, formats, filename in STEPS[-2:]:
+        soil = transform(SoilParamTable.read(path))
+        path = soil.write(work_dir / filename, formats)
+    return Path(path).read_text()
+
+
+def memory_chain(table, checkpoint_dir=None, checkpoint_suffix=".txt", resume_from=None):
+    steps = [("fill_parameters10.5.py", lambda soil: table.copy(), ROUNDED_FORMATS, "SOIL_PARAM_FINAL.txt")] + STEPS[-2:]
+    soil = run_steps(steps, checkpoint_dir, True, checkpoint_suffix, resume_from)
+    return soil.to_text(steps[-1][2])
+
+
+def main():
+    table = synthetic_table()
+    expected = reference_lines(table)
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        results['逐个脚本 (文本文件)'] = file_chain(table, tmp)
+        results['一体化 (内存)'] = memory_chain(table)
+        memory_chain(table, tmp, ".npz")
+        results['一体化 (从 .npz 中间文件继续)'] = memory_chain(table, tmp, ".npz", STEPS[-2][0])
+        memory_chain(table, tmp, ".txt")
+        results['一体化 (从 .txt 中间文件继续)'] = memory_chain(table, tmp, ".txt", STEPS[-1][0])
+
+    failed = False
+    for name, text in results.items():
+        ok = text == expected
+        failed |= not ok
+        print(f"{name}: {'一致' if ok else '不一致'}")
+        if not ok:
+            for got, want in zip(text.splitlines(), expected.splitlines()):
+                if got != want:
+                    diff = [(i, g, w) for i, (g, w) in enumerate(zip(got.split(), want.split())) if g != w]
+                    print(f"  - 第一处不同 (列号, 结果, 原脚本): {diff[:5]}")
+                    break
+    if failed:
+        exit(1)
+    print("\n土壤参数链检查通过。")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+import os
+from pathlib import Path
+
+import numpy as np
+import xarray as xr
+
+# 逐格网的多年气候统计。forcing.py 每写出一个 _huai.nc 文件 (一个变量的一年)，就用内存中的数据
+# 计算该文件的部分统计量 (和、个数、最小值、最大值，以及可选的离差平方和 M2)，
+# 以文件为单位保存在一个很小的 NetCDF 文件中；各文件的部分统计量按 Chan 等人的并行 Welford 公式合并，
+# 土壤参数步骤由此直接读取多年平均降水和气温，不必再扫描全部年份的数据。
+# 按文件保存部分统计量，因此重新处理某一年时只替换该年的统计量，增量运行的结果与全部重算相同。
+
+STATS = ('sum', 'count', 'min', 'max', 'm2')
+
+
+def partial_stats(ds, variance=True):
+    """数据集中每个变量沿时间维的部分统计量，缺测值不计入。
+
+    返回 {'y': 纬度, 'x': 经度, 'vars': {变量名: {统计量: (y, x) 数组}}}，可在子进程中计算后传回主进程。
+    """
+    stats = {}
+    for var in ds.data_vars:
+        da = ds[var]
+        if 'time' not in da.dims:
+            continue
+        values = da.transpose('time', 'y', 'x').values.astype(np.float64)
+        valid = ~np.isnan(values)
+        count = valid.sum(axis=0)
+        total = np.where(valid, values, 0.0).sum(axis=0)
+        entry = {'sum': total, 'count': count.astype(np.float64),
+                 # fmin/fmax 忽略 NaN，且全为 NaN 时不发出警告
+                 'min': np.fmin.reduce(values, axis=0), 'max': np.fmax.reduce(values, axis=0)}
+        if variance:
+            with np.errstate(invalid='ignore', divide='ignore'):
+                mean = total / count
+            entry['m2'] = np.where(valid, (values - mean) ** 2, 0.0).sum(axis=0)
+        stats[var] = entry
+    return {'y': ds['y'].values, 'x': ds['x'].values, 'vars': stats}
+
+
+def combine_stats(entries):
+    """合并若干部分统计量 (同一变量、同一格网)，返回 {mean, count, min, max[, var]}。"""
+    count = sum(e['count'] for e in entries)
+    total = sum(e['sum'] for e in entries)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = total / count
+        result = {'mean': np.where(count > 0, mean, np.nan), 'count': count,
+                  'min': np.fmin.reduce([e['min'] for e in entries]), 'max': np.fmax.reduce([e['max'] for e in entries])}
+        if all('m2' in e for e in entries):
+            # M2 = Σ M2_i + Σ n_i (mean_i - mean)^2
+            m2 = sum(e['m2'] + e['count'] * (np.where(e['count'] > 0, e['sum'] / e['count'], 0.0) - mean) ** 2
+                     for e in entries)
+            result['var'] = np.where(count > 1, m2 / (count - 1), np.nan)
+    return result
+
+
+class ClimatologyAccumulator:
+    """以 (文件名, 变量) 为单位保存部分统计量的累加器，读写同一个 NetCDF 文件。"""
+
+    def __init__(self, path, variance=True):
+        self.path = Path(path)
+        self.variance = variance
+        self.entries = {}
+        self.coords = None
+        if self.path.exists():
+            with xr.open_dataset(self.path) as ds:
+                self.coords = {'y': ds['y'].values, 'x': ds['x'].values}
+                stats = [s for s in STATS if s in ds]
+                for i, (file_name, var) in enumerate(zip(ds['entry_file'].values, ds['entry_var'].values)):
+                    self.entries[(str(file_name), str(var))] = {s: ds[s].values[i] for s in stats}
+
+    def has(self, file_name):
+        return any(name == file_name for name, _ in self.entries)
+
+    def update(self, file_name, stats):
+        """记入一个文件的部分统计量 (partial_stats 的结果)，替换该文件原有的统计量。"""
+        if self.coords is None:
+            self.coords = {'y': stats['y'], 'x': stats['x']}
+        elif len(stats['y']) != len(self.coords['y']) or len(stats['x']) != len(self.coords['x']):
+            raise ValueError(f"{file_name} 的格网与气候统计文件 {self.path.name} 中的格网不一致。")
+        for var, entry in stats['vars'].items():
+            self.entries[(file_name, var)] = entry
+
+    def update_from_file(self, path):
+        """由已写出的文件计算并记入部分统计量 (用于补齐没有统计量的旧文件)。"""
+        with xr.open_dataset(path) as ds:
+            self.update(Path(path).name, partial_stats(ds, self.variance))
+
+    def retain(self, file_names):
+        """只保留这些文件的统计量 (如年份范围改变后去掉范围外的年份)。"""
+        file_names = set(file_names)
+        self.entries = {key: entry for key, entry in self.entries.items() if key[0] in file_names}
+
+    def save(self):
+        """写出为 NetCDF (先写临时文件再替换，写出中断不会损坏原文件)。"""
+        keys = sorted(self.entries)
+        stats = [s for s in STATS if all(s in self.entries[k] for k in keys)]
+        ds = xr.Dataset(
+            {s: (('entry', 'y', 'x'), np.stack([self.entries[k][s] for k in keys])) for s in stats},
+            coords={'entry_file': ('entry', [k[0] for k in keys]), 'entry_var': ('entry', [k[1] for k in keys]),
+                    'y': self.coords['y'], 'x': self.coords['x']},
+        )
+        tmp_path = self.path.with_name(f"{self.path.stem}.{os.getpid()}.tmp.nc")
+        ds.to_netcdf(tmp_path)
+        os.replace(tmp_path, self.path)
+        return self.path
+
+    def summary(self):
+        """合并所有文件后的多年统计: 变量名为 {变量}_{mean|count|min|max|var|std}，维度 (y, x)。"""
+        result = {}
+        for var in sorted({var for _, var in self.entries}):
+            combined = combine_stats([e for (_, v), e in self.entries.items() if v == var])
+            if 'var' in combined:
+                combined['std'] = np.sqrt(combined['var'])
+            for name, values in combined.items():
+                result[f"{var}_{name}"] = (('y', 'x'), values)
+        return xr.Dataset(result, coords=self.coords)
+
+
+def read_climatology(path):
+    """读取 forcing.py 写出的气候统计文件，返回合并后的多年统计 (见 ClimatologyAccumulator.summary)。"""
+    return ClimatologyAccumulator(path).summary()
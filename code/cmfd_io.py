@@ -0,0 +1,185 @@
+import queue
+import threading
+import traceback
+from contextlib import contextmanager
+
+import numpy as np
+import xarray as xr
+
+from regrid import find_lat_lon
+
+# 默认外扩范围 (度): 两个 0.1° 源像元，保证 all_touched 栅格化时边界像元也在窗口内
+DEFAULT_HALO = 0.2
+
+# --- 归档编码 ---
+# 'plain': 只设置 _FillValue，不压缩、默认分块
+# 'compressed': zlib + shuffle 无损压缩，按 (全部时间, y 块, x 块) 分块，适合逐格网读取整段时间序列
+# 'packed': 在 compressed 的基础上用 scale_factor/add_offset 打包为 int16，误差不超过 PACKING_MAX_ERROR
+ARCHIVE_PROFILES = ('plain', 'compressed', 'packed')
+ARCHIVE_COMPLEVEL = 4
+# 空间方向的块大小 (格网数)；时间方向取整个文件
+ARCHIVE_CHUNK_YX = (16, 16)
+# 打包为 int16 时各变量允许的最大绝对误差 (原始单位)。
+# 取值远小于下游文本文件保留的精度；某个文件的数值范围在该精度下超出 int16 时，该变量改为无损压缩
+PACKING_MAX_ERROR = {
+    'temp': 0.005,      # K
+    'prec': 1e-7,       # kg/m2/s (约 0.0086 mm/day)
+    'pres': 1.0,        # Pa
+    'shum': 1e-6,       # kg/kg
+    'rhum': 0.01,       # %
+    'srad': 0.01,       # W/m2
+    'lrad': 0.01,       # W/m2
+    'wind': 0.001,      # m/s
+}
+_INT16_FILL = -32768
+_INT16_MAX = 32767
+
+
+def _index_window(coord, lo, hi):
+    """返回坐标 (升序或降序均可) 落在 [lo, hi] 内的连续索引切片。"""
+    coord = np.asarray(coord)
+    inside = np.flatnonzero((coord >= lo) & (coord <= hi))
+    if len(inside) == 0:
+        raise ValueError(f"坐标范围 [{coord.min()}, {coord.max()}] 与窗口 [{lo}, {hi}] 没有重叠。")
+    return slice(int(inside[0]), int(inside[-1]) + 1)
+
+
+def subset_to_bounds(ds, bounds, halo=DEFAULT_HALO):
+    """按 (minx, miny, maxx, maxy) 外扩 halo 后截取经纬度窗口 (惰性，不读取数据)。"""
+    minx, miny, maxx, maxy = bounds
+    lat_name, lon_name = find_lat_lon(ds)
+    return ds.isel({
+        lat_name: _index_window(ds[lat_name].values, miny - halo, maxy + halo),
+        lon_name: _index_window(ds[lon_name].values, minx - halo, maxx + halo),
+    })
+
+
+@contextmanager
+def open_basin_window(nc_path, bounds, halo=DEFAULT_HALO, **open_kwargs):
+    """打开 NetCDF 文件，只暴露流域外包矩形 (含 halo) 对应的经纬度窗口。
+
+    xarray 在访问数据时才按索引读取，因此磁盘上只有窗口内的数据块会被读取和解码。
+    """
+    with xr.open_dataset(nc_path, **open_kwargs) as ds:
+        yield subset_to_bounds(ds, bounds, halo)
+
+
+def load_basin_window(nc_path, bounds, halo=DEFAULT_HALO, **open_kwargs):
+    """读取窗口内的数据到内存并关闭文件，供预读取线程使用。"""
+    with open_basin_window(nc_path, bounds, halo, **open_kwargs) as ds:
+        return ds.load()
+
+
+def packing_params(values, max_error):
+    """int16 打包参数 (scale_factor, add_offset)。
+
+    量化误差为 scale_factor / 2 = max_error；数值范围在该精度下放不进 int16 (保留 -32768 作为缺测值)
+    或全部为 NaN 时返回 None。
+    """
+    values = np.asarray(values)
+    finite = values[np.isfinite(values)]
+    if finite.size == 0:
+        return None
+    lo, hi = float(finite.min()), float(finite.max())
+    scale = 2.0 * max_error
+    if (hi - lo) / scale > 2 * _INT16_MAX - 1:
+        return None
+    return np.float32(scale), np.float32((hi + lo) / 2)
+
+
+def archive_encoding(ds, base_encoding, profile='compressed', chunk_yx=ARCHIVE_CHUNK_YX,
+                     complevel=ARCHIVE_COMPLEVEL, max_error=None):
+    """在 base_encoding (如 {变量: {'_FillValue': ...}}) 的基础上生成归档用的 encoding。"""
+    if profile not in ARCHIVE_PROFILES:
+        raise ValueError(f"未知的归档编码 '{profile}'，可选 {ARCHIVE_PROFILES}")
+    if profile == 'plain':
+        return base_encoding
+    max_error = PACKING_MAX_ERROR if max_error is None else max_error
+    encoding = {}
+    for var, enc in base_encoding.items():
+        da = ds[var]
+        chunks = tuple(
+            min(chunk_yx[0], size) if dim in ('y', 'lat', 'latitude') else
+            min(chunk_yx[1], size) if dim in ('x', 'lon', 'longitude') else size
+            for dim, size in zip(da.dims, da.shape)
+        )
+        enc = dict(enc, zlib=True, complevel=complevel, shuffle=True, chunksizes=chunks)
+        if profile == 'packed' and var in max_error:
+            params = packing_params(da.values, max_error[var])
+            if params is not None:
+                enc.update(dtype='int16', scale_factor=params[0], add_offset=params[1], _FillValue=np.int16(_INT16_FILL))
+        encoding[var] = enc
+    return encoding
+
+
+def prefetch(items, load, depth=2):
+    """在后台线程中按顺序执行 load(item)，最多提前缓存 depth 个结果。
+
+    逐个产出 (item, result, error)；load 抛出的异常不会中断迭代，而是放在 error 中返回。
+    """
+    buffer = queue.Queue(maxsize=max(depth, 1))
+    stop = threading.Event()
+    done = object()
+
+    def producer():
+        for item in items:
+            if stop.is_set():
+                break
+            try:
+                result, error = load(item), None
+            except Exception as e:
+                result, error = None, e
+            buffer.put((item, result, error))
+        buffer.put(done)
+
+    thread = threading.Thread(target=producer, name="cmfd-prefetch", daemon=True)
+    thread.start()
+    try:
+        while True:
+            entry = buffer.get()
+            if entry is done:
+                break
+            yield entry
+    finally:
+        # 消费者提前退出时，通知生产者停止并清空队列使其不再阻塞
+        stop.set()
+        while thread.is_alive():
+            try:
+                buffer.get(timeout=0.1)
+            except queue.Empty:
+                pass
+
+
+class BackgroundWriter:
+    """后台写出线程。submit() 在队列满 (depth 个待写任务) 时阻塞，以限制内存。
+
+    写出或写完后的回调 on_done 出错时，记入 errors 并继续处理后面的任务，线程只在 close() 时退出。
+    """
+
+    def __init__(self, depth=2):
+        self._queue = queue.Queue(maxsize=max(depth, 1))
+        self.errors = []
+        self._thread = threading.Thread(target=self._run, name="cmfd-writer", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            task = self._queue.get()
+            if task is None:
+                break
+            key, write, on_done = task
+            try:
+                result = write()
+                if on_done is not None:
+                    on_done(key, result)
+            except Exception as e:
+                self.errors.append((key, e, traceback.format_exc()))
+
+    def submit(self, key, write, on_done=None):
+        self._queue.put((key, write, on_done))
+
+    def close(self):
+        """等待所有待写任务完成，返回写出失败的 (key, 异常, 堆栈) 列表。"""
+        self._queue.put(None)
+        self._thread.join()
+        return self.errors
@@ -4,6 +4,9 @@ from pathlib import Path
 import os
 import numpy as np
 import warnings
+from artifact_cache import ArtifactCache, MANIFEST_NAME
+from vic_forcing import FORCING_COLUMNS, write_forcing_file
+from disaggregation import iter_subdaily_blocks, cell_lat_lon
 
 # --- 0. Ignore unnecessary warnings ---
 warnings.filterwarnings("ignore", category=FutureWarning)
@@ -13,44 +16,79 @@ warnings.filterwarnings("ignore", category=FutureWarning)
 DAILY_FORCING_DIR = Path(r"C:\Users\yc\Desktop\vic\huaihe\F_F\vic\forcing")
 # OUTPUT: New folder for the 6-hourly forcing files
 SUBDAILY_FORCING_DIR = Path(r"C:\Users\yc\Desktop\vic\huaihe\F_F\vic\forcing_6H")
+# Name prefix of the daily forcing files (as written by process_forcing.py, followed by lat_lon)
+FILE_PREFIX = "huai_01dy_025deg_"
+# Sub-daily steps per day (4 = 6-hourly)
+STEPS_PER_DAY = 4
+# 'uniform': split precipitation evenly and keep the daily value of every other variable
+# 'diurnal': MTCLIM-style diurnal cycles of shortwave, air temperature and longwave (disaggregation.diurnal_forcing)
+METHOD = 'uniform'
+# Date of the first row of the daily files (needed by 'diurnal' for the solar geometry)
+START_DATE = '1991-01-01'
+# Time zone of the forcing time steps relative to UTC in hours; None = local solar time (off_gmt = lon / 15)
+UTC_OFFSET = None
+# 'diurnal' processes this many cells at once as one (day, cell, 7) array
+CELL_BATCH = 32
+# Note: process_forcing.py can write these files directly from its in-memory daily data
+# (SUBDAILY_STEPS_PER_DAY), without re-reading the text files; this script is for existing daily files.
 
 # --- 2. Setup ---
-print("Starting script to convert daily data to 6-hourly...")
+print(f"Starting script to convert daily data to {24 // STEPS_PER_DAY}-hourly...")
 if not DAILY_FORCING_DIR.exists():
     print(f"ERROR: Daily forcing directory not found at {DAILY_FORCING_DIR}"); exit()
 os.makedirs(SUBDAILY_FORCING_DIR, exist_ok=True)
-daily_files = list(DAILY_FORCING_DIR.glob("*"))
+# Only the forcing files themselves; the manifest, logs and global-parameter snippets in the folder are skipped
+daily_files = sorted(f for f in DAILY_FORCING_DIR.glob(f"{FILE_PREFIX}*") if f.is_file())
 print(f"Found {len(daily_files)} daily files to process...")
+# Manifest of finished outputs: unchanged inputs are skipped and an interrupted run resumes
+cache = ArtifactCache(SUBDAILY_FORCING_DIR / MANIFEST_NAME)
+script_key = cache.fingerprint(Path(__file__))
+n_skipped = 0
 
-# --- 3. Loop through each file ---
-for i, daily_file in enumerate(daily_files):
-    print(f"  ({i+1}/{len(daily_files)}) Processing: {daily_file.name}")
-    
-    # Read daily data
-    df_daily = pd.read_csv(daily_file, sep='\t', header=None)
-    df_daily.columns = ['air_temp', 'prec', 'pressure', 'swdown', 'lwdown', 'vp', 'wind']
+# --- 3. Find the files that need (re)processing ---
+jobs = []
+for daily_file in daily_files:
+    output_path = SUBDAILY_FORCING_DIR / daily_file.name
+    cache_key = cache.key(inputs=[daily_file], config={'script': script_key, 'steps_per_day': STEPS_PER_DAY,
+                                                       'method': METHOD, 'start': START_DATE, 'utc_offset': UTC_OFFSET})
+    if cache.is_fresh(output_path, cache_key):
+        n_skipped += 1
+        continue
+    jobs.append((daily_file, output_path, cache_key))
 
-    # Create an empty DataFrame for the new 6-hourly data
-    df_subdaily = pd.DataFrame(index=np.arange(len(df_daily) * 4), columns=df_daily.columns)
+# --- 4. Disaggregate and write, CELL_BATCH files at a time ---
+batch_size = CELL_BATCH if METHOD == 'diurnal' else 1
+for b0 in range(0, len(jobs), batch_size):
+    batch = jobs[b0:b0 + batch_size]
+    for k, (daily_file, _, _) in enumerate(batch):
+        print(f"  ({b0+k+1}/{len(jobs)}) Processing: {daily_file.name}")
     
-    # --- 4. Disaggregate data and convert units ---
-    # Air Temperature: Keep the daily value for all 4 sub-daily steps
-    df_subdaily['air_temp'] = np.repeat(df_daily['air_temp'].values, 4)
-    # Precipitation: Distribute the daily total evenly across the 4 time steps
-    df_subdaily['prec'] = np.repeat(df_daily['prec'].values, 4) / 4.0
-    # Pressure: Keep the daily value
-    df_subdaily['pressure'] = np.repeat(df_daily['pressure'].values, 4)
-    # Shortwave/Longwave Radiation: Assume constant flux density throughout the day
-    df_subdaily['swdown'] = np.repeat(df_daily['swdown'].values, 4)
-    df_subdaily['lwdown'] = np.repeat(df_daily['lwdown'].values, 4)
-    # Vapor Pressure: Keep the daily value
-    df_subdaily['vp'] = np.repeat(df_daily['vp'].values, 4)
-    # Wind Speed: Keep the daily value
-    df_subdaily['wind'] = np.repeat(df_daily['wind'].values, 4)
+    # Read daily data straight into float64 arrays (columns in FORCING_COLUMNS order)
+    daily = [pd.read_csv(f, sep='\t', header=None, names=FORCING_COLUMNS, dtype=np.float64).to_numpy() for f, _, _ in batch]
     
-    # --- 5. Write the new 6-hourly file ---
-    output_path = SUBDAILY_FORCING_DIR / daily_file.name
-    df_subdaily.to_csv(output_path, sep='\t', header=False, index=False, float_format='%.4f')
+    if len({len(d) for d in daily}) > 1:
+        print(f"ERROR: Daily files in this batch have different lengths: {[f.name for f, _, _ in batch]}"); exit()
+    daily = np.stack(daily, axis=1)
+    lats = lons = dates = None
+    if METHOD == 'diurnal':
+        # Shortwave follows the sun, air temperature and longwave get a diurnal cycle, daily means are kept;
+        # the whole batch is computed as one (day, cell, 7) array
+        lats, lons = np.array([cell_lat_lon(f) for f, _, _ in batch]).T
+        dates = pd.date_range(START_DATE, periods=len(daily), freq='D')
+    # 'uniform': precipitation is distributed evenly across the sub-daily steps; temperature, pressure,
+    # radiation (constant flux density), vapor pressure and wind keep the daily value (a broadcast view, no copy)
+    blocks = iter_subdaily_blocks(daily, STEPS_PER_DAY, METHOD, lats, lons, dates, UTC_OFFSET)
+    
+    # --- 5. Write the new sub-daily files ---
+    # Rows are materialized and appended one block of days at a time, so even 1-hourly output
+    # never holds more than one block in memory. Same bytes as to_csv(sep='\t', float_format='%.4f')
+    for b, block in enumerate(blocks):
+        for k, (_, output_path, _) in enumerate(batch):
+            write_forcing_file(output_path, block[:, k, :], append=b > 0)
+    for _, output_path, cache_key in batch:
+        cache.record(output_path, cache_key)
 
 print("\nData disaggregation complete!")
-print(f"Generated {len(daily_files)} 6-hourly forcing files in: '{SUBDAILY_FORCING_DIR}'")
\ No newline at end of file
+if n_skipped:
+    print(f"Skipped {n_skipped} files whose inputs were unchanged.")
+print(f"Generated {len(daily_files)} {24 // STEPS_PER_DAY}-hourly forcing files in: '{SUBDAILY_FORCING_DIR}'")
\ No newline at end of file
@@ -0,0 +1,232 @@
+import os
+import re
+
+import numpy as np
+import pandas as pd
+
+from vic_forcing import FLOAT_FORMAT, FORCING_COLUMNS, WRITE_BLOCK_ROWS, write_forcing_file
+
+# 太阳常数 (W/m²)
+SOLAR_CONSTANT = 1367.0
+# 由大气透射率反推气温日较差的 Bristow-Campbell 系数: Tt = A * (1 - exp(-B * ΔT ** C))
+BRISTOW_CAMPBELL = (0.75, 0.006, 2.4)
+# 气温日较差的取值范围 (°C)
+DTR_RANGE = (2.0, 20.0)
+# 最高气温出现在日出后白昼长度的该比例处 (与 VIC 相同)，最低气温出现在日出
+TMAX_DAYLIGHT_FRACTION = 0.67
+# 计算日变化曲线时每小时的采样点数，每个时段取其中各点的平均值
+SAMPLES_PER_HOUR = 2
+
+# 各变量在 (时间, 格网, 7) 数组最后一维中的位置
+_COL = {col: k for k, col in enumerate(FORCING_COLUMNS)}
+# 驱动文件名末尾的 纬度_经度
+_LATLON_PATTERN = re.compile(r'_(-?\d+(?:\.\d+)?)_(-?\d+(?:\.\d+)?)$')
+
+
+def subdaily_view(daily, steps_per_day=4):
+    """日尺度数组 (天, ..., 7) 的 (天, 时段, ..., 7) 广播视图，不复制数据。
+
+    一天内各时段共用同一行日值 (降水尚未除以时段数，由 materialize_steps 在展开时完成)，
+    因此无论是 6 小时还是 1 小时，内存都只有日尺度数据本身。
+    """
+    daily = np.asarray(daily)
+    return np.broadcast_to(daily[:, None], (daily.shape[0], steps_per_day) + daily.shape[1:])
+
+
+def materialize_steps(view):
+    """把 (天, 时段, ..., 7) 视图的一段展开为 (天 × 时段, ..., 7) 的 float64 数组。
+
+    与 disaggregate_forcing.py 原来的做法相同: 降水平均分配到各时段，其余变量在一天内保持日值，以 float64 计算。
+    结果只取决于传入的日值；要与由日尺度文本文件读入再拆分的结果相同，日值须先经过 as_written。
+    """
+    steps_per_day = view.shape[1]
+    # 总是复制: 日值已是 float64 时 asarray 不复制，只有一天的块 reshape 后仍是只读的广播视图
+    block = np.array(view, dtype=np.float64).reshape((-1,) + view.shape[2:])
+    block[..., _COL['prec']] /= steps_per_day
+    return block
+
+
+def as_written(data, float_format=FLOAT_FORMAT):
+    """data 按 float_format 写为文本再读入后的 float64 数组 (即日尺度文本文件中的值)。"""
+    data = np.asarray(data, dtype=np.float64)
+    text = ' '.join([float_format] * data.size) % tuple(data.ravel().tolist())
+    return np.array(text.split(), dtype=np.float64).reshape(data.shape)
+
+
+def iter_subdaily_blocks(daily, steps_per_day=4, method='uniform', lats=None, lons=None, dates=None,
+                         utc_offset=None, block_rows=WRITE_BLOCK_ROWS):
+    """按天分块产出次日尺度数据 (天数 × steps_per_day 行, ..., 7)，每块约 block_rows 行。
+
+    daily 为 (天, 7) 或 (天, 格网, 7)。'uniform' 从广播视图中逐块展开，'diurnal' 逐块调用 diurnal_forcing
+    (各天的计算相互独立)。任一时刻只有一块的次日尺度数据在内存中，逐块追加写出即可生成很长的逐时序列。
+    """
+    n_day = len(daily)
+    block_days = max(1, block_rows // steps_per_day)
+    view = subdaily_view(daily, steps_per_day) if method == 'uniform' else None
+    for d0 in range(0, n_day, block_days):
+        d1 = min(d0 + block_days, n_day)
+        if view is not None:
+            yield materialize_steps(view[d0:d1])
+        else:
+            yield diurnal_forcing(daily[d0:d1], lats, lons, dates[d0:d1], steps_per_day, utc_offset=utc_offset)
+
+
+def cell_lat_lon(path):
+    """由驱动文件名 (前缀_纬度_经度) 得到 (纬度, 经度)。"""
+    match = _LATLON_PATTERN.search(os.path.basename(path))
+    if match is None:
+        raise ValueError(f"无法从文件名 '{os.path.basename(path)}' 中解析出纬度和经度。")
+    return float(match.group(1)), float(match.group(2))
+
+
+def solar_geometry(lats, doy, solar_hours):
+    """太阳天顶角余弦 (夜间为 0) 及日出时刻和白昼长度 (小时)。
+
+    lats 形状为 (格网,)，doy 为年积日 (天,)，solar_hours 为地方太阳时 (可广播为 (天, 采样, 格网))。
+    返回的余弦形状为 (天, 采样, 格网)，日出时刻和白昼长度形状为 (天, 1, 格网)。
+    """
+    lat = np.radians(np.asarray(lats, dtype=np.float64))[None, None, :]
+    gamma = (2 * np.pi * (np.asarray(doy, dtype=np.float64) - 1) / 365)[:, None, None]
+    # Spencer (1971) 赤纬公式
+    dec = (0.006918 - 0.399912 * np.cos(gamma) + 0.070257 * np.sin(gamma) - 0.006758 * np.cos(2 * gamma)
+           + 0.000907 * np.sin(2 * gamma) - 0.002697 * np.cos(3 * gamma) + 0.00148 * np.sin(3 * gamma))
+    hour_angle = np.radians(15.0 * (solar_hours - 12.0))
+    cos_zenith = np.sin(lat) * np.sin(dec) + np.cos(lat) * np.cos(dec) * np.cos(hour_angle)
+    sunset_angle = np.arccos(np.clip(-np.tan(lat) * np.tan(dec), -1.0, 1.0))
+    day_length = 2 * np.degrees(sunset_angle) / 15.0
+    return np.maximum(cos_zenith, 0.0), 12.0 - day_length / 2, day_length
+
+
+def estimate_dtr(swdown, potential, coefficients=BRISTOW_CAMPBELL, dtr_range=DTR_RANGE):
+    """由大气透射率 (日均短波 / 日均天文辐射) 反推气温日较差 (Bristow-Campbell 公式的反函数)。
+
+    CMFD 只提供日均气温，没有最高、最低气温；晴天透射率高、日较差大，阴雨天反之。
+    """
+    a, b, c = coefficients
+    with np.errstate(divide='ignore', invalid='ignore'):
+        transmittance = np.where(potential > 0, swdown / potential, 0.0)
+        ratio = np.clip(transmittance / a, 0.0, 0.99)
+        dtr = (-np.log1p(-ratio) / b) ** (1.0 / c)
+    return np.clip(dtr, *dtr_range)
+
+
+def diurnal_forcing(daily, lats, lons, dates, steps_per_day=4, utc_offset=None, dtr=None,
+                    samples_per_hour=SAMPLES_PER_HOUR):
+    """MTCLIM 式的日内分配: 由日均值生成带日变化的次日尺度驱动数据。
+
+    daily 为 (天, 格网, 7) 数组 (列顺序为 FORCING_COLUMNS)，也可以是单个格网的 (天, 7)；
+    lats/lons 为各格网中心坐标，dates 为每天的日期。整个计算在 (天, 采样, 格网) 数组上完成，不逐格网循环。
+
+    - 短波辐射: 按太阳天顶角余弦在一天内的分布分配，日均值不变；
+    - 气温: 最低气温在日出，最高气温在日出后白昼的 TMAX_DAYLIGHT_FRACTION 处，两段余弦曲线相连，
+      日较差 dtr 未给出时由 estimate_dtr 估算，之后整体平移使日均值不变；
+    - 长波辐射: 按 (T + 273.15)^4 随气温变化 (发射率在一天内不变)，日均值不变；
+    - 降水平均分配到各时段，气压、水汽压、风速保持日值。
+
+    utc_offset 为驱动文件时间相对 UTC 的时区 (小时)；None 表示时间为各格网的地方太阳时
+    (即 VIC 土壤参数中 off_gmt = 经度 / 15 时的约定)。
+    返回 (天 × steps_per_day, 格网, 7) 的 float64 数组 (输入为 (天, 7) 时返回 (天 × steps_per_day, 7))。
+    """
+    daily = np.asarray(daily, dtype=np.float64)
+    single = daily.ndim == 2
+    if single:
+        daily = daily[:, None, :]
+    lats = np.atleast_1d(np.asarray(lats, dtype=np.float64))
+    lons = np.atleast_1d(np.asarray(lons, dtype=np.float64))
+    n_day, n_cell, _ = daily.shape
+    n_sample = 24 * samples_per_hour
+    if 24 % steps_per_day or n_sample % steps_per_day:
+        raise ValueError(f"steps_per_day={steps_per_day} 必须能整除 24。")
+
+    # --- 采样点的地方太阳时 (天, 采样, 格网) ---
+    clock_hours = ((np.arange(n_sample) + 0.5) / samples_per_hour)[None, :, None]
+    solar_hours = clock_hours if utc_offset is None else clock_hours - utc_offset + lons[None, None, :] / 15.0
+    doy = pd.DatetimeIndex(dates).dayofyear.values
+    cos_zenith, sunrise, day_length = solar_geometry(lats, doy, solar_hours)
+
+    # --- 短波辐射 ---
+    mean_cos = cos_zenith.mean(axis=1, keepdims=True)
+    swdown = daily[:, None, :, _COL['swdown']]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        sw = np.where(mean_cos > 0, swdown * cos_zenith / mean_cos, swdown)
+
+    # --- 气温 ---
+    if dtr is None:
+        eccentricity = 1 + 0.033 * np.cos(2 * np.pi * doy / 365)
+        potential = SOLAR_CONSTANT * eccentricity[:, None] * mean_cos[:, 0, :]
+        dtr = estimate_dtr(daily[:, :, _COL['swdown']], potential)
+    dtr = np.broadcast_to(np.asarray(dtr, dtype=np.float64), (n_day, n_cell))[:, None, :]
+    rise_to_max = np.clip(TMAX_DAYLIGHT_FRACTION * day_length, 1.0, 23.0)
+    since_sunrise = np.mod(solar_hours - sunrise, 24.0)
+    warming = (1 - np.cos(np.pi * since_sunrise / rise_to_max)) / 2
+    cooling = 1 - (1 - np.cos(np.pi * (since_sunrise - rise_to_max) / (24.0 - rise_to_max))) / 2
+    temp = dtr * np.where(since_sunrise < rise_to_max, warming, cooling)
+    temp += daily[:, None, :, _COL['air_temp']] - temp.mean(axis=1, keepdims=True)
+
+    # --- 长波辐射 ---
+    emission = (temp + 273.15) ** 4
+    lw = daily[:, None, :, _COL['lwdown']] * emission / emission.mean(axis=1, keepdims=True)
+
+    # --- 汇总到各时段 ---
+    def step_mean(samples):
+        return samples.reshape(n_day, steps_per_day, -1, n_cell).mean(axis=2).reshape(n_day * steps_per_day, n_cell)
+
+    subdaily = np.repeat(daily, steps_per_day, axis=0)
+    subdaily[:, :, _COL['prec']] /= steps_per_day
+    subdaily[:, :, _COL['air_temp']] = step_mean(temp)
+    subdaily[:, :, _COL['swdown']] = step_mean(sw)
+    subdaily[:, :, _COL['lwdown']] = step_mean(lw)
+    return subdaily[:, 0, :] if single else subdaily
+
+
+def daily_from_subdaily(data, steps_per_day):
+    """把 (天 × steps_per_day, ..., 7) 的次日尺度驱动数据汇总为 (天, ..., 7) 的日尺度数据。
+
+    降水为各时段累计量之和 (mm/day)，其余变量取日平均；data 须从一天的第一个时段开始、包含整天。
+    """
+    data = np.asarray(data, dtype=np.float64)
+    if len(data) % steps_per_day:
+        raise ValueError(f"次日尺度数据的行数 ({len(data)}) 不是每天时段数 ({steps_per_day}) 的整数倍。")
+    days = data.reshape((-1, steps_per_day) + data.shape[1:])
+    daily = days.mean(axis=1)
+    daily[..., _COL['prec']] = days[..., _COL['prec']].sum(axis=1)
+    return daily
+
+
+def write_with_daily(path, data, append=False, writer=write_forcing_file, daily_dir=None, steps_per_day=8,
+                     rename=None):
+    """写出次日尺度驱动文件，并把同一份内存中的数据汇总为日尺度写入 daily_dir。
+
+    rename 为 (原前缀, 新前缀)，用于把文件名中的时间尺度标识换成日尺度 (如 huai_03hr_ -> huai_01dy_)。
+    输入只读取一次即同时得到两种时间尺度的驱动文件。
+    """
+    writer(path, data, append=append)
+    name = os.path.basename(path)
+    if rename is not None:
+        name = name.replace(rename[0], rename[1], 1)
+    writer(os.path.join(daily_dir, name), daily_from_subdaily(data, steps_per_day), append=append)
+    return path
+
+
+def write_with_subdaily(path, data, append=False, writer=write_forcing_file, subdaily_dir=None, steps_per_day=4,
+                        method='uniform', start_date=None, utc_offset=None):
+    """写出日尺度驱动文件，并把同一份内存中的数据拆分后写入 subdaily_dir 下的同名文件。
+
+    method 为 'uniform' (日值的广播视图) 或 'diurnal' (diurnal_forcing，格网坐标由文件名得到，
+    start_date 为 data 第一天的日期)。日尺度与次日尺度文件一次生成，不再重新读取文本文件；
+    次日尺度数据按行块展开并逐块写出，不会一次生成 时段数 倍大小的数组。
+    写出文本文件时，拆分的是按 '%.4f' 写出的日值，结果与 disaggregate_forcing.py 读入日尺度文件再拆分时逐字节相同。
+    """
+    writer(path, data, append=append)
+    if writer is write_forcing_file:
+        data = as_written(data)
+    lat = lon = dates = None
+    if method == 'diurnal':
+        lat, lon = cell_lat_lon(path)
+        dates = pd.date_range(start_date, periods=len(data), freq='D')
+    subdaily_path = os.path.join(subdaily_dir, os.path.basename(path))
+    blocks = iter_subdaily_blocks(data, steps_per_day, method, lat, lon, dates, utc_offset)
+    for b, block in enumerate(blocks):
+        # 第一块按 append 新建或追加，之后的块接在末尾
+        writer(subdaily_path, block, append=append or b > 0)
+    return path
@@ -1,6 +1,5 @@
 import xarray as xr
 import pandas as pd
-import numpy as np
 from pathlib import Path
 import os
 import geopandas as gpd
@@ -8,7 +7,9 @@ from shapely.geometry import box
 from rasterstats import zonal_stats
 import warnings
 import rioxarray
-from rasterio.enums import Resampling
+from artifact_cache import ArtifactCache, MANIFEST_NAME
+from soil_params import SoilParamTable
+from soil_steps import fill_elevation
 
 # --- 0. 忽略良性的库警告 ---
 warnings.filterwarnings("ignore", category=FutureWarning)
@@ -28,6 +29,11 @@ VEG_PARAM_OUT = OUTPUT_DIR / "veg_param_final.txt"
 # --- 3. 准备工作 ---
 os.makedirs(OUTPUT_DIR, exist_ok=True)
 print("最终一体化脚本处理开始...")
+# --- 增量缓存: 输入文件、本脚本都未变化且两个输出都存在时直接跳过 ---
+cache = ArtifactCache(OUTPUT_DIR / MANIFEST_NAME)
+cache_key = cache.key(inputs=[MASTER_GRID_NC, ELEV_NC_IN, VEG_RASTER_IN, VEGLIB_FILE, Path(__file__), Path(__file__).with_name('soil_steps.py')])
+if cache.is_fresh(SOIL_PARAM_OUT, cache_key) and cache.is_fresh(VEG_PARAM_OUT, cache_key):
+    print(f"输入未变化，{SOIL_PARAM_OUT.name} 和 {VEG_PARAM_OUT.name} 已是最新，跳过。"); exit()
 
 # --- 4. 定义最终的“主格网” ---
 print(f"正在从 {MASTER_GRID_NC.name} 定义主格网...")
@@ -48,49 +54,18 @@ print(f"主格网已确定！有效单元格数量为: {num_final_cells}。")
 
 # --- 5. 生成并填充土壤参数文件 ---
 print("\n--- 正在生成并填充土壤参数文件 ---")
-# 5.1 创建土壤参数文件框架
-df_soil = pd.DataFrame(np.full((num_final_cells, 53), -9999.0))
-df_soil.columns = [f'col_{i}' for i in range(df_soil.shape[1])]
-# 5.2 填充基础信息
-df_soil.iloc[:, 0] = 1
-df_soil.iloc[:, 1] = np.arange(1, num_final_cells + 1)
-df_soil.iloc[:, 2] = lats
-df_soil.iloc[:, 3] = lons
+# 5.1 创建土壤参数文件框架并填充基础信息 (运行标志、网格号、经纬度)
+soil = SoilParamTable.new(lats, lons)
 
 # 5.3 使用区域平均重采样填充高程值
 print("正在使用区域平均重采样方法计算高程值...")
-with xr.open_dataset(ELEV_NC_IN) as ds_elev_raw, xr.open_dataset(MASTER_GRID_NC) as ds_template:
-    # 再次为模板指定CRS
-    ds_template = ds_template.rio.write_crs("EPSG:4326")
-    
-    elev_var = list(ds_elev_raw.data_vars)[0]
-    ds_elev_raw = ds_elev_raw.rio.write_crs("EPSG:4326")
-    
-    reprojected_elev = ds_elev_raw[elev_var].rio.reproject_match(ds_template, resampling=Resampling.average)
-    
-    lats_to_find = xr.DataArray(lats, dims="points")
-    lons_to_find = xr.DataArray(lons, dims="points")
-    elev_values = reprojected_elev.sel(y=lats_to_find, x=lons_to_find, method='nearest')
-    elev_values_filled = elev_values.fillna(0.0)
-    
-    df_soil.iloc[:, 21] = elev_values_filled.values
+fill_elevation(soil, ELEV_NC_IN, MASTER_GRID_NC)
 print("高程值填充完毕！")
 
-# 5.4 按精确格式写入土壤参数文件
+# 5.4 按精确格式写入土壤参数文件 (经纬度4位小数，高程2位小数，其余整数或3位小数)
 print(f"正在写入最终土壤参数文件: {SOIL_PARAM_OUT.name}")
-df_soil_to_write = df_soil.astype(object)
-with open(SOIL_PARAM_OUT, 'w') as f:
-    for index, row in df_soil_to_write.iterrows():
-        formatted_items = []
-        for i, item in enumerate(row):
-            if i in [0, 1]: formatted_items.append(str(int(item)))
-            elif i in [2, 3]: formatted_items.append(f"{float(item):.4f}")
-            elif i == 21: formatted_items.append(f"{float(item):.2f}")
-            else:
-                if pd.isna(item) or item == -9999.0: formatted_items.append('-9999')
-                elif item == int(item): formatted_items.append(str(int(item)))
-                else: formatted_items.append(f"{float(item):.3f}")
-        f.write(" ".join(formatted_items) + "\n")
+soil.write(SOIL_PARAM_OUT)
+cache.record(SOIL_PARAM_OUT, cache_key)
 print("土壤参数文件生成成功！")
 
 
@@ -158,6 +133,7 @@ for index, row in stats_gdf.iterrows():
 # 6.4 写入文件
 if output_lines:
     with open(VEG_PARAM_OUT, 'w') as f: f.write("\n".join(output_lines) + "\n")
+    cache.record(VEG_PARAM_OUT, cache_key)
     print(f"植被参数文件生成成功！共为 {len(output_lines)} 个格网生成了参数。")
 else:
     print("未能生成任何有效的植被参数。")
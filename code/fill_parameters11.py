@@ -1,6 +1,7 @@
-import pandas as pd
 from pathlib import Path
 import os
+from artifact_cache import ArtifactCache, MANIFEST_NAME
+from soil_params import SoilParamTable, FINAL_FORMATS
 
 # --- 1. 配置路径 ---
 # 输入文件：您需要修改的土壤参数文件
@@ -15,23 +16,24 @@ if not SOIL_PARAM_IN.exists():
     print(f"错误: 找不到输入文件 {SOIL_PARAM_IN}")
     exit()
 os.makedirs(SOIL_PARAM_OUT.parent, exist_ok=True)
+# --- 增量缓存: 输入文件、本脚本和配置都未变化时直接跳过 ---
+cache = ArtifactCache(SOIL_PARAM_OUT.parent / MANIFEST_NAME)
+cache_key = cache.key(inputs=[SOIL_PARAM_IN, Path(__file__)])
+if cache.is_fresh(SOIL_PARAM_OUT, cache_key):
+    print(f"输入未变化，{SOIL_PARAM_OUT.name} 已是最新，跳过。"); exit()
 
 # --- 3. 读取、格式化并保存文件 ---
 try:
-    # **关键步骤**: 使用 dtype=object 读取所有数据为字符串，以保留原始格式
     print(f"正在读取文件: {SOIL_PARAM_IN.name}")
-    df_soil = pd.read_csv(SOIL_PARAM_IN, sep=' ', header=None, dtype=object, skip_blank_lines=False)
+    soil = SoilParamTable.read(SOIL_PARAM_IN)
 
-    # 对第3列（纬度，索引为2）和第4列（经度，索引为3）进行格式化
-    # .map() 方法可以对列中的每一个元素应用格式化函数
+    # 第3列（纬度）和第4列（经度）格式化为四位小数，
+    # 其余列与上一步 (fill_parameters10.5.py) 相同: 整数值写成整数，否则保留2位小数
     print("正在格式化第3列 (纬度) 和第4列 (经度) 为四位小数...")
-    df_soil.iloc[:, 2] = df_soil.iloc[:, 2].astype(float).map('{:.4f}'.format)
-    df_soil.iloc[:, 3] = df_soil.iloc[:, 3].astype(float).map('{:.4f}'.format)
-    
-    # **关键步骤**: 将修改后的DataFrame写回文本文件，保持空格分隔，不加表头和索引
     print(f"正在将结果保存到新文件: {SOIL_PARAM_OUT.name}")
-    df_soil.to_csv(SOIL_PARAM_OUT, sep=' ', header=False, index=False, quotechar='"', lineterminator='\n')
+    soil.write(SOIL_PARAM_OUT, FINAL_FORMATS)
     
+    cache.record(SOIL_PARAM_OUT, cache_key)
     print("\n操作成功完成！")
     print(f"已生成格式化后的新文件: {SOIL_PARAM_OUT}")
 
@@ -1,6 +1,7 @@
-import pandas as pd
 from pathlib import Path
 import os
+from artifact_cache import ArtifactCache, MANIFEST_NAME
+from soil_params import SoilParamTable, SOIL_FORMATS, column_formats
 
 # --- 1. 配置路径 ---
 # 输入文件：您已经填充好高程的土壤参数文件
@@ -10,20 +11,14 @@ SOIL_PARAM_IN = Path(r"C:\Users\yc\Desktop\vic\huaihe\F_F\vic\param\soil_param_f
 SOIL_PARAM_OUT = Path(r"C:\Users\yc\Desktop\vic\huaihe\F_F\vic\param\soil_param_with_constants.txt")
 
 # --- 2. 定义要填充的常量值 ---
-# {列索引: 要填充的值}
-# 第23列(索引22) -> Depth(1)
-# 第24列(索引23) -> Depth(2)
-# 第25列(索引24) -> Depth(3)
-# 第27列(索引26) -> Dp
-# 第40列(索引39) -> Off_gmt
-# 第53列(索引52) -> Fs_active
+# {列名: 要填充的值}，列名见 soil_params.SOIL_COLUMNS
 CONSTANTS_TO_FILL = {
-    22: 0.1,
-    23: 1.0,
-    24: 1.5,
-    26: 3.0,
-    39: 8,
-    52: 1
+    'depth_1': 0.1,     # 第23列: Depth(1)
+    'depth_2': 1.0,     # 第24列: Depth(2)
+    'depth_3': 1.5,     # 第25列: Depth(3)
+    'dp': 3.0,          # 第27列: Dp
+    'off_gmt': 8,       # 第40列: Off_gmt
+    'fs_active': 1,     # 第53列: Fs_active
 }
 
 # --- 3. 准备工作 ---
@@ -31,45 +26,29 @@ print("处理开始...")
 if not SOIL_PARAM_IN.exists():
     print(f"错误: 找不到输入文件 {SOIL_PARAM_IN}")
     exit()
+# --- 增量缓存: 输入文件、本脚本和配置都未变化时直接跳过 ---
+cache = ArtifactCache(SOIL_PARAM_OUT.parent / MANIFEST_NAME)
+cache_key = cache.key(inputs=[SOIL_PARAM_IN, Path(__file__)], config=CONSTANTS_TO_FILL)
+if cache.is_fresh(SOIL_PARAM_OUT, cache_key):
+    print(f"输入未变化，{SOIL_PARAM_OUT.name} 已是最新，跳过。"); exit()
 
 # --- 4. 读取并填充数据 ---
 print(f"正在读取文件: {SOIL_PARAM_IN.name}")
-# 读取时指定所有列为字符串(object)，以保留原始格式，避免pandas自动转换类型
-df_soil = pd.read_csv(SOIL_PARAM_IN, sep=' ', header=None, dtype=object)
+soil = SoilParamTable.read(SOIL_PARAM_IN)
 
 print("正在填充模型常量参数...")
-for col_index, value in CONSTANTS_TO_FILL.items():
-    # 使用 .loc 进行赋值，这是pandas推荐的方式
-    df_soil.loc[:, col_index] = value
+for column, value in CONSTANTS_TO_FILL.items():
+    soil[column] = value
 
 print("常量参数填充完毕！")
 
 # --- 5. 保存为与之前完全一致的精确格式 ---
+# 经纬度4位小数、高程2位小数，其余列与上一步相同；
+# 常量列按配置的写法写出 (整数常量写成整数，小数常量如 0.1、1.0 原样写出)
 print(f"正在将更新后的文件保存至: {SOIL_PARAM_OUT.name}")
-with open(SOIL_PARAM_OUT, 'w') as f:
-    # 逐行处理DataFrame
-    for index, row in df_soil.iterrows():
-        # 将行转换为列表，方便按索引修改
-        items = list(row)
-        formatted_items = []
-        
-        # 遍历行中的每一项
-        for i, item in enumerate(items):
-            # 将所有项转换为字符串
-            item_str = str(item)
-            
-            # 对特定列应用特定格式，其他列保持原样
-            # 第3,4列(索引2,3): lat, lon (保留4位小数)
-            if i in [2, 3]:
-                formatted_items.append(f"{float(item_str):.4f}")
-            # 第22列(索引21): elev (保留2位小数)
-            elif i == 21:
-                formatted_items.append(f"{float(item_str):.2f}")
-            # 其他列保持原样（已经是填充好的整数或-9999）
-            else:
-                formatted_items.append(item_str)
-        
-        # 用空格连接所有格式化后的字符串，并写入文件
-        f.write(" ".join(formatted_items) + "\n")
+formats = column_formats(SOIL_FORMATS, **{column: '%d' if isinstance(value, int) else '%s'
+                                          for column, value in CONSTANTS_TO_FILL.items()})
+soil.write(SOIL_PARAM_OUT, formats)
 
+cache.record(SOIL_PARAM_OUT, cache_key)
 print("\n操作成功完成！")
\ No newline at end of file
@@ -6,6 +6,12 @@ import os
 import warnings
 from rasterio.enums import Resampling
 import re
+import traceback
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from regrid import find_lat_lon, get_regrid_operator
+from cmfd_io import open_basin_window, load_basin_window, prefetch, BackgroundWriter, archive_encoding
+from artifact_cache import ArtifactCache, MANIFEST_NAME, shapefile_parts
+from climatology import ClimatologyAccumulator, partial_stats
 
 # ====================================================================
 # --- 0. 配置 ---
@@ -14,102 +20,426 @@ import re
 VARIABLES_TO_PROCESS = [
     "wind", "temp", "pres", "shum", "rhum", "srad", "lrad", "prec"
 ]
-# 设置年份范围
+# 输入产品: '01dy' 为 CMFD 日尺度产品；'03hr' 为 3 小时产品 (数据量约为日尺度的 8 倍)，
+# 输出真正的 3 小时 _huai.nc，供 process_forcing.py 直接生成 3 小时驱动文件
+PRODUCT = '01dy'
+# 设置年份范围；YEAR_END 为 None 时处理到输入文件夹中最新的年份。
+# CMFD 发布新的年份后直接重新运行即可: 已处理的年份由产物清单跳过，只处理新增的文件
 YEAR_START = 1991
-YEAR_END = 2020
+YEAR_END = None
+
+# --- 并行设置 ---
+# 并行进程数。设为 1 时在当前进程中逐个处理 (与原来的串行方式相同)
+NUM_WORKERS = 1
+# 同时提交给进程池的最大工作单元数 (一个单元 = 一个变量的一个年份)。
+# 每个进程同一时刻只持有一个全国文件，峰值内存约为 NUM_WORKERS 个文件的大小
+MAX_IN_FLIGHT = 2 * NUM_WORKERS
+
+# --- 串行流水线设置 (仅 NUM_WORKERS = 1 时生效) ---
+# 预读取线程提前读入的文件数；设为 0 时不使用流水线，逐个文件 读取-处理-写出
+PREFETCH_DEPTH = 2
+# 等待后台写出的结果数上限
+WRITE_QUEUE_DEPTH = 2
+
+# --- 重采样设置 ---
+# True: 使用预先计算的稀疏重采样算子 (裁剪掩膜 + 面积平均权重只计算一次)；
+# False: 每个文件都调用 rio.clip + rio.reproject (原来的方式)
+USE_SPARSE_REGRID = True
+# 只读取流域外包矩形外扩该距离 (度) 的窗口，而不是整个全国格网
+WINDOW_HALO_DEG = 0.2
+# 时次数超过该值的文件按时间块读取和重采样 (248 个 3 小时时次约为一个月)，
+# 内存约为 一块 × 窗口大小，与文件覆盖的时长无关；None 表示一次读取整个文件
+TIME_BLOCK_STEPS = 248
+
+# --- 输出文件编码 (各方式的说明见 cmfd_io.ARCHIVE_PROFILES，体积与读取速度的比较可运行 archive_report.py) ---
+# 'plain': 不压缩 (原来的方式)；'compressed': 无损压缩 + 按格网时间序列分块；
+# 'packed': 再打包为 int16，各变量误差上限见 cmfd_io.PACKING_MAX_ERROR
+ARCHIVE_PROFILE = 'compressed'
 
 # --- 1. 文件路径 (固定，无需修改) ---
-INPUT_DATA_DIR = Path(r"H:\CMFD\Data_forcing_01dy_010deg")
+INPUT_DATA_DIR = Path(rf"H:\CMFD\Data_forcing_{PRODUCT}_010deg")
 SHP_FILE_PATH = Path(r"C:\Users\yc\Desktop\vic\huaihe\vic_result\grid\huaihe.shp")
-OUTPUT_DIR = Path(r"H:\CMFD\huai\Data_forcing_01dy_010deg")
-
-# --- 2. 初始化和检查 ---
-warnings.simplefilter(action='ignore', category=FutureWarning)
-os.makedirs(OUTPUT_DIR, exist_ok=True)
-print(f"输入路径: {INPUT_DATA_DIR}")
-print(f"Shapefile路径: {SHP_FILE_PATH}")
-print(f"输出路径: {OUTPUT_DIR}\n")
-
-# --- 3. 读取并准备淮河流域的 shapefile ---
-print(f"--- 步骤1: 读取 Shapefile ---")
-try:
-    huai_basin_gdf = gpd.read_file(SHP_FILE_PATH)
-    if not huai_basin_gdf.crs or huai_basin_gdf.crs.to_epsg() != 4326:
-        huai_basin_gdf = huai_basin_gdf.to_crs("EPSG:4326")
-    print("Shapefile 已准备就绪 (WGS84 坐标系)。")
-except Exception as e:
-    print(f"错误：无法读取 Shapefile 文件。 {e}")
-    exit()
+OUTPUT_DIR_PATTERN = r"H:\CMFD\huai\Data_forcing_{}_010deg"
+OUTPUT_DIR = Path(OUTPUT_DIR_PATTERN.format(PRODUCT))
+# 输入为次日尺度产品时，由同一次读取同时写出日平均的 _huai.nc (与日尺度产品的输出相同的命名和单位)，
+# 这样不必再单独下载、处理日尺度产品；None 表示不写。
+# 须与日尺度产品的输出目录分开 (文件同名，会互相覆盖)，下游脚本要用这些文件时把输入路径改到这里
+DAILY_AGGREGATE_DIR = Path(rf"H:\CMFD\huai\Data_forcing_01dy_from_{PRODUCT}_010deg")
+# 重采样算子的缓存目录
+REGRID_CACHE_DIR = OUTPUT_DIR / ".regrid_cache"
+# 产物清单: 输入和配置未变化的 _huai.nc 文件在下次运行时直接跳过
+MANIFEST_PATH = OUTPUT_DIR / MANIFEST_NAME
+# 逐格网多年气候统计: 写出每个 _huai.nc 时用内存中的数据累计和、个数、最小/最大值，
+# fill_parameters4.py (年平均降水) 和 fill_parameters9.py (年平均气温) 直接读取，不必再扫描全部年份；None 表示不累计
+CLIMATOLOGY_FILE = OUTPUT_DIR / "climatology.nc"
+# 同时累计离差平方和，可得到方差/标准差
+CLIMATOLOGY_VARIANCE = True
 
-# ====================================================================
-# --- 4. 批量处理所有指定的变量 ---
-# ====================================================================
-for var_name in VARIABLES_TO_PROCESS:
-    print(f"\n{'='*25} 开始处理变量: {var_name.upper()} {'='*25}")
-    
-    # 步骤 4a: 查找所有匹配变量名的文件
-    all_nc_files = list(INPUT_DATA_DIR.glob(f"{var_name}_*.nc"))
 
-    # ====================================================================
-    # --- 新增步骤 4b: 根据年份筛选文件 (1990-2020) ---
-    # ====================================================================
-    print(f"从 {len(all_nc_files)} 个文件中筛选 {YEAR_START}-{YEAR_END} 年的数据...")
-    filtered_files = []
-    for nc_file in all_nc_files:
-        try:
-            # 从文件名的最后一部分提取年份
-            date_part = nc_file.stem.split('_')[-1]
-            year = int(date_part[:4])
+def load_basin(shp_path):
+    """读取流域边界并统一为 WGS84 坐标系。"""
+    basin_gdf = gpd.read_file(shp_path)
+    if not basin_gdf.crs or basin_gdf.crs.to_epsg() != 4326:
+        basin_gdf = basin_gdf.to_crs("EPSG:4326")
+    return basin_gdf
+
+
+def collect_work_units(input_dir, variables, year_start, year_end):
+    """按 (变量, 年份) 将输入文件分组为互不依赖的工作单元。year_end 为 None 时不设上限。"""
+    work_units = {}
+    for var_name in variables:
+        # 查找所有匹配变量名的文件
+        all_nc_files = sorted(input_dir.glob(f"{var_name}_*.nc"))
+        print(f"变量 {var_name.upper()}: 从 {len(all_nc_files)} 个文件中筛选 {year_start}-{year_end or '最新'} 年的数据...")
+        n_selected = 0
+        for nc_file in all_nc_files:
+            try:
+                # 从文件名的最后一部分提取年份
+                date_part = nc_file.stem.split('_')[-1]
+                year = int(date_part[:4])
+            except (IndexError, ValueError):
+                print(f"  - 警告: 文件名 '{nc_file.name}' 格式不规范, 无法提取年份, 已跳过。")
+                continue
             # 检查年份是否在指定范围内
-            if YEAR_START <= year <= YEAR_END:
-                filtered_files.append(nc_file)
-        except (IndexError, ValueError):
-            print(f"  - 警告: 文件名 '{nc_file.name}' 格式不规范, 无法提取年份, 已跳过。")
-    
-    # 后续的处理将使用筛选后的 `filtered_files` 列表
-    nc_files = filtered_files
-    
-    if not nc_files:
-        print(f"警告：在 {YEAR_START}-{YEAR_END} 年范围内未找到变量 '{var_name}' 的任何文件，跳过...")
-        continue
-
-    print(f"筛选完毕, 共有 {len(nc_files)} 个 {var_name.upper()} 文件待处理。")
-    
-    # 步骤 4c: 循环处理筛选后的文件
+            if year_start <= year and (year_end is None or year <= year_end):
+                work_units.setdefault((var_name, year), []).append(nc_file)
+                n_selected += 1
+        if n_selected == 0:
+            print(f"警告：在 {year_start}-{year_end or '最新'} 年范围内未找到变量 '{var_name}' 的任何文件，跳过...")
+    return work_units
+
+
+def output_path_for(nc_file, output_dir, product=None):
+    """输出文件路径；product 给出时替换文件名中的产品标识 (如 03hr -> 01dy)。"""
+    base_name = re.sub(r'_\d{3}deg_', '_025deg_', nc_file.stem)
+    if product is not None:
+        base_name = re.sub(r'_(\d{2}dy|\d{2}hr)_', f'_{product}_', base_name, count=1)
+    return output_dir / f"{base_name}_huai.nc"
+
+
+def daily_output_path_for(nc_file):
+    """次日尺度输入对应的日平均 _huai.nc；日尺度输入或不写日平均文件时返回 None。"""
+    if PRODUCT == '01dy' or DAILY_AGGREGATE_DIR is None:
+        return None
+    return output_path_for(nc_file, DAILY_AGGREGATE_DIR, '01dy')
+
+
+def daily_aggregate(resampled_ds):
+    """按 (UTC) 日求平均。CMFD 各变量 (包括降水速率) 都是瞬时值或时段平均值，日平均即日尺度产品的定义。"""
+    daily_ds = resampled_ds.resample(time='1D').mean(keep_attrs=True)
+    for var in daily_ds.data_vars:
+        daily_ds[var] = daily_ds[var].astype(resampled_ds[var].dtype)
+    return daily_ds
+
+
+def regrid_source(xds, basin_gdf, shp_path):
+    """裁剪并重采样至 0.25°，返回 (重采样后的数据集, 写出时的 encoding)。
+
+    时次数超过 TIME_BLOCK_STEPS 时逐块读取 (惰性打开的文件每次只读取一块) 并重采样，
+    重采样后的流域数据很小，最后再拼接为整个文件。
+    """
+    n_time = xds.sizes.get('time', 0)
+    if TIME_BLOCK_STEPS and n_time > TIME_BLOCK_STEPS:
+        parts = [regrid_window(xds.isel(time=slice(t0, t0 + TIME_BLOCK_STEPS)).load(), basin_gdf, shp_path)
+                 for t0 in range(0, n_time, TIME_BLOCK_STEPS)]
+        resampled_ds = xr.concat(parts, dim='time', combine_attrs='override')
+    else:
+        resampled_ds = regrid_window(xds, basin_gdf, shp_path)
+    return resampled_ds, output_encoding(resampled_ds, xds)
+
+
+def output_encoding(resampled_ds, xds):
+    encoding = {var: {'_FillValue': xds[var].attrs.get('_FillValue', -9999)} for var in resampled_ds.data_vars}
+    return archive_encoding(resampled_ds, encoding, ARCHIVE_PROFILE)
+
+
+def regrid_window(xds, basin_gdf, shp_path):
+    """裁剪并重采样一段数据至 0.25°。"""
+    if USE_SPARSE_REGRID:
+        lat_name, lon_name = find_lat_lon(xds)
+        operator = get_regrid_operator(
+            xds[lat_name].values, xds[lon_name].values, shp_path, basin_gdf,
+            resolution=0.25, all_touched=True, cache_dir=REGRID_CACHE_DIR,
+        )
+        resampled_ds = operator.regrid_dataset(xds)
+    else:
+        xds = xds.rio.write_crs("EPSG:4326", inplace=True)
+
+        clipped_ds = xds.rio.clip(basin_gdf.geometry.values, basin_gdf.crs, drop=True, all_touched=True)
+
+        resampled_ds = clipped_ds.rio.reproject(
+            dst_crs=clipped_ds.rio.crs, resolution=0.25, resampling=Resampling.average
+        )
+
+    # 移除 'spatial_ref' 变量
+    if "spatial_ref" in resampled_ds.coords:
+        resampled_ds = resampled_ds.drop_vars("spatial_ref")
+
+    for var in resampled_ds.data_vars:
+        if 'grid_mapping' in resampled_ds[var].attrs:
+            del resampled_ds[var].attrs['grid_mapping']
+    return resampled_ds
+
+
+def write_output(resampled_ds, encoding, output_path):
+    resampled_ds.to_netcdf(output_path, encoding=encoding)
+    return output_path
+
+
+def write_outputs(nc_file, xds, resampled_ds, encoding, output_dir, write=write_output):
+    """写出 _huai.nc；次日尺度输入同时写出日平均文件。返回 [(输出路径, 写出函数)]。"""
+    jobs = [(output_path_for(nc_file, output_dir), lambda path: write(resampled_ds, encoding, path))]
+    daily_path = daily_output_path_for(nc_file)
+    if daily_path is not None:
+        daily_ds = daily_aggregate(resampled_ds)
+        daily_encoding = output_encoding(daily_ds, xds)
+        jobs.append((daily_path, lambda path: write(daily_ds, daily_encoding, path)))
+    return jobs
+
+
+def climatology_stats(resampled_ds):
+    """_huai.nc 的部分气候统计 (由内存中的数据计算，不再读回文件)；不累计时返回 None。"""
+    if CLIMATOLOGY_FILE is None:
+        return None
+    return partial_stats(resampled_ds, CLIMATOLOGY_VARIANCE)
+
+
+def process_nc_file(nc_file, basin_gdf, shp_path, output_dir):
+    """裁剪单个全国文件至流域范围，重采样至 0.25° 并写出 _huai.nc 文件 (次日尺度输入另写日平均文件)。
+
+    返回 (写出的文件列表, _huai.nc 的部分气候统计)。
+    """
+    with open_basin_window(nc_file, basin_gdf.total_bounds, halo=WINDOW_HALO_DEG) as xds:
+        resampled_ds, encoding = regrid_source(xds, basin_gdf, shp_path)
+        outputs = [write(path) for path, write in write_outputs(nc_file, xds, resampled_ds, encoding, output_dir)]
+        return outputs, climatology_stats(resampled_ds)
+
+
+# --- 进程池工作函数 ---
+# 每个子进程只读取一次 shapefile，保存在模块级变量中
+_worker_basin_gdf = None
+_worker_shp_path = None
+
+
+def _init_worker(shp_path):
+    global _worker_basin_gdf, _worker_shp_path
+    _worker_shp_path = shp_path
+    warnings.simplefilter(action='ignore', category=FutureWarning)
+    _worker_basin_gdf = load_basin(shp_path)
+
+
+def process_work_unit(var_name, year, nc_files, output_dir, basin_gdf=None, shp_path=None):
+    """处理一个 (变量, 年份) 工作单元，逐文件捕获错误而不是中断整个单元。"""
+    if basin_gdf is None:
+        basin_gdf, shp_path = _worker_basin_gdf, _worker_shp_path
+    result = {'unit': (var_name, year), 'outputs': [], 'errors': [], 'stats': {}}
     for nc_file in nc_files:
         try:
-            print(f"\n>>> 正在处理: {nc_file.name}")
-            
-            with xr.open_dataset(nc_file) as xds:
-                xds = xds.rio.write_crs("EPSG:4326", inplace=True)
-                
-                print("   - 正在进行裁剪操作...")
-                clipped_ds = xds.rio.clip(huai_basin_gdf.geometry.values, huai_basin_gdf.crs, drop=True, all_touched=True)
-
-                print("   - 正在重采样至 0.25° 分辨率...")
-                resampled_ds = clipped_ds.rio.reproject(
-                    dst_crs=clipped_ds.rio.crs, resolution=0.25, resampling=Resampling.average
-                )
-
-                print("   - 正在移除 'spatial_ref' 变量...")
-                if "spatial_ref" in resampled_ds.coords:
-                    resampled_ds = resampled_ds.drop_vars("spatial_ref")
-                
-                for var in resampled_ds.data_vars:
-                    if 'grid_mapping' in resampled_ds[var].attrs:
-                        del resampled_ds[var].attrs['grid_mapping']
-
-                base_name = re.sub(r'_\d{3}deg_', '_025deg_', nc_file.stem)
-                output_filename = f"{base_name}_huai.nc"
-                output_path = OUTPUT_DIR / output_filename
-                
-                encoding = {var: {'_FillValue': xds[var].attrs.get('_FillValue', -9999)} for var in resampled_ds.data_vars}
-                resampled_ds.to_netcdf(output_path, encoding=encoding)
-                
-                print(f"   - 处理完成，已保存至: {output_path}")
+            outputs, stats = process_nc_file(nc_file, basin_gdf, shp_path, output_dir)
+            result['outputs'] += outputs
+            if stats is not None:
+                result['stats'][outputs[0]] = stats
+        except Exception as e:
+            result['errors'].append((nc_file.name, f"{type(e).__name__}: {e}", traceback.format_exc()))
+    return result
+
+
+def artifact_key(cache, nc_file, shp_path):
+    """_huai.nc 产物的缓存键: 源文件、shapefile、处理代码以及影响结果的重采样配置。"""
+    code_files = [Path(__file__), Path(__file__).with_name('regrid.py'), Path(__file__).with_name('cmfd_io.py')]
+    config = {'resolution': 0.25, 'all_touched': True, 'sparse_regrid': USE_SPARSE_REGRID, 'archive': ARCHIVE_PROFILE,
+              'product': PRODUCT}
+    return cache.key(inputs=[nc_file, *shapefile_parts(shp_path), *code_files], config=config)
+
+
+def filter_fresh_units(work_units, cache, shp_path, output_dir):
+    """去掉输出已是最新的文件，返回 (剩余工作单元, {输出路径: 缓存键}, 跳过的文件数)。"""
+    remaining, keys, n_skipped = {}, {}, 0
+    for unit, nc_files in work_units.items():
+        for nc_file in nc_files:
+            output_paths = [output_path_for(nc_file, output_dir), daily_output_path_for(nc_file)]
+            output_paths = [path for path in output_paths if path is not None]
+            key = artifact_key(cache, nc_file, shp_path)
+            if all(cache.is_fresh(path, key) for path in output_paths):
+                n_skipped += 1
+                continue
+            keys.update((path, key) for path in output_paths)
+            remaining.setdefault(unit, []).append(nc_file)
+    return remaining, keys, n_skipped
+
+
+def report_result(result, failures, on_output=None):
+    var_name, year = result['unit']
+    for output_path in result['outputs']:
+        print(f"   - [{var_name} {year}] 已保存至: {output_path}")
+        if on_output is not None:
+            on_output(output_path, result.get('stats', {}).get(output_path))
+    for file_name, message, tb in result['errors']:
+        print(f"   - [{var_name} {year}] 处理文件 {file_name} 时发生错误: {message}")
+        failures.append((var_name, year, file_name, message, tb))
+
+
+def run_serial(work_units, basin_gdf, shp_path, output_dir, on_output=None):
+    failures = []
+    for i, ((var_name, year), nc_files) in enumerate(sorted(work_units.items())):
+        print(f"\n>>> ({i + 1}/{len(work_units)}) 正在处理: {var_name.upper()} {year}")
+        result = process_work_unit(var_name, year, nc_files, output_dir, basin_gdf=basin_gdf, shp_path=shp_path)
+        report_result(result, failures, on_output)
+    return failures
+
 
+def run_pipelined(work_units, basin_gdf, shp_path, output_dir, prefetch_depth, write_depth, on_output=None):
+    """单进程流水线: 预读取线程读取后续文件，主线程重采样，写出线程保存结果。"""
+    results = {unit: {'unit': unit, 'outputs': [], 'errors': []} for unit in sorted(work_units)}
+    jobs = [(unit, nc_file) for unit in sorted(work_units) for nc_file in work_units[unit]]
+    bounds = basin_gdf.total_bounds
+    # 主线程计算的部分气候统计，随对应的 _huai.nc 写出完成后一起交给 on_output
+    pending_stats = {}
+
+    def load(job):
+        return load_basin_window(job[1], bounds, halo=WINDOW_HALO_DEG)
+
+    def on_written(job, output_path):
+        results[job[0]]['outputs'].append(output_path)
+        if on_output is not None:
+            on_output(output_path, pending_stats.pop(output_path, None))
+
+    writer = BackgroundWriter(depth=write_depth)
+    for i, (job, xds, error) in enumerate(prefetch(jobs, load, depth=prefetch_depth)):
+        (var_name, year), nc_file = job
+        print(f"\n>>> ({i + 1}/{len(jobs)}) 正在处理: {nc_file.name}")
+        try:
+            if error is not None:
+                raise error
+            resampled_ds, encoding = regrid_source(xds, basin_gdf, shp_path)
+            stats = climatology_stats(resampled_ds)
+            if stats is not None:
+                pending_stats[output_path_for(nc_file, output_dir)] = stats
+            for output_path, write in write_outputs(nc_file, xds, resampled_ds, encoding, output_dir):
+                writer.submit(job, lambda write=write, path=output_path: write(path), on_done=on_written)
         except Exception as e:
-            print(f"   - 处理文件 {nc_file.name} 时发生错误: {e}")
-            continue
+            tb = "".join(traceback.format_exception(type(e), e, e.__traceback__))
+            results[job[0]]['errors'].append((nc_file.name, f"{type(e).__name__}: {e}", tb))
+    for (unit, nc_file), e, tb in writer.close():
+        results[unit]['errors'].append((nc_file.name, f"{type(e).__name__}: {e}", tb))
+
+    failures = []
+    for result in results.values():
+        report_result(result, failures)
+    return failures
+
+
+def run_parallel(work_units, shp_path, output_dir, num_workers, max_in_flight, on_output=None):
+    """将工作单元分发到进程池，最多同时提交 max_in_flight 个单元。"""
+    failures = []
+    pending_units = sorted(work_units.items())
+    in_flight = {}
+    n_done = 0
+    with ProcessPoolExecutor(max_workers=num_workers, initializer=_init_worker, initargs=(shp_path,)) as pool:
+        while pending_units or in_flight:
+            while pending_units and len(in_flight) < max_in_flight:
+                (var_name, year), nc_files = pending_units.pop(0)
+                future = pool.submit(process_work_unit, var_name, year, nc_files, output_dir)
+                in_flight[future] = (var_name, year, nc_files)
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                var_name, year, nc_files = in_flight.pop(future)
+                n_done += 1
+                print(f"\n>>> ({n_done}/{len(work_units)}) 完成: {var_name.upper()} {year}")
+                try:
+                    result = future.result()
+                except Exception as e:
+                    # 子进程崩溃等进程池级别的错误，整个单元记为失败
+                    result = {'unit': (var_name, year), 'outputs': [],
+                              'errors': [(f.name, f"{type(e).__name__}: {e}", "") for f in nc_files]}
+                report_result(result, failures, on_output)
+    return failures
+
+
+if __name__ == "__main__":
+    # --- 2. 初始化和检查 ---
+    warnings.simplefilter(action='ignore', category=FutureWarning)
+    os.makedirs(OUTPUT_DIR, exist_ok=True)
+    print(f"输入路径: {INPUT_DATA_DIR} (产品: {PRODUCT})")
+    print(f"Shapefile路径: {SHP_FILE_PATH}")
+    print(f"输出路径: {OUTPUT_DIR}")
+    if PRODUCT != '01dy' and DAILY_AGGREGATE_DIR is not None:
+        same_dirs = [d for d in (OUTPUT_DIR, Path(OUTPUT_DIR_PATTERN.format('01dy')))
+                     if os.path.normcase(os.path.abspath(d)) == os.path.normcase(os.path.abspath(DAILY_AGGREGATE_DIR))]
+        if same_dirs:
+            print(f"错误: 日平均输出路径 {DAILY_AGGREGATE_DIR} 与产品输出路径相同，日平均文件会覆盖同名的 _huai.nc。")
+            print("请把 DAILY_AGGREGATE_DIR 改为单独的目录，或设为 None。")
+            exit()
+        os.makedirs(DAILY_AGGREGATE_DIR, exist_ok=True)
+        print(f"日平均输出路径: {DAILY_AGGREGATE_DIR}")
+    print()
+
+    # --- 3. 读取并准备淮河流域的 shapefile ---
+    print(f"--- 步骤1: 读取 Shapefile ---")
+    try:
+        huai_basin_gdf = load_basin(SHP_FILE_PATH)
+        print("Shapefile 已准备就绪 (WGS84 坐标系)。")
+    except Exception as e:
+        print(f"错误：无法读取 Shapefile 文件。 {e}")
+        exit()
+
+    # ====================================================================
+    # --- 4. 按 (变量, 年份) 划分工作单元并批量处理 ---
+    # ====================================================================
+    print(f"\n--- 步骤2: 筛选 {YEAR_START}-{YEAR_END or '最新'} 年的文件 ---")
+    work_units = collect_work_units(INPUT_DATA_DIR, VARIABLES_TO_PROCESS, YEAR_START, YEAR_END)
+    if work_units:
+        print(f"输入文件覆盖 {min(y for _, y in work_units)}-{max(y for _, y in work_units)} 年。")
+    cache = ArtifactCache(MANIFEST_PATH)
+    all_outputs = [output_path_for(nc_file, OUTPUT_DIR) for nc_files in work_units.values() for nc_file in nc_files]
+    work_units, artifact_keys, n_skipped = filter_fresh_units(work_units, cache, SHP_FILE_PATH, OUTPUT_DIR)
+    print(f"已跳过 {n_skipped} 个输入未变化、输出已是最新的文件。")
+    print(f"筛选完毕, 共有 {len(work_units)} 个 (变量, 年份) 工作单元待处理。")
+
+    climatology = ClimatologyAccumulator(CLIMATOLOGY_FILE, CLIMATOLOGY_VARIANCE) if CLIMATOLOGY_FILE is not None else None
+
+    def record_output(output_path, stats=None):
+        # 每写完一个文件立即记入清单，中途中断后重新运行会从未完成的文件继续
+        cache.record(output_path, artifact_keys[output_path])
+        if climatology is not None and stats is not None:
+            climatology.update(output_path.name, stats)
+
+    if NUM_WORKERS > 1:
+        print(f"\n--- 步骤3: 使用 {NUM_WORKERS} 个进程并行处理 ---")
+        failures = run_parallel(work_units, SHP_FILE_PATH, OUTPUT_DIR, NUM_WORKERS, MAX_IN_FLIGHT, record_output)
+    elif PREFETCH_DEPTH > 0:
+        print(f"\n--- 步骤3: 串行流水线处理 (预读取 {PREFETCH_DEPTH} 个文件, 后台写出) ---")
+        failures = run_pipelined(work_units, huai_basin_gdf, SHP_FILE_PATH, OUTPUT_DIR, PREFETCH_DEPTH, WRITE_QUEUE_DEPTH,
+                                 record_output)
+    else:
+        print(f"\n--- 步骤3: 串行处理 ---")
+        failures = run_serial(work_units, huai_basin_gdf, SHP_FILE_PATH, OUTPUT_DIR, record_output)
+
+    # --- 5. 更新气候统计 ---
+    if climatology is not None:
+        # 本次跳过、但还没有统计量的文件 (如启用气候统计之前已处理的年份) 读回一次补齐
+        missing = [path for path in all_outputs if path.exists() and not climatology.has(path.name)]
+        if missing:
+            print(f"\n正在为 {len(missing)} 个已有的 _huai.nc 文件补算气候统计...")
+        for path in missing:
+            climatology.update_from_file(path)
+        # 只保留本次年份范围内的文件
+        climatology.retain(path.name for path in all_outputs)
+        if climatology.entries:
+            print(f"气候统计已保存至: {climatology.save()}")
 
-print(f"\n{'='*20} 所有指定变量处理完毕! {'='*20}")
\ No newline at end of file
+    # --- 6. 汇总 ---
+    failed_units = sorted({(var_name, year) for var_name, year, *_ in failures})
+    print(f"\n{'='*20} 所有指定变量处理完毕! {'='*20}")
+    print(f"成功: {len(work_units) - len(failed_units)} 个单元, 失败: {len(failed_units)} 个单元。")
+    # 隐藏文件: 与产物清单一样不计入流水线的输出摘要
+    log_path = OUTPUT_DIR / ".forcing_failures.log"
+    if not failures:
+        # 上次运行留下的错误记录已过时
+        log_path.unlink(missing_ok=True)
+    else:
+        with open(log_path, 'w', encoding='utf-8') as f:
+            for var_name, year, file_name, message, tb in failures:
+                print(f"  - 失败: {var_name} {year} ({file_name}): {message}")
+                f.write(f"[{var_name} {year}] {file_name}: {message}\n{tb}\n")
+        print(f"详细错误信息已写入: {log_path}")
\ No newline at end of file
@@ -0,0 +1,329 @@
+import argparse
+import json
+import re
+import threading
+import warnings
+import zipfile
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qs, urlparse
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import shapely
+import xarray as xr
+from scipy.spatial import cKDTree
+from shapely.geometry import shape
+
+from vic_forcing import (CMFD_VARIABLES, WRITE_BLOCK_ROWS, iter_store_blocks, forcing_step_hours, format_rows, pack_binary,
+                         write_forcing_file, write_binary_forcing_file)
+
+# ====================================================================
+# --- 0. 配置 ---
+# ====================================================================
+# 按格网分块的合并数据 (rechunk_forcing.py 的输出)
+FORCING_STORE = Path(r"H:\CMFD\huai\Data_forcing_01dy_010deg\huai_forcing_cells.nc")
+# 命令行模式下驱动文件的输出文件夹
+OUTPUT_DIR = Path(r"C:\Users\yc\Desktop\vic\huaihe\F_F\vic\forcing_subset")
+# 默认输出的时间范围 (与 process_forcing.py 相同)；None 表示到数据的最后一天
+TIME_START = '1991-01-01'
+TIME_END = None
+# 内存中保留最近使用的格网块数 (每块为 合并数据的一个数据块，即 CELL_CHUNK 个格网的完整时间序列)
+CACHE_BLOCKS = 64
+# HTTP 服务只监听本机
+HOST = '127.0.0.1'
+PORT = 8765
+
+
+class ForcingService:
+    """保持合并数据打开，按需为任意格网子集生成 VIC 驱动数据。
+
+    格网查找: 点用主格网中心的 KD 树找最近格网 (超出半个格网对角线视为不在流域内)，
+    矩形框和多边形先用外包框筛选，再判断格网中心是否落在其中。
+    读取: 按合并数据的数据块 (同一块中的格网) 读取并换算单位，换算结果放入 LRU 缓存，
+    相邻的请求 (同一子流域、相邻站点) 通常命中同一块。
+    """
+
+    def __init__(self, store_path=FORCING_STORE, cache_blocks=CACHE_BLOCKS):
+        self.store = xr.open_dataset(store_path)
+        self.lats = self.store['lat'].values
+        self.lons = self.store['lon'].values
+        self.times = pd.DatetimeIndex(self.store['time'].values)
+        # 时间步长和驱动文件名前缀 (与 process_forcing.py 相同，其后接 纬度_经度)
+        self.step_hours = forcing_step_hours(self.store['time'].values)
+        self.file_prefix = "huai_01dy_025deg_" if self.step_hours == 24 else f"huai_{self.step_hours:02d}hr_025deg_"
+        chunks = self.store[CMFD_VARIABLES[0]].encoding.get('chunksizes')
+        self.block_cells = int(chunks[1]) if chunks else 16
+        self.tree = cKDTree(np.column_stack([self.lats, self.lons]))
+        spacing = float(np.median(self.tree.query(self.tree.data, k=2)[0][:, 1])) if len(self.lats) > 1 else 0.25
+        self.max_distance = spacing * np.sqrt(2) / 2 + 1e-6
+        self.cache_blocks = cache_blocks
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = self.misses = 0
+
+    # --- 格网查找 ---
+    def cells_near(self, points):
+        """每个 (纬度, 经度) 所在的格网序号；不在任何格网内的点返回 -1。"""
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        distance, cells = self.tree.query(points)
+        return np.where(distance <= self.max_distance, cells, -1)
+
+    def cells_in_bbox(self, west, south, east, north):
+        """格网中心落在矩形框 (含边界) 内的格网序号。"""
+        inside = (self.lons >= west) & (self.lons <= east) & (self.lats >= south) & (self.lats <= north)
+        return np.flatnonzero(inside)
+
+    def cells_in_polygon(self, polygon):
+        """格网中心落在多边形内的格网序号。
+
+        多边形小于一个格网、不包含任何格网中心时，取多边形代表点所在的格网。
+        """
+        candidates = self.cells_in_bbox(*polygon.bounds)
+        cells = candidates[shapely.contains_xy(polygon, self.lons[candidates], self.lats[candidates])]
+        if len(cells) == 0:
+            point = polygon.representative_point()
+            cells = self.cells_near([(point.y, point.x)])
+            cells = cells[cells >= 0]
+        return cells
+
+    def select(self, points=None, bbox=None, polygon=None):
+        """按点、矩形框或多边形 (任选其一或组合) 选出格网，返回去重并排序后的格网序号。"""
+        selected = []
+        if points is not None:
+            found = self.cells_near(points)
+            if (found < 0).any():
+                missing = np.asarray(points, dtype=np.float64).reshape(-1, 2)[found < 0]
+                print(f"  - 警告: {len(missing)} 个点不在任何格网内: {missing.tolist()}")
+            selected.append(found[found >= 0])
+        if bbox is not None:
+            selected.append(self.cells_in_bbox(*bbox))
+        if polygon is not None:
+            selected.append(self.cells_in_polygon(polygon))
+        if not selected:
+            raise ValueError("请至少指定 points、bbox 或 polygon 之一。")
+        return np.unique(np.concatenate(selected)).astype(np.int64)
+
+    def file_name(self, cell):
+        return f"{self.file_prefix}{self.lats[cell]:.4f}_{self.lons[cell]:.4f}"
+
+    def time_window(self, start=TIME_START, end=TIME_END):
+        """时间范围对应的时间序号切片 (与 ``sel(time=slice(start, end))`` 相同)。"""
+        return self.times.slice_indexer(start, end)
+
+    # --- 读取 ---
+    def block(self, b):
+        """第 b 个格网块换算后的 (时间, 格网, 7) 数组，带 LRU 缓存。
+
+        锁只保护缓存的查找和插入，读取和换算在锁外进行，其他请求命中缓存时不必等待。
+        """
+        with self._lock:
+            if b in self._cache:
+                self._cache.move_to_end(b)
+                self.hits += 1
+                return self._cache[b]
+            self.misses += 1
+        lo = b * self.block_cells
+        hi = min(lo + self.block_cells, len(self.lats))
+        _, data = next(iter_store_blocks(self.store, np.arange(lo, hi), block_cells=hi - lo, step_hours=self.step_hours))
+        with self._lock:
+            # 同一块可能同时被两个请求读取，保留先放入缓存的结果
+            data = self._cache.setdefault(b, data)
+            self._cache.move_to_end(b)
+            while len(self._cache) > self.cache_blocks:
+                self._cache.popitem(last=False)
+        return data
+
+    def iter_cells(self, cells, window=slice(None)):
+        """按格网块的顺序产出 (格网序号, (时间, 7) 数组)，同一块只读取一次。"""
+        for cell in sorted(int(c) for c in cells):
+            yield cell, self.block(cell // self.block_cells)[window, cell % self.block_cells, :]
+
+    def iter_bytes(self, data, output_format='ascii'):
+        """把一个格网的数据按驱动文件格式分块编码，用于边生成边发送。"""
+        if output_format == 'binary':
+            yield pack_binary(data).tobytes()
+            return
+        for start in range(0, len(data), WRITE_BLOCK_ROWS):
+            yield format_rows(data[start:start + WRITE_BLOCK_ROWS]).encode('ascii')
+
+    def cell_info(self, cells):
+        return [{'cell': int(c), 'lat': float(self.lats[c]), 'lon': float(self.lons[c]), 'file': self.file_name(c)}
+                for c in cells]
+
+    def write_files(self, cells, output_dir, output_format='ascii', start=TIME_START, end=TIME_END):
+        """把选中格网的驱动文件写入 output_dir，文件与 process_forcing.py 的输出逐字节相同。"""
+        output_dir = Path(output_dir)
+        output_dir.mkdir(parents=True, exist_ok=True)
+        writer = write_binary_forcing_file if output_format == 'binary' else write_forcing_file
+        for n, (cell, data) in enumerate(self.iter_cells(cells, self.time_window(start, end)), 1):
+            path = writer(output_dir / self.file_name(cell), data)
+            print(f"  ({n}/{len(cells)}) lat={self.lats[cell]:.4f}, lon={self.lons[cell]:.4f} -> {path.name}")
+
+
+def parse_points(text):
+    """'纬度,经度;纬度,经度' (点之间也可换行，逗号两侧可有空格) -> [(纬度, 经度), ...]"""
+    points = []
+    for item in re.split(r'[;\n]', text):
+        if not item.strip():
+            continue
+        values = [float(v) for v in item.split(',')]
+        if len(values) != 2:
+            raise ValueError(f"点应为 纬度,经度: {item.strip()}")
+        points.append(tuple(values))
+    return points
+
+
+def parse_polygon(value):
+    """多边形: GeoJSON (字典或字符串)、WKT 字符串，或 shapefile/GeoJSON 文件路径 (统一转换为 WGS84)。"""
+    if isinstance(value, dict):
+        return shape(value.get('geometry', value))
+    text = str(value).strip()
+    if text.startswith('{'):
+        return parse_polygon(json.loads(text))
+    if Path(text).exists():
+        gdf = gpd.read_file(text)
+        if gdf.crs is not None:
+            gdf = gdf.to_crs(epsg=4326)
+        return shapely.union_all(gdf.geometry.to_numpy())
+    return shapely.from_wkt(text)
+
+
+def parse_request(params):
+    """把查询参数或 JSON 请求体统一为 select() 的参数和输出选项。"""
+    selection = {}
+    if params.get('points'):
+        points = params['points']
+        selection['points'] = parse_points(points) if isinstance(points, str) else points
+    if params.get('bbox'):
+        bbox = params['bbox']
+        selection['bbox'] = [float(v) for v in (bbox.split(',') if isinstance(bbox, str) else bbox)]
+        if len(selection['bbox']) != 4:
+            raise ValueError("bbox 应为 西,南,东,北 四个数。")
+    if params.get('polygon'):
+        selection['polygon'] = parse_polygon(params['polygon'])
+    output_format = params.get('format', 'ascii')
+    if output_format not in ('ascii', 'binary'):
+        raise ValueError(f"不支持的输出格式: {output_format}")
+    return selection, output_format, params.get('start', TIME_START), params.get('end', TIME_END)
+
+
+def make_handler(service):
+    class ForcingHandler(BaseHTTPRequestHandler):
+        """GET /info、GET /cells?...、GET /forcing?...、POST /forcing (JSON 请求体)。
+
+        选择参数: points=纬度,经度;纬度,经度  bbox=西,南,东,北  polygon=WKT 或 GeoJSON
+        输出参数: format=ascii|binary  start=YYYY-MM-DD  end=YYYY-MM-DD
+        /forcing 选中一个格网时直接返回驱动文件，多个格网时边生成边返回 zip。
+        """
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            params = {k: v[-1] for k, v in parse_qs(url.query).items()}
+            self.dispatch(url.path, params)
+
+        def do_POST(self):
+            length = int(self.headers.get('Content-Length', 0))
+            try:
+                params = json.loads(self.rfile.read(length) or b'{}')
+            except ValueError as e:
+                return self.send_json({'error': f"请求体不是有效的 JSON: {e}"}, 400)
+            self.dispatch(urlparse(self.path).path, params)
+
+        def dispatch(self, path, params):
+            try:
+                if path == '/info':
+                    return self.send_json({
+                        'cells': len(service.lats), 'step_hours': service.step_hours, 'start': str(service.times[0].date()), 'end': str(service.times[-1].date()),
+                        'bounds': [float(service.lons.min()), float(service.lats.min()),
+                                   float(service.lons.max()), float(service.lats.max())],
+                        'cache': {'blocks': len(service._cache), 'hits': service.hits, 'misses': service.misses},
+                    })
+                if path not in ('/cells', '/forcing'):
+                    return self.send_json({'error': f"未知路径: {path}"}, 404)
+                selection, output_format, start, end = parse_request(params)
+                cells = service.select(**selection)
+            except Exception as e:
+                return self.send_json({'error': f"{type(e).__name__}: {e}"}, 400)
+            if path == '/cells':
+                return self.send_json(service.cell_info(cells))
+            if len(cells) == 0:
+                return self.send_json({'error': "没有选中任何格网。"}, 404)
+            self.send_forcing(cells, output_format, service.time_window(start, end))
+
+        def send_json(self, obj, status=200):
+            body = json.dumps(obj, ensure_ascii=False).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def send_forcing(self, cells, output_format, window):
+            # HTTP/1.0 下以关闭连接表示响应结束，无需预先知道长度
+            self.send_response(200)
+            if len(cells) == 1:
+                self.send_header('Content-Type', 'application/octet-stream')
+                self.send_header('Content-Disposition', f'attachment; filename="{service.file_name(cells[0])}"')
+                self.end_headers()
+                for cell, data in service.iter_cells(cells, window):
+                    for chunk in service.iter_bytes(data, output_format):
+                        self.wfile.write(chunk)
+                return
+            self.send_header('Content-Type', 'application/zip')
+            self.send_header('Content-Disposition', 'attachment; filename="forcing.zip"')
+            self.end_headers()
+            with zipfile.ZipFile(self.wfile, 'w', compression=zipfile.ZIP_DEFLATED) as zf:
+                for cell, data in service.iter_cells(cells, window):
+                    with zf.open(service.file_name(cell), 'w', force_zip64=True) as f:
+                        for chunk in service.iter_bytes(data, output_format):
+                            f.write(chunk)
+
+        def log_message(self, format, *args):
+            print(f"  [{self.log_date_time_string()}] {self.address_string()} {format % args}")
+
+    return ForcingHandler
+
+
+if __name__ == "__main__":
+    warnings.simplefilter(action='ignore', category=FutureWarning)
+    parser = argparse.ArgumentParser(description="按需生成任意格网子集的 VIC 驱动文件 (命令行或本地 HTTP 服务)。")
+    parser.add_argument('command', choices=['points', 'bbox', 'polygon', 'serve'],
+                        help="points: 纬度,经度 ...; bbox: 西 南 东 北; polygon: shapefile/GeoJSON 文件或 WKT; serve: 启动 HTTP 服务")
+    parser.add_argument('values', nargs='*')
+    parser.add_argument('--store', type=Path, default=FORCING_STORE)
+    parser.add_argument('--output', type=Path, default=OUTPUT_DIR)
+    parser.add_argument('--format', choices=['ascii', 'binary'], default='ascii')
+    parser.add_argument('--start', default=TIME_START)
+    parser.add_argument('--end', default=TIME_END)
+    parser.add_argument('--port', type=int, default=PORT)
+    args = parser.parse_args()
+
+    if not args.store.exists():
+        print(f"错误: 合并数据 {args.store} 不存在，请先运行 rechunk_forcing.py。"); exit()
+    service = ForcingService(args.store)
+    print(f"已打开合并数据: {args.store} ({len(service.lats)} 个格网, "
+          f"{service.times[0].date()} 至 {service.times[-1].date()})")
+
+    if args.command == 'serve':
+        server = ThreadingHTTPServer((HOST, args.port), make_handler(service))
+        print(f"服务已启动: http://{HOST}:{args.port}/  (Ctrl+C 停止)")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            print("\n服务已停止。")
+        exit()
+
+    try:
+        separator = {'points': ';', 'bbox': ',', 'polygon': ' '}[args.command]
+        selection, _, _, _ = parse_request({args.command: separator.join(args.values)})
+        cells = service.select(**selection)
+    except Exception as e:
+        print(f"错误: 无法解析选择条件: {e}"); exit()
+    if len(cells) == 0:
+        print("没有选中任何格网。"); exit()
+    print(f"选中 {len(cells)} 个格网，正在写出到 {args.output} ...")
+    service.write_files(cells, args.output, args.format, args.start, args.end)
+    print(f"\n处理成功完成！已在 '{args.output}' 文件夹下生成 {len(cells)} 个气象驱动文件。")
@@ -0,0 +1,324 @@
+import ast
+import hashlib
+import os
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from pathlib import Path
+from artifact_cache import ArtifactCache, MANIFEST_NAME, shapefile_parts
+
+# 按依赖关系运行整个工作流 (WORKFLOW.md 中的气象驱动、植被、土壤三条流程)。
+# 每个阶段是一个原有脚本，输入和输出由脚本自身的配置常量给出 (读取脚本源码中的赋值，不执行脚本)，
+# 某阶段的输出路径是另一阶段的输入 (或包含关系) 时，后者依赖前者。
+# 相互独立的分支并行运行；输入文件、脚本代码和输出都未变化的阶段直接跳过，
+# 因此只有受改动影响的阶段及其下游会重新运行。每次运行都会写出一份耗时报告。
+
+# --- 1. 配置 ---
+CODE_DIR = Path(__file__).parent
+# 日志、耗时报告和阶段状态 (指纹清单) 存放的文件夹
+PIPELINE_DIR = Path(r"C:\Users\yc\Desktop\vic\huaihe\F_F\vic\pipeline")
+# 同时运行的阶段数 (各阶段本身也可能使用多进程，请按内存大小设置)
+MAX_PARALLEL_STAGES = 3
+# 只运行这些阶段 (及其所需的上游阶段)；None 表示运行全部阶段
+TARGETS = None
+# 无论是否最新都重新运行的阶段
+FORCE_STAGES = []
+# 不运行的阶段 (如已由 process_forcing.py 直接生成次日尺度文件时的 disaggregate_forcing)
+SKIP_STAGES = ['disaggregate_forcing']
+# True: 土壤分支使用一体化的 build_soil_params.py；False: 逐个运行 fill_parameters*.py
+USE_SOIL_RUNNER = False
+
+
+def process_forcing_outputs(cfg):
+    """process_forcing.py 的输出文件夹取决于输出格式和是否同时生成次日尺度/日尺度文件。"""
+    formats = {'ascii': cfg.get('OUTPUT_FORCING_DIR'), 'binary': cfg.get('OUTPUT_BINARY_DIR'), 'image': cfg.get('OUTPUT_IMAGE_DIR')}
+    subdaily = cfg.get('OUTPUT_SUBDAILY_DIR') if cfg.get('SUBDAILY_STEPS_PER_DAY') else None
+    return [formats.get(cfg.get('OUTPUT_FORMAT')), subdaily, cfg.get('OUTPUT_DAILY_DIR')]
+
+
+def stage(script, inputs=(), outputs=(), name=None):
+    """声明一个阶段。inputs/outputs 中的字符串为脚本中的配置常量名，也可以是由配置字典返回路径列表的函数。"""
+    return {'name': name or Path(script).stem, 'script': script, 'inputs': list(inputs), 'outputs': list(outputs)}
+
+
+def optional(name):
+    """可选输入: 配置常量给出的文件存在时才作为输入 (脚本在文件不存在时有替代做法)，不存在时不阻止阶段运行。"""
+    return lambda cfg: [p for p in [cfg.get(name)] if p is not None and Path(p).exists()]
+
+
+# --- 2. 流水线定义 ---
+FORCING_STAGES = [
+    stage('forcing.py', inputs=['INPUT_DATA_DIR', 'SHP_FILE_PATH'],
+          outputs=['OUTPUT_DIR', lambda cfg: [cfg.get('DAILY_AGGREGATE_DIR') if cfg.get('PRODUCT') != '01dy' else None]]),
+    stage('process_forcing.py', inputs=['INPUT_DATA_DIR', 'FORCING_STORE'], outputs=[process_forcing_outputs]),
+    stage('disaggregate_forcing.py', inputs=['DAILY_FORCING_DIR'], outputs=['SUBDAILY_FORCING_DIR']),
+]
+VEGETATION_STAGES = [
+    stage('process_vegetation_detailed.py', inputs=['MASTER_GRID_NC', 'VEG_RASTER_IN', 'VEGLIB_FILE'], outputs=['VEG_PARAM_OUT']),
+]
+# framework.py 生成的框架文件不被后续步骤读取 (fill_parameters.py 由主格网自行建立框架并填充高程)，因此不在流水线中
+SOIL_STAGES = [
+    stage('fill_parameters.py', inputs=['MASTER_GRID_NC', 'ELEV_NC_IN', 'VEG_RASTER_IN', 'VEGLIB_FILE'],
+          outputs=['SOIL_PARAM_OUT', 'VEG_PARAM_OUT']),
+    stage('fill_parameters2.py', inputs=['SOIL_PARAM_IN'], outputs=['SOIL_PARAM_OUT']),
+    stage('fill_parameters3.py', inputs=['SOIL_PARAM_IN'], outputs=['SOIL_PARAM_OUT']),
+    stage('fill_parameters4.py', inputs=['SOIL_PARAM_IN', 'MET_DATA_DIR'], outputs=['SOIL_PARAM_OUT']),
+    stage('fill_parameters5.py', inputs=['SOIL_PARAM_IN'], outputs=['SOIL_PARAM_OUT']),
+    stage('fill_parameters9.py', inputs=['SOIL_PARAM_IN', 'GLOBAL_SOIL_FILE', optional('CLIMATOLOGY_FILE')], outputs=['SOIL_PARAM_OUT']),
+    stage('fill_parameters10.5.py', inputs=['SOIL_PARAM_IN', 'ARCGIS_SOIL_OUTPUT'], outputs=['SOIL_PARAM_OUT']),
+    stage('fill_parameters11.py', inputs=['SOIL_PARAM_IN'], outputs=['SOIL_PARAM_OUT']),
+    stage('fill_parameters12.py', inputs=['SOIL_PARAM_IN'], outputs=['SOIL_PARAM_OUT']),
+]
+SOIL_RUNNER_STAGES = [
+    stage('build_soil_params.py', inputs=['GRID_NC', 'ELEV_NC_IN', 'MET_DATA_DIR', 'GLOBAL_SOIL_FILE', 'ARCGIS_SOIL_OUTPUT'],
+          outputs=['SOIL_PARAM_OUT']),
+]
+PIPELINE = FORCING_STAGES + VEGETATION_STAGES + (SOIL_RUNNER_STAGES if USE_SOIL_RUNNER else SOIL_STAGES)
+
+STATUS_LABELS = {'ran': '已运行', 'fresh': '最新，跳过', 'failed': '失败', 'blocked': '未运行 (上游失败)'}
+
+
+# --- 3. 读取脚本配置与依赖 ---
+def script_config(script_path):
+    """按顺序求值脚本顶层的常量赋值 (如 Path(r"...")、OUTPUT_DIR / "a.txt")，无法求值的赋值忽略。"""
+    tree = ast.parse(Path(script_path).read_text(encoding='utf-8'))
+    namespace = {'Path': Path}
+    for node in tree.body:
+        if isinstance(node, ast.Assign) and len(node.targets) == 1 and isinstance(node.targets[0], ast.Name):
+            try:
+                namespace[node.targets[0].id] = eval(compile(ast.Expression(node.value), str(script_path), 'eval'), namespace)
+            except Exception:
+                pass
+    return namespace
+
+
+def local_modules(script_path, seen=None):
+    """脚本及其 (递归) 导入的本仓库模块的源文件，作为阶段缓存键的一部分。"""
+    seen = [] if seen is None else seen
+    script_path = Path(script_path)
+    if script_path in seen or not script_path.exists():
+        return seen
+    seen.append(script_path)
+    for node in ast.walk(ast.parse(script_path.read_text(encoding='utf-8'))):
+        names = [a.name for a in node.names] if isinstance(node, ast.Import) else [node.module] if isinstance(node, ast.ImportFrom) and node.module else []
+        for module in names:
+            local_modules(script_path.with_name(f"{module.split('.')[0]}.py"), seen)
+    return seen
+
+
+def resolve_paths(entries, cfg):
+    """把配置常量名或函数解析为路径列表，忽略 None。"""
+    paths = []
+    for entry in entries:
+        values = entry(cfg) if callable(entry) else [cfg.get(entry)]
+        paths += [Path(v) for v in values if v is not None]
+    return paths
+
+
+def resolve_stages(stages, code_dir=CODE_DIR):
+    """读取各阶段脚本的配置，得到 {阶段名: 阶段} (含解析后的 input_paths/output_paths)。"""
+    resolved = {}
+    for s in stages:
+        script_path = Path(code_dir) / s['script']
+        cfg = script_config(script_path)
+        resolved[s['name']] = dict(s, script_path=script_path,
+                                   input_paths=resolve_paths(s['inputs'], cfg), output_paths=resolve_paths(s['outputs'], cfg))
+    return resolved
+
+
+def _normalize(path):
+    # 统一大小写 (Windows) 和分隔符，OUTPUT_DIR / "a.txt" 与 Path(r"...\\a.txt") 视为同一路径
+    return os.path.normcase(os.path.abspath(path)).replace('\\', '/').rstrip('/')
+
+
+def _overlaps(a, b):
+    a, b = _normalize(a), _normalize(b)
+    return a == b or a.startswith(b + '/') or b.startswith(a + '/')
+
+
+def stage_dependencies(stages):
+    """{阶段名: 上游阶段名列表}：某阶段的输入与另一阶段的输出相同或互相包含时，前者依赖后者。"""
+    deps = {name: [other for other, o in stages.items() if other != name
+                   and any(_overlaps(i, out) for i in s['input_paths'] for out in o['output_paths'])]
+            for name, s in stages.items()}
+    # 检查循环依赖
+    state = {}
+    def visit(name, chain):
+        if state.get(name) == 'done':
+            return
+        if state.get(name) == 'visiting':
+            raise ValueError(f"流水线存在循环依赖: {' -> '.join(chain + [name])}")
+        state[name] = 'visiting'
+        for d in deps[name]:
+            visit(d, chain + [name])
+        state[name] = 'done'
+    for name in deps:
+        visit(name, [])
+    return deps
+
+
+def with_upstream(targets, deps):
+    """targets 及其所有上游阶段。"""
+    selected, todo = set(), list(targets)
+    while todo:
+        name = todo.pop()
+        if name not in deps:
+            raise KeyError(f"未知的阶段: {name!r}，可选: {list(deps)}")
+        if name not in selected:
+            selected.add(name)
+            todo += deps[name]
+    return selected
+
+
+# --- 4. 阶段缓存 ---
+def expand_files(paths):
+    """路径展开为文件列表: 文件夹取其中所有非隐藏文件 (跳过清单、重采样缓存等)，shapefile 取全部组成文件。"""
+    files = []
+    for p in paths:
+        if p.is_dir():
+            files += sorted(f for f in p.rglob('*') if f.is_file()
+                            and not any(part.startswith('.') for part in f.relative_to(p).parts))
+        elif p.suffix.lower() == '.shp':
+            files += shapefile_parts(p)
+        else:
+            files.append(p)
+    return files
+
+
+def outputs_signature(paths):
+    """输出文件的 (路径, 大小, 修改时间) 摘要，用于发现输出被删除或改动。"""
+    h = hashlib.sha256()
+    for p in paths:
+        if not p.exists():
+            h.update(f"{p}:missing\n".encode())
+            continue
+        for f in expand_files([p]):
+            st = f.stat()
+            h.update(f"{f}:{st.st_size}:{st.st_mtime_ns}\n".encode())
+    return h.hexdigest()
+
+
+def stage_key(cache, s):
+    missing = [str(p) for p in s['input_paths'] if not p.exists()]
+    if missing:
+        raise FileNotFoundError(f"找不到输入: {missing}")
+    return cache.key(inputs=[*expand_files(s['input_paths']), *local_modules(s['script_path'])],
+                     config={'inputs': [str(p) for p in s['input_paths']], 'outputs': [str(p) for p in s['output_paths']]})
+
+
+def stamp_path(pipeline_dir, name):
+    return Path(pipeline_dir) / "stamps" / f"{name}.stamp"
+
+
+def is_stage_fresh(cache, s, key, pipeline_dir):
+    """上次成功运行时的键相同，且输出与当时一致。"""
+    stamp = stamp_path(pipeline_dir, s['name'])
+    if not cache.is_fresh(stamp, key):
+        return False
+    return stamp.read_text(encoding='utf-8') == outputs_signature(s['output_paths'])
+
+
+def run_stage(cache, s, pipeline_dir, force=False):
+    """运行 (或跳过) 一个阶段，返回 (状态, 说明)。脚本输出写入日志文件。"""
+    try:
+        key = stage_key(cache, s)
+    except FileNotFoundError as e:
+        return 'failed', str(e)
+    if not force and is_stage_fresh(cache, s, key, pipeline_dir):
+        return 'fresh', ''
+    log_path = Path(pipeline_dir) / "logs" / f"{s['name']}.log"
+    log_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(log_path, 'w', encoding='utf-8') as log:
+        proc = subprocess.run([sys.executable, str(s['script_path'])], cwd=s['script_path'].parent, stdout=log,
+                              stderr=subprocess.STDOUT, env=dict(os.environ, PYTHONIOENCODING='utf-8'))
+    # 脚本出错时大多只打印错误并 exit()，返回码为 0，因此还要检查声明的输出是否已生成
+    missing = [str(p) for p in s['output_paths'] if not p.exists()]
+    if proc.returncode != 0 or missing:
+        return 'failed', f"返回码 {proc.returncode}" + (f"，未生成: {missing}" if missing else "") + f"，详见 {log_path}"
+    stamp = stamp_path(pipeline_dir, s['name'])
+    stamp.parent.mkdir(parents=True, exist_ok=True)
+    stamp.write_text(outputs_signature(s['output_paths']), encoding='utf-8')
+    cache.record(stamp, key)
+    return 'ran', ''
+
+
+# --- 5. 调度 ---
+def run_pipeline(stages, pipeline_dir, max_parallel=MAX_PARALLEL_STAGES, targets=None, force=(), skip=(), code_dir=CODE_DIR):
+    """按依赖关系并行运行各阶段，返回 {阶段名: 运行记录}。"""
+    stages = {name: s for name, s in resolve_stages(stages, code_dir).items() if name not in skip}
+    deps = stage_dependencies(stages)
+    selected = with_upstream(targets, deps) if targets else set(stages)
+    pending = [name for name in stages if name in selected]
+    cache = ArtifactCache(Path(pipeline_dir) / MANIFEST_NAME)
+    records, running = {}, {}
+    t0 = time.perf_counter()
+
+    def finish(name, status, message, start):
+        records[name] = {'status': status, 'message': message, 'start': start - t0, 'seconds': time.perf_counter() - start}
+        print(f"  [{time.perf_counter() - t0:8.1f} 秒] {name}: {STATUS_LABELS[status]} {message}".rstrip())
+
+    with ThreadPoolExecutor(max_workers=max_parallel) as pool:
+        while pending or running:
+            for name in list(pending):
+                upstream = [records.get(d, {}).get('status') for d in deps[name] if d in selected]
+                if any(st in ('failed', 'blocked') for st in upstream):
+                    pending.remove(name)
+                    finish(name, 'blocked', '', time.perf_counter())
+                elif all(st in ('ran', 'fresh') for st in upstream):
+                    pending.remove(name)
+                    start = time.perf_counter()
+                    running[pool.submit(run_stage, cache, stages[name], pipeline_dir, name in force)] = (name, start)
+            if not running:
+                break
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name, start = running.pop(future)
+                try:
+                    status, message = future.result()
+                except Exception as e:
+                    status, message = 'failed', f"{type(e).__name__}: {e}"
+                finish(name, status, message, start)
+    return records, deps, time.perf_counter() - t0
+
+
+# --- 6. 耗时报告 ---
+def critical_path(records, deps):
+    """按各阶段实际耗时计算的最长依赖链 (阶段名列表, 总耗时)。"""
+    best = {}
+    def longest(name):
+        if name not in best:
+            chains = [longest(d) for d in deps[name] if d in records]
+            chain, seconds = max(chains, key=lambda c: c[1], default=([], 0.0))
+            best[name] = (chain + [name], seconds + records[name]['seconds'])
+        return best[name]
+    return max((longest(name) for name in records), key=lambda c: c[1], default=([], 0.0))
+
+
+def timing_report(records, deps, wall_seconds):
+    lines = [f"流水线运行报告 {time.strftime('%Y-%m-%d %H:%M:%S')}",
+             f"{'阶段':<32}{'状态':<16}{'开始 (秒)':>12}{'耗时 (秒)':>12}"]
+    for name, r in sorted(records.items(), key=lambda item: item[1]['start']):
+        lines.append(f"{name:<32}{STATUS_LABELS[r['status']]:<16}{r['start']:>12.1f}{r['seconds']:>12.1f}")
+    chain, chain_seconds = critical_path(records, deps)
+    lines += ["",
+              f"总耗时 (墙钟): {wall_seconds:.1f} 秒；各阶段耗时之和 (顺序运行时): {sum(r['seconds'] for r in records.values()):.1f} 秒",
+              f"关键路径 ({chain_seconds:.1f} 秒): {' -> '.join(chain)}"]
+    failed = [name for name, r in records.items() if r['status'] in ('failed', 'blocked')]
+    if failed:
+        lines.append(f"未完成的阶段: {', '.join(failed)}")
+    return "\n".join(lines) + "\n"
+
+
+if __name__ == "__main__":
+    os.makedirs(PIPELINE_DIR, exist_ok=True)
+    print(f"流水线开始，最多同时运行 {MAX_PARALLEL_STAGES} 个阶段...")
+    try:
+        records, deps, wall_seconds = run_pipeline(PIPELINE, PIPELINE_DIR, MAX_PARALLEL_STAGES, TARGETS, FORCE_STAGES, SKIP_STAGES)
+    except (KeyError, ValueError) as e:
+        print(f"错误: {e}"); exit()
+    report = timing_report(records, deps, wall_seconds)
+    report_path = PIPELINE_DIR / f"timing_{time.strftime('%Y%m%d_%H%M%S')}.txt"
+    report_path.write_text(report, encoding='utf-8')
+    print("\n" + report)
+    print(f"耗时报告已保存至: {report_path}")
@@ -4,6 +4,9 @@ import rioxarray
 from pathlib import Path
 import os
 from rasterio.enums import Resampling
+from regrid import find_lat_lon, get_regrid_operator
+from cmfd_io import subset_to_bounds
+from artifact_cache import ArtifactCache, MANIFEST_NAME, shapefile_parts
 
 # --- 1. 配置路径 (已根据您的信息设置，无需修改) ---
 
@@ -18,11 +21,24 @@ OUTPUT_DIR = Path(r"H:\CMFD\huai\Data_ancillary")
 OUTPUT_FILENAME = "elev_CMFD_V0200_B-00_fx_025deg_huai.nc"
 ELEV_NC_OUT = OUTPUT_DIR / OUTPUT_FILENAME
 
+# True: 使用与 forcing.py 共用的稀疏重采样算子 (面积平均，与 fill_parameters.py 中的高程处理一致)；
+# False: 使用 rio.clip + rio.reproject 双线性插值 (原来的方式)
+USE_SPARSE_REGRID = True
+REGRID_CACHE_DIR = OUTPUT_DIR / ".regrid_cache"
+# 只读取流域外包矩形外扩该距离 (度) 的窗口
+WINDOW_HALO_DEG = 0.2
+
 # --- 2. 准备工作 ---
 os.makedirs(OUTPUT_DIR, exist_ok=True)
 print("处理开始...")
 print(f"输入文件: {ELEV_NC_IN}")
 print(f"Shapefile: {SHP_FILE}")
+# --- 增量缓存: 输入文件、本脚本和配置都未变化时直接跳过 ---
+cache = ArtifactCache(ELEV_NC_OUT.parent / MANIFEST_NAME)
+code_files = [Path(__file__), Path(__file__).with_name('regrid.py'), Path(__file__).with_name('cmfd_io.py')]
+cache_key = cache.key(inputs=[ELEV_NC_IN, *shapefile_parts(SHP_FILE), *code_files], config={'resolution': 0.25, 'sparse_regrid': USE_SPARSE_REGRID})
+if cache.is_fresh(ELEV_NC_OUT, cache_key):
+    print(f"输入未变化，{ELEV_NC_OUT.name} 已是最新，跳过。"); exit()
 
 # --- 3. 读取并准备数据 ---
 # 读取Shapefile
@@ -37,7 +53,9 @@ except Exception as e:
 
 # 读取高程NetCDF文件
 try:
-    elev_ds = xr.open_dataset(ELEV_NC_IN)
+    elev_ds_full = xr.open_dataset(ELEV_NC_IN)
+    # 只截取流域范围的窗口，后续只会读取这一部分数据
+    elev_ds = subset_to_bounds(elev_ds_full, huai_basin_gdf.total_bounds, halo=WINDOW_HALO_DEG)
     # 明确数据坐标系为 WGS84
     elev_ds = elev_ds.rio.write_crs("EPSG:4326")
     print("高程NC文件读取成功。")
@@ -47,18 +65,28 @@ except Exception as e:
 
 # --- 4. 核心处理流程 ---
 try:
-    # 步骤 1: 裁剪到淮河流域
-    print("正在裁剪高程数据...")
-    clipped_elev = elev_ds.rio.clip(huai_basin_gdf.geometry, drop=True)
+    if USE_SPARSE_REGRID:
+        # 步骤 1+2: 裁剪并按面积平均重采样到0.25度 (算子只计算一次并缓存)
+        print("正在裁剪并重采样至 0.25° 分辨率 (稀疏算子)...")
+        lat_name, lon_name = find_lat_lon(elev_ds)
+        operator = get_regrid_operator(
+            elev_ds[lat_name].values, elev_ds[lon_name].values, SHP_FILE, huai_basin_gdf,
+            resolution=0.25, all_touched=False, cache_dir=REGRID_CACHE_DIR,
+        )
+        resampled_elev = operator.regrid_dataset(elev_ds)
+    else:
+        # 步骤 1: 裁剪到淮河流域
+        print("正在裁剪高程数据...")
+        clipped_elev = elev_ds.rio.clip(huai_basin_gdf.geometry, drop=True)
 
-    # 步骤 2: 重采样到0.25度
-    print("正在重采样至 0.25° 分辨率...")
-    # 对于高程数据，使用双线性插值(bilinear)或平均(average)都可以
-    resampled_elev = clipped_elev.rio.reproject(
-        dst_crs=clipped_elev.rio.crs,
-        resolution=0.25,
-        resampling=Resampling.bilinear 
-    )
+        # 步骤 2: 重采样到0.25度
+        print("正在重采样至 0.25° 分辨率...")
+        # 对于高程数据，使用双线性插值(bilinear)或平均(average)都可以
+        resampled_elev = clipped_elev.rio.reproject(
+            dst_crs=clipped_elev.rio.crs,
+            resolution=0.25,
+            resampling=Resampling.bilinear 
+        )
 
     # 步骤 3 (可选，但推荐): 移除 rioxarray 添加的 spatial_ref 变量，保持文件干净
     print("正在清理 'spatial_ref' 变量...")
@@ -72,6 +100,7 @@ try:
     print(f"正在保存至: {ELEV_NC_OUT}")
     resampled_elev.to_netcdf(ELEV_NC_OUT)
     
+    cache.record(ELEV_NC_OUT, cache_key)
     print("\n处理成功完成！")
 
 except Exception as e:
@@ -79,5 +108,5 @@ except Exception as e:
 
 finally:
     # 关闭数据集
-    if 'elev_ds' in locals():
-        elev_ds.close()
\ No newline at end of file
+    if 'elev_ds_full' in locals():
+        elev_ds_full.close()
\ No newline at end of file
@@ -4,6 +4,15 @@ from pathlib import Path
 import os
 import numpy as np
 import warnings
+from artifact_cache import ArtifactCache, MANIFEST_NAME
+from functools import partial
+from disaggregation import write_with_subdaily, write_with_daily
+from vic_forcing import (CMFD_VARIABLES, FORCING_COLUMNS, valid_cells, convert_to_vic, extract_cells, write_forcing_files,
+                         time_blocks, year_blocks, iter_cell_blocks, iter_store_blocks, existing_rows, huai_file_year,
+                         forcing_step_hours,
+                         forcing_dtype, SharedCube, write_cells_shared,
+                         write_forcing_file, write_binary_forcing_file, binary_global_snippet,
+                         image_forcing_dataset, write_image_forcing_file, image_global_snippet)
 
 # --- 0. 忽略不必要的警告 ---
 warnings.filterwarnings("ignore", category=FutureWarning)
@@ -14,104 +23,401 @@ INPUT_DATA_DIR = Path(r"H:\CMFD\huai\Data_forcing_01dy_010deg")
 # 输出：最终气象驱动文件存放的文件夹
 OUTPUT_FORCING_DIR = Path(r"C:\Users\yc\Desktop\vic\huaihe\F_F\vic\forcing")
 
-# --- 2. 准备工作 ---
-os.makedirs(OUTPUT_FORCING_DIR, exist_ok=True)
-print("最终气象驱动文件生成脚本开始...")
-
-# --- 3. 一次性读取所有变量和所有年份的数据 ---
-print("正在读取所有变量的NC文件...")
-# 需要从CMFD读取的变量列表
-variables_to_load = ['prec', 'temp', 'pres', 'srad', 'lrad', 'wind', 'shum']
-all_ds = []
-try:
-    for var in variables_to_load:
-        print(f"  - 正在加载变量: {var}")
-        # 使用 open_mfdataset 高效打开该变量所有年份的文件
-        ds_var = xr.open_mfdataset(
-            str(INPUT_DATA_DIR / f"{var}_*_huai.nc"),
-            combine='by_coords',
-            chunks={'time': 366} # 按年份分块读取
-        )
-        all_ds.append(ds_var)
-    
-    # 将所有变量合并到一个大的 xarray.Dataset 中
-    ds_merged = xr.merge(all_ds)
-    print("所有数据加载并合并完毕！")
-except Exception as e:
-    print(f"错误：读取NC文件时出错。请确保路径 '{INPUT_DATA_DIR}' 下包含所有必需的变量文件。错误信息: {e}")
-    exit()
-
-# --- 4. 筛选时间范围 (1991-2020) ---
-print("正在筛选 1991-01-01 到 2020-12-31 的数据...")
-ds_merged = ds_merged.sel(time=slice('1991-01-01', '2020-12-31'))
-# 检查天数是否正确 (30年 * 365 + 8个闰年 = 10958天)
-# 如果您的数据包含1990，请使用 slice('1990-01-01', '2020-12-31')
-print(f"数据筛选完毕，共包含 {len(ds_merged.time)} 天。")
-
-
-# --- 5. 确定需要处理的有效格网 ---
-print("正在确定有效格网坐标...")
-master_var = 'wind' # 以任一变量为标准
-valid_points = ds_merged[master_var].isel(time=0).stack(gridcell=('y', 'x')).dropna('gridcell')
-lats = valid_points.coords['y'].values
-lons = valid_points.coords['x'].values
-num_grids = len(lats)
-print(f"已确定 {num_grids} 个有效格网。")
-
-# --- 6. 为每个格网生成一个驱动文件 ---
-print(f"\n开始为 {num_grids} 个格网生成驱动文件 (这可能需要较长时间)...")
-for i in range(num_grids):
-    lat, lon = lats[i], lons[i]
-    
-    # 构造输出文件名，保留4位小数
-    output_filename = f"huai_01dy_025deg_{lat:.4f}_{lon:.4f}"
-    output_path = OUTPUT_FORCING_DIR / output_filename
-    
-    print(f"  ({i+1}/{num_grids}) 正在处理格网: lat={lat:.4f}, lon={lon:.4f} -> {output_filename}")
-    
-    # 提取该格网所有时间序列的数据并加载到内存
-    cell_data = ds_merged.sel(y=lat, x=lon, method='nearest').compute()
-    
-    # 转换为Pandas DataFrame以便于计算和写入
-    df = cell_data.to_dataframe()
-    
-    # --- 7. 单位换算与参数计算 ---
-    df_out = pd.DataFrame(index=df.index) # 创建一个新的DataFrame用于存储最终结果
-    
-    # 1. 气温 (air_temp): 从 K 转换为 °C
-    df_out['air_temp'] = df['temp'] - 273.15
+# --- 1b. 提取方式 ---
+# True: 按时间块一次读取所有格网，单位换算以整块数组完成 (快)
+# False: 沿用逐格网 sel().compute() 的方式 (慢，仅用于核对结果)
+VECTORIZED_EXTRACTION = True
+# 每个时间块的天数；None 表示一次读取全部时间
+# (内存约为 天数 × 格网数 × 7 × 4 字节，淮河 30 年约 200 MB)
+EXTRACT_BLOCK_DAYS = 3653
+# True: 流式处理，逐年 (或每 STREAM_BLOCK_DAYS 天) 读取、换算，并把该块的行追加到每个格网的文件末尾；
+#       内存峰值约为 一个块 × 格网数 × 7，与总年数无关 (适用于全国等大范围)
+STREAM_BY_BLOCK = False
+# 流式处理时每块的天数；None 表示按自然年分块
+STREAM_BLOCK_DAYS = None
 
-    # 2. 降水 (prec): 从 kg/m2/s (即 mm/s) 转换为 mm/day
-    df_out['prec'] = df['prec'] * 86400
+# --- 1c. 输出格式与写出方式 ---
+# 'ascii': VIC 文本驱动文件 (制表符分隔，保留4位小数)
+# 'binary': VIC 4 二进制驱动文件 (每个数值 2 字节，体积约为文本的 1/4，VIC 无需解析文本)，
+#           乘数与有无符号见 vic_forcing.BINARY_FORCE_TYPES，全局参数文件片段另存为 global_forcing_binary.txt
+# 'image': VIC 5 image driver 使用的逐年 NetCDF 文件 (整个 0.25° 格网，按时间步分块)，
+#          全局参数文件片段另存为 global_forcing_image.txt
+OUTPUT_FORMAT = 'ascii'
+# 二进制驱动文件存放的文件夹
+OUTPUT_BINARY_DIR = Path(r"C:\Users\yc\Desktop\vic\huaihe\F_F\vic\forcing_bin")
+# image driver 驱动文件存放的文件夹及文件名前缀 (文件名为 前缀 + 年份 + .nc)
+OUTPUT_IMAGE_DIR = Path(r"C:\Users\yc\Desktop\vic\huaihe\F_F\vic\forcing_image")
+IMAGE_FILE_PREFIX = "huai_forcing_"
+# 写出驱动文件的进程数；1 表示在主进程中写出
+WRITE_WORKERS = 1
+# WRITE_WORKERS > 1 时，把换算后的 (时间, 格网, 变量) 数组放在共享内存中，
+# 各进程直接读取自己负责的格网，不再把每个格网的数据复制给子进程
+SHARED_MEMORY_WRITE = True
 
-    # 3. 气压 (pressure): 从 Pa 转换为 kPa
-    df_out['pressure'] = df['pres'] / 1000.0
+# --- 1d. 时间范围与增量更新 ---
+# 起始日期；结束日期为 None 时取输入文件中的最后一天 (CMFD 发布新的年份后无需修改)
+TIME_START = '1991-01-01'
+TIME_END = None
+# True: 已有驱动文件只追加其末尾之后的新日期 (已有行数即从 TIME_START 起已覆盖的天数)，
+#       新增一年只需处理一年的数据；旧年份的输入被重新生成过时请设为 False 以整体重写
+INCREMENTAL_APPEND = False
 
-    # 4. 短波辐射 (swdown): 单位 W/m2，仅重命名
-    df_out['swdown'] = df['srad']
-    
-    # 5. 长波辐射 (lwdown): 单位 W/m2，仅重命名
-    df_out['lwdown'] = df['lrad']
+# --- 1e. 按格网分块的合并数据 (由 rechunk_forcing.py 生成) ---
+# 设为该文件路径时直接从中按格网块读取 (每个格网的完整时间序列存放在同一个数据块中)，
+# 不再打开逐年的 _huai.nc 文件；None 表示不使用。image 格式需要完整格网，不能使用该文件
+FORCING_STORE = None
+# 每次从合并数据中读取的格网数 (内存约为 天数 × 该格网数 × 7)
+STORE_BLOCK_CELLS = 64
 
-    # 6. 水汽压 (vp): 根据比湿(shum)和气压(pres)计算，并转换为kPa
-    df_out['vp'] = (df['shum'] * df['pres']) / (0.622 + 0.378 * df['shum']) / 1000.0
-    
-    # 7. 风速 (wind): 单位 m/s，无需转换
-    df_out['wind'] = df['wind']
+# --- 1f. 同时生成次日尺度驱动文件 ---
+# 每天的时段数 (4 即 6 小时，8 即 3 小时，须能整除 24)；None 表示只生成日尺度文件。
+# 由内存中的日数据直接拆分，与日尺度文件一同写出 (文件名相同)，不必再运行 disaggregate_forcing.py
+SUBDAILY_STEPS_PER_DAY = None
+# 'uniform': 降水平均分配，其余变量保持日值 (与 disaggregate_forcing.py 原来的做法相同)
+# 'diurnal': 按太阳高度角分配短波辐射，并生成气温、长波辐射的日变化 (见 disaggregation.diurnal_forcing)
+SUBDAILY_METHOD = 'uniform'
+# 'diurnal' 时驱动文件时间相对 UTC 的时区 (小时)；None 表示地方太阳时 (土壤参数 off_gmt = 经度 / 15)
+SUBDAILY_UTC_OFFSET = None
+OUTPUT_SUBDAILY_DIR = Path(r"C:\Users\yc\Desktop\vic\huaihe\F_F\vic\forcing_6H")
+
+# --- 1g. 次日尺度输入 ---
+# 输入为 forcing.py 由 CMFD 3 小时产品 (PRODUCT = '03hr') 生成的 _huai.nc 时，时间步长由文件自动识别，
+# 写出真正的 3 小时驱动文件 (文件名为 huai_03hr_025deg_纬度_经度，降水为每个时段的累计量 mm)，
+# 各处以天为单位的块大小 (EXTRACT_BLOCK_DAYS、STREAM_BLOCK_DAYS) 仍按天计。
+# 同时由同一份数据汇总写出日尺度驱动文件 (降水为日累计，其余变量为日平均) 的文件夹；None 表示不写
+OUTPUT_DAILY_DIR = None
 
-    # --- 8. 整理并写入文件 ---
-    # 严格按照您指定的顺序选择最终的列
-    final_columns_order = ['air_temp', 'prec', 'pressure', 'swdown', 'lwdown', 'vp', 'wind']
-    vic_forcing_df = df_out[final_columns_order]
+if __name__ == "__main__":
+    # --- 2. 准备工作 ---
+    output_dirs = {'ascii': OUTPUT_FORCING_DIR, 'binary': OUTPUT_BINARY_DIR, 'image': OUTPUT_IMAGE_DIR}
+    if OUTPUT_FORMAT not in output_dirs:
+        print(f"错误: 未知的输出格式 '{OUTPUT_FORMAT}'，可选 {list(output_dirs)}。"); exit()
+    output_dir = output_dirs[OUTPUT_FORMAT]
+    if FORCING_STORE is not None and OUTPUT_FORMAT == 'image':
+        print("错误: image 格式需要完整格网，请将 FORCING_STORE 设为 None。"); exit()
+    if SUBDAILY_STEPS_PER_DAY and (OUTPUT_FORMAT == 'image' or 24 % SUBDAILY_STEPS_PER_DAY):
+        print(f"错误: SUBDAILY_STEPS_PER_DAY={SUBDAILY_STEPS_PER_DAY} 无效 (须能整除 24，且不能用于 image 格式)。"); exit()
+    if SUBDAILY_STEPS_PER_DAY and SUBDAILY_METHOD not in ('uniform', 'diurnal'):
+        print(f"错误: 未知的次日尺度拆分方法 '{SUBDAILY_METHOD}'，可选 'uniform'、'diurnal'。"); exit()
+    os.makedirs(output_dir, exist_ok=True)
+    if SUBDAILY_STEPS_PER_DAY:
+        os.makedirs(OUTPUT_SUBDAILY_DIR, exist_ok=True)
+    print("最终气象驱动文件生成脚本开始...")
+
+    # --- 3. 一次性读取所有变量和所有年份的数据 ---
+    print("正在读取所有变量的NC文件...")
+    # 需要从CMFD读取的变量列表
+    variables_to_load = CMFD_VARIABLES
+    all_ds = []
+    try:
+        if FORCING_STORE is not None:
+            # 按格网分块的合并数据已包含所有变量和年份
+            print(f"  - 正在打开合并数据: {FORCING_STORE}")
+            all_ds.append(xr.open_dataset(FORCING_STORE)[variables_to_load])
+        for var in ([] if FORCING_STORE is not None else variables_to_load):
+            print(f"  - 正在加载变量: {var}")
+            # 使用 open_mfdataset 高效打开该变量所有年份的文件
+            ds_var = xr.open_mfdataset(
+                str(INPUT_DATA_DIR / f"{var}_*_huai.nc"),
+                combine='by_coords',
+                chunks={'time': 366} # 按年份分块读取
+            )
+            all_ds.append(ds_var)
     
-    # 将数据写入文本文件，使用制表符 '\t' 作为分隔符，保留4位小数
-    vic_forcing_df.to_csv(
-        output_path,
-        sep='\t',
-        header=False,
-        index=False,
-        float_format='%.4f'
+        # 将所有变量合并到一个大的 xarray.Dataset 中
+        ds_merged = xr.merge(all_ds)
+        print("所有数据加载并合并完毕！")
+    except Exception as e:
+        print(f"错误：读取NC文件时出错。请确保路径 '{INPUT_DATA_DIR}' 下包含所有必需的变量文件。错误信息: {e}")
+        exit()
+
+    # --- 4. 筛选时间范围 (默认从 1991-01-01 到输入文件的最后一天) ---
+    print(f"正在筛选 {TIME_START} 到 {TIME_END or '最后一天'} 的数据...")
+    ds_merged = ds_merged.sel(time=slice(TIME_START, TIME_END))
+    # 时间步长: 日尺度产品为 24 小时，3 小时产品为 3 小时
+    step_hours = forcing_step_hours(ds_merged.time.values)
+    steps_per_day = 24 // step_hours
+    if steps_per_day > 1 and SUBDAILY_STEPS_PER_DAY:
+        print("错误: 输入已是次日尺度数据，请将 SUBDAILY_STEPS_PER_DAY 设为 None。"); exit()
+    file_prefix = "huai_01dy_025deg_" if steps_per_day == 1 else f"huai_{step_hours:02d}hr_025deg_"
+    # 检查天数是否正确 (1991-2020 共 30年 * 365 + 8个闰年 = 10958天)
+    print(f"数据筛选完毕，共包含 {len(ds_merged.time) // steps_per_day} 天"
+          + (f" ({len(ds_merged.time)} 个 {step_hours} 小时时次)" if steps_per_day > 1 else "") + " "
+          f"({pd.Timestamp(ds_merged.time.values[0]).date()} 至 {pd.Timestamp(ds_merged.time.values[-1]).date()})。")
+
+
+    # --- 5. 确定需要处理的有效格网 ---
+    print("正在确定有效格网坐标...")
+    master_var = 'wind' # 以任一变量为标准
+    if FORCING_STORE is not None:
+        # 合并数据中只有有效格网，cell 维的序号即格网序号
+        lats, lons = ds_merged['lat'].values, ds_merged['lon'].values
+        grid_iy, grid_ix = np.arange(len(lats)), None
+    else:
+        grid_iy, grid_ix, lats, lons = valid_cells(ds_merged[master_var].isel(time=0))
+    num_grids = len(lats)
+    print(f"已确定 {num_grids} 个有效格网。")
+
+    # --- 5b. 产物缓存 ---
+    # 所有格网共用的输入指纹: 全部 _huai.nc 文件、本脚本以及时间范围等配置。
+    # 每个格网写完后立即记入清单，中断后重新运行会跳过已完成的格网。
+    cache = ArtifactCache(output_dir / MANIFEST_NAME)
+    if FORCING_STORE is not None:
+        input_files = [Path(FORCING_STORE)]
+    else:
+        input_files = sorted(f for var in variables_to_load for f in INPUT_DATA_DIR.glob(f"{var}_*_huai.nc"))
+    base_key = cache.key(
+        inputs=input_files + [Path(__file__)],
+        config={'time': [TIME_START, TIME_END], 'variables': variables_to_load, 'format': OUTPUT_FORMAT,
+                'subdaily': [SUBDAILY_STEPS_PER_DAY, SUBDAILY_METHOD, SUBDAILY_UTC_OFFSET],
+                'daily': OUTPUT_DAILY_DIR is not None and steps_per_day > 1},
     )
 
-print("\n全部处理成功完成！")
-print(f"已在 '{OUTPUT_FORCING_DIR}' 文件夹下生成 {num_grids} 个气象驱动文件。")
\ No newline at end of file
+    # --- 5c. VIC 5 image driver: 逐年写出整个格网，不再逐格网处理 ---
+    if OUTPUT_FORMAT == 'image':
+        years = sorted(set(pd.DatetimeIndex(ds_merged.time.values).year))
+        print(f"\n开始生成 {len(years)} 个年度 image driver 驱动文件...")
+        n_skipped = 0
+        for year in years:
+            output_path = output_dir / f"{IMAGE_FILE_PREFIX}{year}.nc"
+            # 每年的文件只依赖该年的输入，新增一年时已有年份的文件保持不变
+            year_files = [f for f in input_files if huai_file_year(f) == year]
+            year_key = cache.key(inputs=year_files + [Path(__file__)],
+                                 config={'variables': variables_to_load, 'format': OUTPUT_FORMAT, 'year': int(year)})
+            if cache.is_fresh(output_path, year_key):
+                n_skipped += 1
+                continue
+            print(f"  - 正在处理 {year} 年 -> {output_path.name}")
+            ds_image = image_forcing_dataset(ds_merged.sel(time=str(year)), variables=variables_to_load, step_hours=step_hours)
+            write_image_forcing_file(ds_image, output_path)
+            cache.record(output_path, year_key)
+        snippet_path = output_dir / "global_forcing_image.txt"
+        with open(snippet_path, 'w', encoding='utf-8') as f:
+            f.write(image_global_snippet(f"{output_dir / IMAGE_FILE_PREFIX}"))
+        print("\n全部处理成功完成！")
+        if n_skipped:
+            print(f"其中 {n_skipped} 个年份的输入未变化，沿用了已有文件。")
+        print(f"已在 '{output_dir}' 文件夹下生成 {len(years)} 个年度驱动文件。")
+        print(f"全局参数文件的驱动设置已写入: {snippet_path}")
+        exit()
+
+    # --- 5d. 与驱动文件一同写出的另一时间尺度的文件 (见 1f、1g) ---
+    def companion_path(output_path):
+        """与 output_path 一同写出的次日尺度或日尺度文件；没有时返回 None。"""
+        if SUBDAILY_STEPS_PER_DAY:
+            return OUTPUT_SUBDAILY_DIR / output_path.name
+        if steps_per_day > 1 and OUTPUT_DAILY_DIR is not None:
+            return OUTPUT_DAILY_DIR / output_path.name.replace(file_prefix, "huai_01dy_025deg_", 1)
+        return None
+
+    def companion_rows(rows):
+        """驱动文件有 rows 行时，对应文件应有的行数。"""
+        if SUBDAILY_STEPS_PER_DAY:
+            return rows * SUBDAILY_STEPS_PER_DAY
+        return rows // steps_per_day if rows % steps_per_day == 0 else None
+
+    if companion_path(output_dir / file_prefix) is not None:
+        os.makedirs(companion_path(output_dir / file_prefix).parent, exist_ok=True)
+
+    # --- 6. 找出需要 (重新) 生成的格网 ---
+    n_skipped = 0
+    pending = []  # (格网序号, 输出路径, 缓存键)
+    for i in range(num_grids):
+        lat, lon = lats[i], lons[i]
+    
+        # 构造输出文件名，保留4位小数
+        output_filename = f"{file_prefix}{lat:.4f}_{lon:.4f}"
+        output_path = output_dir / output_filename
+        cell_key = cache.key(config={'base': base_key, 'lat': float(lat), 'lon': float(lon)})
+        if cache.is_fresh(output_path, cell_key) and (
+                companion_path(output_path) is None or cache.is_fresh(companion_path(output_path), cell_key)):
+            n_skipped += 1
+            continue
+        pending.append((i, output_path, cell_key))
+
+    def cell_writer(start=0, append=False):
+        """写出格网从第 start 天开始的数据的函数 (可以传给子进程)。"""
+        writer = write_binary_forcing_file if OUTPUT_FORMAT == 'binary' else write_forcing_file
+        if SUBDAILY_STEPS_PER_DAY:
+            # 每个格网的数据写出日尺度文件后，立即拆分写出次日尺度文件
+            writer = partial(write_with_subdaily, writer=writer, subdaily_dir=OUTPUT_SUBDAILY_DIR,
+                             steps_per_day=SUBDAILY_STEPS_PER_DAY, method=SUBDAILY_METHOD,
+                             start_date=str(pd.Timestamp(ds_merged.time.values[start]).date()),
+                             utc_offset=SUBDAILY_UTC_OFFSET)
+        elif companion_path(output_dir / file_prefix) is not None:
+            # 次日尺度输入: 写出驱动文件后，立即汇总写出日尺度文件
+            writer = partial(write_with_daily, writer=writer, daily_dir=OUTPUT_DAILY_DIR, steps_per_day=steps_per_day,
+                             rename=(file_prefix, "huai_01dy_025deg_"))
+        return partial(writer, append=append)
+
+    def record_output(key, path):
+        # 每写完一个文件立即记入清单
+        output_path, cell_key = key
+        cache.record(output_path, cell_key)
+        if companion_path(output_path) is not None:
+            cache.record(companion_path(output_path), cell_key)
+
+    def stream_cells(cells, start=0, append=False):
+        """逐个时间块读取、换算并写出 cells 中格网从第 start 天开始的数据，返回失败列表。
+
+        append=False 时第一块新建文件、之后的块追加；append=True 时所有块都追加到已有文件末尾。
+        """
+        ds_part = ds_merged.isel(time=slice(start, None))
+        if STREAM_BLOCK_DAYS:
+            blocks = time_blocks(len(ds_part.time), STREAM_BLOCK_DAYS * steps_per_day)
+        else:
+            blocks = year_blocks(ds_part.time.values)
+        cells_idx = [i for i, _, _ in cells]
+        active = list(range(len(cells)))  # 尚未出错的格网
+        failures = []
+        for b, (block, data) in enumerate(iter_cell_blocks(ds_part, grid_iy[cells_idx], grid_ix[cells_idx], blocks,
+                                                           step_hours=step_hours)):
+            first_day = pd.Timestamp(ds_part.time.values[block.start]).date()
+            print(f"  ({b+1}/{len(blocks)}) 正在写入 {first_day} 起的 {(block.stop - block.start) // steps_per_day} 天...")
+            jobs = ((cells[k][1:], cells[k][1], data[:, k, :]) for k in active)
+            block_failures = write_forcing_files(jobs, num_workers=WRITE_WORKERS,
+                                                 writer=cell_writer(start + block.start, append or b > 0))
+            if block_failures:
+                # 出错的格网文件已不完整，之后的块不再写入，也不记入清单
+                failed_paths = {output_path for (output_path, _), _, _ in block_failures}
+                active = [k for k in active if cells[k][1] not in failed_paths]
+                failures += block_failures
+        # 所有块都写完后，文件才是完整的，此时才记入清单
+        for k in active:
+            record_output(cells[k][1:], cells[k][1])
+        return failures
+
+    def store_cells(cells, start=0, append=False):
+        """从合并数据中按格网块读取 cells 中格网从第 start 天开始的数据并写出，返回失败列表。"""
+        def jobs():
+            cells_idx = [i for i, _, _ in cells]
+            for positions, data in iter_store_blocks(ds_merged, cells_idx, STORE_BLOCK_CELLS, start, variables_to_load,
+                                                     step_hours):
+                for k, p in enumerate(positions):
+                    i, output_path, cell_key = cells[p]
+                    print(f"  ({i+1}/{num_grids}) 正在处理格网: lat={lats[i]:.4f}, lon={lons[i]:.4f} -> {output_path.name}")
+                    yield (output_path, cell_key), output_path, data[:, k, :]
+        return write_forcing_files(jobs(), num_workers=WRITE_WORKERS, on_done=record_output,
+                                   writer=cell_writer(start, append))
+
+    # 并行写出时存放换算结果的共享内存 (见第 7、8 步)
+    shared_cube = None
+
+    # --- 6b. 增量更新: 已有文件覆盖了前 n 天的格网只追加之后的新数据 ---
+    failures = []
+    if INCREMENTAL_APPEND and pending:
+        n_time = len(ds_merged.time)
+        appends = {}  # 已有天数 -> [(格网序号, 输出路径, 缓存键)]
+        full_rewrite = []
+        for cell in pending:
+            rows = existing_rows(cell[1], binary=OUTPUT_FORMAT == 'binary')
+            if rows and companion_path(cell[1]) is not None and (
+                    companion_rows(rows) is None
+                    or existing_rows(companion_path(cell[1]), binary=OUTPUT_FORMAT == 'binary') != companion_rows(rows)):
+                # 对应的次日尺度/日尺度文件与驱动文件的天数不一致时两者一起重写
+                rows = None
+            if rows == n_time:
+                # 已覆盖全部日期，只是缓存键因新增输入文件而改变
+                record_output(cell[1:], cell[1])
+                n_skipped += 1
+            elif rows and rows < n_time:
+                appends.setdefault(rows, []).append(cell)
+            else:
+                # 文件不存在、末尾不完整或比当前时间范围还长时整体重写
+                full_rewrite.append(cell)
+        for rows, cells in sorted(appends.items()):
+            first_new = pd.Timestamp(ds_merged.time.values[rows]).date()
+            print(f"\n{len(cells)} 个格网已有前 {rows} 天的数据，正在追加 {first_new} 起的 {n_time - rows} 天...")
+            if FORCING_STORE is not None:
+                failures += store_cells(cells, start=rows, append=True)
+            else:
+                failures += stream_cells(cells, start=rows, append=True)
+        pending = full_rewrite
+
+    # --- 7. 提取数据并完成单位换算 ---
+    # 换算公式见 vic_forcing.convert_to_vic:
+    # 气温 K -> °C，降水 mm/s -> mm/day，气压 Pa -> kPa，由比湿和气压计算水汽压 (kPa)
+    if pending and FORCING_STORE is not None:
+        # --- 7'/8'. 从按格网分块的合并数据读取: 每次读取 STORE_BLOCK_CELLS 个格网的完整时间序列 ---
+        print(f"\n开始从合并数据为 {len(pending)} 个格网生成驱动文件 (写出进程数: {WRITE_WORKERS})...")
+        failures += store_cells(pending)
+        pending = []
+    elif pending and STREAM_BY_BLOCK:
+        # --- 7'/8'. 流式处理: 每次只读取一个时间块，第一块新建文件，之后的块追加 ---
+        print(f"\n开始流式生成 {len(pending)} 个格网的驱动文件 (写出进程数: {WRITE_WORKERS})...")
+        failures += stream_cells(pending)
+        pending = []
+    elif pending and VECTORIZED_EXTRACTION:
+        print(f"\n正在一次性提取 {len(pending)} 个格网的数据 (每块 {EXTRACT_BLOCK_DAYS or len(ds_merged.time) // steps_per_day} 天)...")
+        pending_idx = [i for i, _, _ in pending]
+        if WRITE_WORKERS > 1 and SHARED_MEMORY_WRITE:
+            shared_cube = SharedCube((len(ds_merged.time), len(pending), len(FORCING_COLUMNS)),
+                                     forcing_dtype(ds_merged, variables_to_load))
+        forcing_cube = extract_cells(ds_merged, grid_iy[pending_idx], grid_ix[pending_idx],
+                                     block_size=EXTRACT_BLOCK_DAYS and EXTRACT_BLOCK_DAYS * steps_per_day,
+                                     out=shared_cube.array if shared_cube is not None else None, step_hours=step_hours)
+        print("数据提取与单位换算完毕。")
+
+    # --- 8. 为每个格网写出驱动文件 ---
+    # 按 '%.4f' 格式、制表符分隔写出，与 DataFrame.to_csv(sep='\t', float_format='%.4f') 逐字节相同
+    def forcing_jobs():
+        for k, (i, output_path, cell_key) in enumerate(pending):
+            lat, lon = lats[i], lons[i]
+            print(f"  ({i+1}/{num_grids}) 正在处理格网: lat={lat:.4f}, lon={lon:.4f} -> {output_path.name}")
+            if VECTORIZED_EXTRACTION:
+                # 从 (时间, 格网, 变量) 数组中切出该格网的列
+                data = forcing_cube[:, k, :]
+            else:
+                # 提取该格网所有时间序列的数据并加载到内存
+                cell_data = ds_merged.sel(y=lat, x=lon, method='nearest').compute()
+                converted = convert_to_vic({var: cell_data[var].values for var in variables_to_load}, step_hours)
+                # 严格按照 VIC 要求的顺序排列各列
+                data = np.column_stack([converted[col] for col in FORCING_COLUMNS])
+            yield (output_path, cell_key), output_path, data
+
+    if pending and shared_cube is not None:
+        print(f"\n开始由 {WRITE_WORKERS} 个进程从共享内存写出 {len(pending)} 个格网的驱动文件...")
+        try:
+            jobs = [((output_path, cell_key), output_path, k) for k, (_, output_path, cell_key) in enumerate(pending)]
+            failures += write_cells_shared(shared_cube, jobs, WRITE_WORKERS, on_done=record_output, writer=cell_writer())
+        finally:
+            forcing_cube = None
+            shared_cube.close()
+    elif pending:
+        print(f"\n开始为 {len(pending)} 个格网生成{'二进制' if OUTPUT_FORMAT == 'binary' else '文本'}驱动文件 (写出进程数: {WRITE_WORKERS})...")
+        failures += write_forcing_files(forcing_jobs(), num_workers=WRITE_WORKERS, on_done=record_output, writer=cell_writer())
+
+    if OUTPUT_FORMAT == 'binary':
+        # 全局参数文件中对应的驱动设置，FORCING1 为文件名前缀 (VIC 会在其后接 纬度_经度)
+        snippet_path = output_dir / "global_forcing_binary.txt"
+        start_date = pd.Timestamp(ds_merged.time.values[0])
+        with open(snippet_path, 'w', encoding='utf-8') as f:
+            f.write(binary_global_snippet(f"{output_dir / file_prefix}", start_date, force_dt=step_hours))
+        print(f"全局参数文件的驱动设置已写入: {snippet_path}")
+        companion_prefix = companion_path(output_dir / file_prefix)
+        if companion_prefix is not None:
+            snippet_path = companion_prefix.parent / "global_forcing_binary.txt"
+            with open(snippet_path, 'w', encoding='utf-8') as f:
+                f.write(binary_global_snippet(f"{companion_prefix}", start_date,
+                                              force_dt=24 // SUBDAILY_STEPS_PER_DAY if SUBDAILY_STEPS_PER_DAY else 24))
+            print(f"{'次日尺度' if SUBDAILY_STEPS_PER_DAY else '日尺度'}驱动的全局参数设置已写入: {snippet_path}")
+
+    print("\n全部处理成功完成！")
+    if n_skipped:
+        print(f"其中 {n_skipped} 个格网的输入未变化，沿用了已有文件。")
+    print(f"已在 '{output_dir}' 文件夹下生成 {num_grids - len(failures)} 个气象驱动文件。")
+    if SUBDAILY_STEPS_PER_DAY:
+        print(f"对应的 {24 // SUBDAILY_STEPS_PER_DAY} 小时驱动文件位于 '{OUTPUT_SUBDAILY_DIR}'。")
+    elif companion_path(output_dir / file_prefix) is not None:
+        print(f"由 {step_hours} 小时数据汇总的日尺度驱动文件位于 '{OUTPUT_DAILY_DIR}'。")
+    # 隐藏文件: 不会被 disaggregate_forcing.py 当作驱动文件读取，也不计入流水线的输出摘要
+    log_path = output_dir / ".forcing_failures.log"
+    if not failures:
+        # 上次运行留下的错误记录已过时
+        log_path.unlink(missing_ok=True)
+    else:
+        with open(log_path, 'w', encoding='utf-8') as f:
+            for (output_path, _), message, tb in failures:
+                print(f"  - 失败: {output_path.name}: {message}")
+                f.write(f"{output_path.name}: {message}\n{tb}\n")
+        print(f"详细错误信息已写入: {log_path}")
\ No newline at end of file
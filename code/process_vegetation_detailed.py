@@ -8,6 +8,7 @@ from shapely.geometry import box
 from rasterstats import zonal_stats
 import warnings
 import rioxarray
+from artifact_cache import ArtifactCache, MANIFEST_NAME
 
 # --- 0. 忽略良性的库警告 ---
 warnings.filterwarnings("ignore", category=FutureWarning)
@@ -22,6 +23,11 @@ VEG_PARAM_OUT = Path(r"C:\Users\yc\Desktop\vic\huaihe\F_F\vic\param\vic_veg_para
 # --- 2. 准备工作 ---
 os.makedirs(VEG_PARAM_OUT.parent, exist_ok=True)
 print("处理开始...")
+# --- 增量缓存: 输入文件、本脚本和配置都未变化时直接跳过 ---
+cache = ArtifactCache(VEG_PARAM_OUT.parent / MANIFEST_NAME)
+cache_key = cache.key(inputs=[MASTER_GRID_NC, VEG_RASTER_IN, VEGLIB_FILE, Path(__file__)])
+if cache.is_fresh(VEG_PARAM_OUT, cache_key):
+    print(f"输入未变化，{VEG_PARAM_OUT.name} 已是最新，跳过。"); exit()
 
 # --- 3. 解析植被库文件 ---
 print(f"正在解析植被库文件: {VEGLIB_FILE.name}")
@@ -124,6 +130,7 @@ if output_lines:
     with open(VEG_PARAM_OUT, 'w') as f:
         f.write("\n".join(output_lines))
         f.write("\n")
+    cache.record(VEG_PARAM_OUT, cache_key)
     print(f"\n处理成功完成！共为 {len(output_lines)} 个有效格网生成了参数。")
 else:
     print("\n处理完成，但未能生成任何有效的植被参数。输出文件为空。")
\ No newline at end of file
@@ -0,0 +1,191 @@
+import os
+import warnings
+from pathlib import Path
+
+import netCDF4
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+from artifact_cache import ArtifactCache, MANIFEST_NAME
+from vic_forcing import CMFD_VARIABLES, valid_cells, huai_file_year
+
+# ====================================================================
+# --- 0. 配置 ---
+# ====================================================================
+# 输入：forcing.py 输出的逐年 _huai.nc 文件所在文件夹
+INPUT_DATA_DIR = Path(r"H:\CMFD\huai\Data_forcing_01dy_010deg")
+# 输出：按格网存放的合并数据 (所有变量、所有年份)，供 process_forcing.py 等逐格网读取
+STORE_PATH = INPUT_DATA_DIR / "huai_forcing_cells.nc"
+# 写入的变量
+VARIABLES = CMFD_VARIABLES
+# 以该变量第一个时次的非 NaN 格网作为有效格网 (与 process_forcing.py 相同)
+MASTER_VAR = 'wind'
+
+# 每个数据块包含的格网数。块形状为 (全部时间, CELL_CHUNK)，
+# 读取一个格网的完整时间序列只需解压一个块；块越大压缩率越高，但读取单个格网时多读的数据也越多
+CELL_CHUNK = 16
+# zlib 压缩级别 (1-9)，配合 shuffle 过滤器
+COMPLEVEL = 4
+# 第一遍中间文件的块在时间方向的长度 (时次)
+TMP_TIME_CHUNK = 366
+
+
+def list_year_files(input_dir, variables):
+    """返回 {年份: {变量: [文件]}} (按文件名即时间排序；日尺度产品每年一个文件，3 小时产品每月一个)，
+    只保留所有变量都齐全、且各变量文件数相同的年份。"""
+    by_year = {}
+    for var in variables:
+        for nc_file in sorted(input_dir.glob(f"{var}_*_huai.nc")):
+            year = huai_file_year(nc_file)
+            if year is None:
+                print(f"  - 警告: 文件名 '{nc_file.name}' 格式不规范, 无法提取年份, 已跳过。")
+                continue
+            by_year.setdefault(year, {}).setdefault(var, []).append(nc_file)
+    complete = {}
+    for year, files in sorted(by_year.items()):
+        missing = [var for var in variables if var not in files]
+        if missing:
+            print(f"  - 警告: {year} 年缺少变量 {missing}，该年已跳过。")
+            continue
+        counts = {var: len(files[var]) for var in variables}
+        if len(set(counts.values())) > 1:
+            print(f"  - 警告: {year} 年各变量的文件数不一致 {counts}，该年已跳过。")
+            continue
+        complete[year] = files
+    return complete
+
+
+def _create_cell_variables(nc, variables, templates, chunk_shape, **compression):
+    for var in variables:
+        template = templates[var]
+        v = nc.createVariable(var, template['dtype'], ('time', 'cell'), chunksizes=chunk_shape,
+                              fill_value=template['fill_value'], **compression)
+        v.setncatts(template['attrs'])
+
+
+def build_cell_store(year_files, store_path, variables=VARIABLES, master_var=MASTER_VAR,
+                     cell_chunk=CELL_CHUNK, complevel=COMPLEVEL, tmp_time_chunk=TMP_TIME_CHUNK):
+    """把逐年 (或逐月) 的 (time, y, x) 文件重组为按格网分块的 (time, cell) NetCDF4 文件。
+
+    分两遍完成，内存始终有界:
+      1. 逐个文件读取每个变量，只保留有效格网，写入按 (TMP_TIME_CHUNK 个时次, CELL_CHUNK) 分块的未压缩中间文件
+         —— 内存约为 一个文件的时次数 × 格网数；
+      2. 逐个格网块读出全部时间，写入按 (全部时间, CELL_CHUNK) 分块的压缩文件
+         —— 内存约为 全部时间 × CELL_CHUNK。
+    直接按最终分块逐年写入会使每个压缩块被反复解压、重写 30 次，因此需要中间文件。
+    """
+    years = sorted(year_files)
+    store_path = Path(store_path)
+    tmp_path = store_path.with_name(store_path.stem + ".pass1.tmp.nc")
+    out_path = store_path.with_name(store_path.stem + ".tmp.nc")
+
+    # --- 有效格网、时间轴以及各变量的属性 ---
+    with xr.open_dataset(year_files[years[0]][master_var][0]) as ds:
+        iy, ix, lats, lons = valid_cells(ds[master_var].isel(time=0))
+    n_cells = len(iy)
+    times, templates = [], {}
+    for year in years:
+        for nc_file in year_files[year][master_var]:
+            with xr.open_dataset(nc_file) as ds:
+                times.append(ds['time'].values)
+    times = np.concatenate(times)
+    for var in variables:
+        with xr.open_dataset(year_files[years[0]][var][0]) as ds:
+            da = ds[var]
+            templates[var] = {
+                'dtype': da.dtype,
+                'fill_value': da.encoding.get('_FillValue', np.nan),
+                'attrs': {k: v for k, v in da.attrs.items() if k not in ('_FillValue', 'grid_mapping')},
+            }
+    # 比较完整的时间戳 (3 小时产品同一天有多个时次)
+    if not np.all(np.diff(times.astype('datetime64[s]').astype(np.int64)) > 0):
+        raise ValueError("各文件的时间轴不连续或有重叠。")
+    time_units = f"days since {pd.Timestamp(times[0]).date()}"
+    time_values = netCDF4.date2num(pd.DatetimeIndex(times).to_pydatetime(), time_units, calendar='standard')
+    print(f"有效格网 {n_cells} 个，共 {len(times)} 个时次 ({years[0]}-{years[-1]})。")
+
+    # --- 第一遍: 逐个文件写入中间文件 ---
+    print("第一遍: 逐个文件写入中间文件...")
+    with netCDF4.Dataset(tmp_path, 'w', format='NETCDF4') as tmp:
+        tmp.createDimension('time', len(times))
+        tmp.createDimension('cell', n_cells)
+        _create_cell_variables(tmp, variables, templates, (min(tmp_time_chunk, len(times)), min(cell_chunk, n_cells)))
+        for var in variables:
+            # 一个文件的数据最多跨两行数据块 (日尺度一年 366 天、3 小时产品一个月最多 248 个时次)，
+            # 缓存要能容纳这两行，避免部分写入的块被反复换出
+            tmp[var].set_var_chunk_cache(size=2 * tmp_time_chunk * n_cells * templates[var]['dtype'].itemsize + 1024 ** 2)
+        t0 = 0
+        for year in years:
+            n_year = 0
+            for i in range(len(year_files[year][master_var])):
+                n_steps = None
+                for var in variables:
+                    nc_file = year_files[year][var][i]
+                    with xr.open_dataset(nc_file) as ds:
+                        values = ds[var].transpose('time', 'y', 'x').values[:, iy, ix]
+                    if n_steps is None:
+                        n_steps = len(values)
+                    elif len(values) != n_steps:
+                        raise ValueError(f"{nc_file.name} 的时次数 ({len(values)}) 与其他变量 ({n_steps}) 不一致。")
+                    tmp[var][t0:t0 + n_steps, :] = values
+                t0 += n_steps
+                n_year += n_steps
+            print(f"  - {year} 年已写入 ({n_year} 个时次)")
+
+    # --- 第二遍: 逐个格网块写入最终的压缩文件 ---
+    print("第二遍: 按格网块重组并压缩...")
+    with netCDF4.Dataset(tmp_path, 'r') as tmp, netCDF4.Dataset(out_path, 'w', format='NETCDF4') as out:
+        tmp.set_auto_mask(False)
+        out.createDimension('time', len(times))
+        out.createDimension('cell', n_cells)
+        t = out.createVariable('time', 'f8', ('time',))
+        t.setncatts({'standard_name': 'time', 'units': time_units, 'calendar': 'standard'})
+        t[:] = time_values
+        for name, values, attrs in [
+            ('lat', lats, {'standard_name': 'latitude', 'units': 'degrees_north'}),
+            ('lon', lons, {'standard_name': 'longitude', 'units': 'degrees_east'}),
+        ]:
+            v = out.createVariable(name, 'f8', ('cell',))
+            v.setncatts(attrs)
+            v[:] = values
+        _create_cell_variables(out, variables, templates, (len(times), min(cell_chunk, n_cells)),
+                               zlib=True, complevel=complevel, shuffle=True)
+        for var in variables:
+            out[var].setncattr('coordinates', 'lat lon')
+        out.setncatts({
+            'title': 'Basin forcing, cell-major layout',
+            'source': 'CMFD clipped and resampled to 0.25 degree (forcing.py), rechunked by rechunk_forcing.py',
+            'Conventions': 'CF-1.6',
+        })
+        for c0 in range(0, n_cells, cell_chunk):
+            c1 = min(c0 + cell_chunk, n_cells)
+            for var in variables:
+                out[var][:, c0:c1] = tmp[var][:, c0:c1]
+    os.remove(tmp_path)
+    os.replace(out_path, store_path)
+    return store_path
+
+
+if __name__ == "__main__":
+    warnings.simplefilter(action='ignore', category=FutureWarning)
+    print(f"输入路径: {INPUT_DATA_DIR}")
+    print(f"输出文件: {STORE_PATH}\n")
+    year_files = list_year_files(INPUT_DATA_DIR, VARIABLES)
+    if not year_files:
+        print(f"错误: 在 {INPUT_DATA_DIR} 中没有找到所有变量都齐全的年份。"); exit()
+
+    # 输入文件和本脚本都未变化时跳过
+    cache = ArtifactCache(STORE_PATH.parent / MANIFEST_NAME)
+    input_files = [f for files in year_files.values() for var_files in files.values() for f in var_files]
+    cache_key = cache.key(inputs=input_files + [Path(__file__)],
+                          config={'variables': VARIABLES, 'master': MASTER_VAR, 'cell_chunk': CELL_CHUNK,
+                                  'complevel': COMPLEVEL})
+    if cache.is_fresh(STORE_PATH, cache_key):
+        print(f"输入未变化，{STORE_PATH.name} 已是最新，跳过。"); exit()
+
+    build_cell_store(year_files, STORE_PATH)
+    cache.record(STORE_PATH, cache_key)
+    size_in = sum(f.stat().st_size for f in input_files)
+    print(f"\n处理成功完成！{len(input_files)} 个文件 ({size_in / 1024 ** 2:.1f} MB) -> "
+          f"{STORE_PATH.name} ({STORE_PATH.stat().st_size / 1024 ** 2:.1f} MB)")
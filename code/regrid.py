@@ -0,0 +1,215 @@
+import hashlib
+import math
+import os
+from pathlib import Path
+
+import numpy as np
+import scipy.sparse as sp
+import xarray as xr
+from affine import Affine
+from rasterio.features import geometry_mask
+
+# 原始数据中可能出现的纬度/经度维度名
+LAT_NAMES = ('lat', 'latitude', 'y')
+LON_NAMES = ('lon', 'longitude', 'x')
+
+# 进程内缓存: 同一进程处理的所有文件共用一个算子
+_OPERATOR_CACHE = {}
+# 权重的计算方式改变时加 1，使磁盘上缓存的旧算子失效
+OPERATOR_VERSION = 2
+
+
+def find_lat_lon(ds):
+    """返回数据集中纬度、经度维度的名称。"""
+    lat_name = next(name for name in LAT_NAMES if name in ds.dims)
+    lon_name = next(name for name in LON_NAMES if name in ds.dims)
+    return lat_name, lon_name
+
+
+def _overlap_matrix(dst_edges, src_edges):
+    """一维权重矩阵 [目标格网, 源像元]，与 GDAL average 重采样 (GWKAverageOrMode) 的窗口权重相同。
+
+    以源像元为单位，目标格网覆盖 [lo, hi) 时，窗口为 floor(lo) 至 ceil(hi) 并截断在源范围内；
+    窗口内部的像元权重为 1，首个像元为 (首像元 + 1 - lo)，末个像元为 (hi - 末像元)。
+    目标格网超出源范围 (裁剪后范围的最后一行/列) 时，截断后端点像元的权重仍按到目标格网边界的距离计算，
+    会大于 1，这与按重叠面积加权不同，但与 rio.reproject 的结果一致。
+    """
+    n_src = len(src_edges) - 1
+    pos = (dst_edges - src_edges[0]) / (src_edges[1] - src_edges[0])
+    # GDAL 的取整容差: 边界重合时的浮点误差不会多出一个权重近似为 0 的像元 (否则会改变结果是否为 NaN)
+    i_min = np.maximum(np.floor(pos[:-1] + 1e-10), 0).astype(int)
+    i_max = np.minimum(np.ceil(pos[1:] - 1e-10), n_src).astype(int)
+    weights = sp.lil_matrix((len(dst_edges) - 1, n_src))
+    for d, (lo, hi, first, stop) in enumerate(zip(pos[:-1], pos[1:], i_min, i_max)):
+        if stop <= first:
+            continue
+        weights[d, first:stop] = 1.0
+        if stop - first == 1:
+            # 只有一个像元时权重在归一化中抵消，取覆盖长度即可
+            weights[d, first] = hi - lo
+        else:
+            weights[d, first] = first + 1 - lo
+            weights[d, stop - 1] = hi - (stop - 1)
+    return weights.tocsr()
+
+
+class RegridOperator:
+    """“裁剪 + 面积平均重采样”的稀疏算子。
+
+    等价于 ``rio.clip(..., drop=True, all_touched=...)`` 之后再执行
+    ``rio.reproject(resolution=..., resampling=Resampling.average)`` (权重见 _overlap_matrix，
+    裁剪后范围边缘的格网也与 GDAL 相同；差异只在 float32 舍入的量级，可运行 check_regrid.py 检查)。
+    唯一的区别是源数据在流域内有缺测 (NaN) 时，这些像元按缺测剔除，而 rio 路径会把 _FillValue 当作数值计入平均。
+    掩膜与面积权重只计算一次，保存为 (目标格网 × 源像元) 的稀疏矩阵，
+    之后每个文件的所有时次只需一次矩阵乘法。
+    """
+
+    def __init__(self, weights, src_rows, src_cols, lat_ascending, y, x):
+        self.weights = weights.tocsr()
+        self.src_rows = src_rows
+        self.src_cols = src_cols
+        self.lat_ascending = bool(lat_ascending)
+        self.y = np.asarray(y)
+        self.x = np.asarray(x)
+
+    @classmethod
+    def build(cls, src_lat, src_lon, basin_gdf, resolution=0.25, all_touched=True):
+        src_lat = np.asarray(src_lat, dtype=np.float64)
+        src_lon = np.asarray(src_lon, dtype=np.float64)
+        lat_ascending = src_lat[-1] > src_lat[0]
+        res_x = (src_lon[-1] - src_lon[0]) / (len(src_lon) - 1)
+        res_y_signed = (src_lat[-1] - src_lat[0]) / (len(src_lat) - 1)
+
+        # 1. 流域掩膜: 按源数据自身的行方向栅格化 (与 rio.clip 完全相同，
+        #    边界恰好落在像元边上时的取舍也一致)，之后再统一翻转为北向上
+        transform = Affine(res_x, 0.0, src_lon[0] - res_x / 2, 0.0, res_y_signed, src_lat[0] - res_y_signed / 2)
+        mask = geometry_mask(
+            basin_gdf.geometry.values, out_shape=(len(src_lat), len(src_lon)),
+            transform=transform, all_touched=all_touched, invert=True,
+        )
+        # 内部统一使用北向上 (纬度递减) 的排列，与 rioxarray 的输出一致
+        lat_desc = src_lat[::-1] if lat_ascending else src_lat
+        res_y = abs(res_y_signed)
+        if lat_ascending:
+            mask = mask[::-1]
+        if not mask.any():
+            raise ValueError("流域边界与源格网没有重叠。")
+        rows = np.flatnonzero(mask.any(axis=1))
+        cols = np.flatnonzero(mask.any(axis=0))
+        r0, r1, c0, c1 = rows[0], rows[-1] + 1, cols[0], cols[-1] + 1
+        mask = mask[r0:r1, c0:c1]
+
+        # 2. 裁剪后范围，以及 rio.reproject 推导出的目标格网
+        left = src_lon[0] - res_x / 2 + c0 * res_x
+        top = lat_desc[0] + res_y / 2 - r0 * res_y
+        # rasterio.warp.calculate_default_transform: 左上角不变，
+        # 像元数 = ceil(源像元数 × 源分辨率 / 目标分辨率)，容差用于消除浮点误差
+        dst_width = max(int(math.ceil((c1 - c0) * res_x / resolution - 1e-6)), 1)
+        dst_height = max(int(math.ceil((r1 - r0) * res_y / resolution - 1e-6)), 1)
+        x = left + (np.arange(dst_width) + 0.5) * resolution
+        y = top - (np.arange(dst_height) + 0.5) * resolution
+
+        # 3. 面积权重 = 经向重叠 × 纬向重叠，再剔除流域外的源像元
+        src_x_edges = left + np.arange(c1 - c0 + 1) * res_x
+        src_y_edges = top - np.arange(r1 - r0 + 1) * res_y
+        dst_x_edges = left + np.arange(dst_width + 1) * resolution
+        dst_y_edges = top - np.arange(dst_height + 1) * resolution
+        wx = _overlap_matrix(dst_x_edges, src_x_edges)
+        wy = _overlap_matrix(-dst_y_edges, -src_y_edges)
+        weights = sp.kron(wy, wx, format='csr') @ sp.diags(mask.ravel().astype(np.float64))
+        weights.eliminate_zeros()
+
+        if lat_ascending:
+            n_lat = len(src_lat)
+            src_rows = slice(n_lat - r1, n_lat - r0)
+        else:
+            src_rows = slice(r0, r1)
+        return cls(weights, src_rows, slice(c0, c1), lat_ascending, y, x)
+
+    def regrid_array(self, data):
+        """对 (..., lat, lon) 数组重采样，返回 (..., y, x)，保持原数据类型。"""
+        data = np.asarray(data)
+        block = data[..., self.src_rows, self.src_cols]
+        if self.lat_ascending:
+            block = block[..., ::-1, :]
+        lead_shape = block.shape[:-2]
+        flat = block.reshape(-1, block.shape[-2] * block.shape[-1]).T
+        valid = np.isfinite(flat)
+        numerator = self.weights @ np.where(valid, flat, 0.0)
+        denominator = self.weights @ valid.astype(np.float64)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            result = np.where(denominator > 0, numerator / denominator, np.nan)
+        result = result.T.reshape(lead_shape + (len(self.y), len(self.x)))
+        if np.issubdtype(data.dtype, np.floating):
+            result = result.astype(data.dtype, copy=False)
+        return result
+
+    def regrid_dataset(self, ds):
+        """对数据集中所有含经纬度维度的变量重采样，输出维度为 (..., y, x)。"""
+        lat_name, lon_name = find_lat_lon(ds)
+        coords = {
+            'y': ('y', self.y, {'axis': 'Y', 'long_name': 'latitude', 'standard_name': 'latitude', 'units': 'degrees_north'}),
+            'x': ('x', self.x, {'axis': 'X', 'long_name': 'longitude', 'standard_name': 'longitude', 'units': 'degrees_east'}),
+        }
+        out_vars = {}
+        for name, da in ds.data_vars.items():
+            if lat_name not in da.dims or lon_name not in da.dims:
+                continue
+            other_dims = [d for d in da.dims if d not in (lat_name, lon_name)]
+            da = da.transpose(*other_dims, lat_name, lon_name)
+            values = self.regrid_array(da.values)
+            attrs = {k: v for k, v in da.attrs.items() if k != 'grid_mapping'}
+            out_vars[name] = xr.DataArray(values, dims=other_dims + ['y', 'x'], attrs=attrs)
+            for dim in other_dims:
+                out_vars[name] = out_vars[name].assign_coords({dim: da[dim]})
+        return xr.Dataset(out_vars, coords=coords, attrs=ds.attrs)
+
+    def save(self, path):
+        w = self.weights
+        np.savez_compressed(
+            path, data=w.data, indices=w.indices, indptr=w.indptr, shape=np.array(w.shape),
+            src_rows=np.array([self.src_rows.start, self.src_rows.stop]),
+            src_cols=np.array([self.src_cols.start, self.src_cols.stop]),
+            lat_ascending=np.array(self.lat_ascending), y=self.y, x=self.x,
+        )
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as f:
+            weights = sp.csr_matrix((f['data'], f['indices'], f['indptr']), shape=tuple(f['shape']))
+            return cls(weights, slice(*f['src_rows'].tolist()), slice(*f['src_cols'].tolist()),
+                       f['lat_ascending'].item(), f['y'], f['x'])
+
+
+def operator_key(src_lat, src_lon, shp_path, resolution, all_touched):
+    """由源格网、shapefile 内容和重采样参数计算算子的缓存键。"""
+    h = hashlib.sha1()
+    h.update(np.ascontiguousarray(src_lat, dtype=np.float64).tobytes())
+    h.update(np.ascontiguousarray(src_lon, dtype=np.float64).tobytes())
+    shp_path = Path(shp_path)
+    for suffix in ('.shp', '.prj'):
+        sidecar = shp_path.with_suffix(suffix)
+        if sidecar.exists():
+            h.update(sidecar.read_bytes())
+    h.update(f"{resolution}|{all_touched}|{OPERATOR_VERSION}".encode())
+    return h.hexdigest()[:16]
+
+
+def get_regrid_operator(src_lat, src_lon, shp_path, basin_gdf, resolution=0.25, all_touched=True, cache_dir=None):
+    """获取 (或构建并缓存) 对应源格网和流域边界的重采样算子。"""
+    key = operator_key(src_lat, src_lon, shp_path, resolution, all_touched)
+    if key in _OPERATOR_CACHE:
+        return _OPERATOR_CACHE[key]
+    cache_path = Path(cache_dir) / f"regrid_{key}.npz" if cache_dir is not None else None
+    if cache_path is not None and cache_path.exists():
+        operator = RegridOperator.load(cache_path)
+    else:
+        operator = RegridOperator.build(src_lat, src_lon, basin_gdf, resolution=resolution, all_touched=all_touched)
+        if cache_path is not None:
+            # 先写临时文件再替换，避免多个进程同时写同一个缓存文件
+            cache_path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = cache_path.with_name(f"{cache_path.stem}.{os.getpid()}.tmp.npz")
+            operator.save(tmp_path)
+            os.replace(tmp_path, cache_path)
+    _OPERATOR_CACHE[key] = operator
+    return operator
@@ -0,0 +1,210 @@
+import io
+import math
+
+import numpy as np
+import pandas as pd
+
+# 缺测值 (VIC 参数文件中写作 -9999)
+MISSING = -9999.0
+
+
+def _layers(name, n=3):
+    return [f"{name}_{i}" for i in range(1, n + 1)]
+
+
+# VIC 4 三层土壤参数文件的 53 列，顺序即文件中的列顺序 (列号 = 索引 + 1)
+SOIL_COLUMNS = (
+    ['run_cell', 'gridcel', 'lat', 'lon', 'infilt', 'Ds', 'Dsmax', 'Ws', 'c']
+    + _layers('expt') + _layers('Ksat') + _layers('phi_s') + _layers('init_moist')
+    + ['elev'] + _layers('depth') + ['avg_T', 'dp']
+    + _layers('bubble') + _layers('quartz') + _layers('bulk_density') + _layers('soil_density')
+    + ['off_gmt'] + _layers('Wcr_FRACT') + _layers('Wpwp_FRACT')
+    + ['rough', 'snow_rough', 'annual_prec'] + _layers('resid_moist') + ['fs_active']
+)
+COLUMN_INDEX = {name: i for i, name in enumerate(SOIL_COLUMNS)}
+
+# 以这些后缀结尾的路径按二进制列存储读写 (每列一个带列名的 float64 数组，不经过文本格式化)，
+# 用于步骤之间的中间文件；其余后缀按 VIC 文本格式读写
+BINARY_SUFFIXES = ('.npz', '.parquet')
+
+# 列格式: 'printf 格式' 对该列所有值使用同一格式；
+# (整数格式, 小数格式) 表示整数值写成整数、其余值用小数格式，
+# 即各脚本中 "if num == int(num): str(int(num)) else f'{num:.3f}'" 的写法
+INT_OR_3F = ('%d', '%.3f')
+INT_OR_2F = ('%d', '%.2f')
+
+
+class KeepText:
+    """列格式: 该列读入后未被修改时原样写出文本文件中的字符串，否则按 fmt 格式化。
+
+    对应 fill_parameters11.py、12.py 用 dtype=object 读入、只改写经纬度的写法:
+    上一步写出的 "2346.00" (2345.9999 按 2 位小数格式化) 仍写作 "2346.00"，而不是按数值写成 "2346"。
+    """
+
+    def __init__(self, fmt):
+        self.fmt = fmt
+
+
+def column_formats(default, **formats):
+    """53 列的格式列表: formats 中按列名给出的列使用指定格式，其余列使用 default。
+
+    default 也可以是已有的 53 列格式列表，此时在其基础上修改 formats 中的列。
+    """
+    unknown = set(formats) - set(COLUMN_INDEX)
+    if unknown:
+        raise KeyError(f"未知的土壤参数列: {sorted(unknown)}")
+    if isinstance(default, list):
+        return [formats.get(name, base) for name, base in zip(SOIL_COLUMNS, default)]
+    return [formats.get(name, default) for name in SOIL_COLUMNS]
+
+
+# framework.py 生成的框架: 运行标志、网格号为整数，经纬度 4 位小数，其余整数或 3 位小数
+GRID_FORMATS = column_formats(INT_OR_3F, run_cell='%d', gridcel='%d', lat='%.4f', lon='%.4f')
+# fill_parameters.py 至 fill_parameters5.py: 在框架格式的基础上，高程保留 2 位小数
+SOIL_FORMATS = column_formats(GRID_FORMATS, elev='%.2f')
+# fill_parameters9.py、10.py、10.5.py: 所有列 (包括经纬度) 写成整数或 2 位小数
+ROUNDED_FORMATS = column_formats(INT_OR_2F)
+# fill_parameters11.py、12.py: 经纬度 4 位小数，其余列原样保留读入的字符串 (没有读入的字符串时为整数或 2 位小数)
+FINAL_FORMATS = column_formats(KeepText(INT_OR_2F), lat='%.4f', lon='%.4f')
+
+
+def is_binary(path):
+    """path 是否为二进制列存储 (.npz 或 .parquet) 的中间文件。"""
+    return str(path).lower().endswith(BINARY_SUFFIXES)
+
+
+def column_index(columns):
+    """列名 (或 0 起始的列索引) 对应的索引；传入列表时返回索引列表。"""
+    if isinstance(columns, (list, tuple)):
+        return [column_index(c) for c in columns]
+    if isinstance(columns, (int, np.integer)):
+        return int(columns)
+    try:
+        return COLUMN_INDEX[columns]
+    except KeyError:
+        raise KeyError(f"未知的土壤参数列: {columns!r}") from None
+
+
+def format_value(value, fmt):
+    """按列格式格式化单个数值。"""
+    if isinstance(fmt, KeepText):
+        fmt = fmt.fmt
+    if isinstance(fmt, str):
+        return fmt % value
+    int_fmt, frac_fmt = fmt
+    return int_fmt % value if math.isfinite(value) and value.is_integer() else frac_fmt % value
+
+
+def format_column(values, fmt):
+    """按列格式把一列数值格式化为字符串数组 (与逐个 f-string 格式化的结果相同)。
+
+    参数列大多只有少数几个不同的值 (-9999、常量、查表值)，因此每个不同的值只格式化一次，
+    再按索引取回整列；按位比较，-0.0 与 0.0 分开格式化。
+    """
+    values = np.ascontiguousarray(values, dtype=np.float64)
+    bits, inverse = np.unique(values.view(np.int64), return_inverse=True)
+    strings = np.array([format_value(v, fmt) for v in bits.view(np.float64).tolist()], dtype=object)
+    return strings[inverse.reshape(-1)]
+
+
+class SoilParamTable:
+    """VIC 土壤参数表: (格网数, 53) 的 float64 数组，各列可按名称读写。
+
+    ``table['elev']`` 返回该列的视图，``table['Ksat_1'] = ...``、
+    ``table[['resid_moist_1', 'resid_moist_2']] = 0`` 直接修改数组；
+    读取一次解析整个文件，写出时按列格式整列格式化，不再逐行逐格转换字符串。
+    路径以 .npz/.parquet 结尾时按二进制列存储读写，数值保持完整的 float64 精度。
+
+    text 保存每列读入 (或 quantize) 时的字符串，按列赋值后该列的字符串失效；
+    写出时 KeepText 格式的列优先使用这些字符串。
+    """
+
+    def __init__(self, values, text=None):
+        values = np.asarray(values, dtype=np.float64)
+        if values.ndim != 2 or values.shape[1] != len(SOIL_COLUMNS):
+            raise ValueError(f"土壤参数表应为 (格网数, {len(SOIL_COLUMNS)}) 的数组，收到的形状为 {values.shape}。")
+        self.values = values
+        self.text = list(text) if text is not None else [None] * len(SOIL_COLUMNS)
+
+    @classmethod
+    def new(cls, lats, lons):
+        """新建框架: 所有格网运行 (run_cell = 1)，网格号从 1 开始，其余参数为 -9999。"""
+        lats = np.asarray(lats, dtype=np.float64)
+        table = cls(np.full((len(lats), len(SOIL_COLUMNS)), MISSING))
+        table['run_cell'] = 1
+        table['gridcel'] = np.arange(1, len(lats) + 1)
+        table['lat'] = lats
+        table['lon'] = lons
+        return table
+
+    @classmethod
+    def read(cls, path):
+        """读取空格分隔的 53 列土壤参数文件 (C 解析器一次读入整个文件)，或 .npz/.parquet 中间文件。"""
+        suffix = str(path).lower()
+        if suffix.endswith('.npz'):
+            with np.load(path) as data:
+                missing = [name for name in SOIL_COLUMNS if name not in data.files]
+                if missing:
+                    raise KeyError(f"{path} 中缺少土壤参数列: {missing}")
+                return cls(np.column_stack([data[name] for name in SOIL_COLUMNS]))
+        if suffix.endswith('.parquet'):
+            return cls(pd.read_parquet(path, columns=SOIL_COLUMNS).to_numpy(dtype=np.float64))
+        with open(path) as f:
+            content = f.read()
+        values = pd.read_csv(io.StringIO(content), sep=r'\s+', header=None, dtype=np.float64).to_numpy()
+        tokens = np.array(content.split(), dtype=object).reshape(values.shape)
+        return cls(values, [tokens[:, i] for i in range(values.shape[1])])
+
+    def __len__(self):
+        return len(self.values)
+
+    def __getitem__(self, columns):
+        return self.values[:, column_index(columns)]
+
+    def __setitem__(self, columns, value):
+        index = column_index(columns)
+        self.values[:, index] = value
+        for i in (index if isinstance(index, list) else [index]):
+            self.text[i] = None
+
+    def copy(self):
+        return SoilParamTable(self.values.copy(), self.text)
+
+    def _column_text(self, i, fmt):
+        if isinstance(fmt, KeepText) and self.text[i] is not None:
+            return self.text[i]
+        return format_column(self.values[:, i], fmt)
+
+    def to_text(self, formats=SOIL_FORMATS):
+        """按列格式 (见 column_formats) 生成文件内容，每行末尾带换行符。"""
+        if len(formats) != len(SOIL_COLUMNS):
+            raise ValueError(f"列格式的数量 ({len(formats)}) 与列数 ({len(SOIL_COLUMNS)}) 不一致。")
+        if not len(self):
+            return ""
+        columns = [self._column_text(i, fmt).tolist() for i, fmt in enumerate(formats)]
+        return "\n".join(map(" ".join, zip(*columns))) + "\n"
+
+    def quantize(self, formats=SOIL_FORMATS):
+        """把每个值替换为按列格式写出再读回的值，即与经过一次文本文件往返的结果相同 (写出的字符串也一并保存)。"""
+        for i, fmt in enumerate(formats):
+            if isinstance(fmt, KeepText) and self.text[i] is not None:
+                continue
+            bits, inverse = np.unique(self.values[:, i].view(np.int64), return_inverse=True)
+            strings = np.array([format_value(v, fmt) for v in bits.view(np.float64).tolist()], dtype=object)
+            inverse = inverse.reshape(-1)
+            self.values[:, i] = np.array([float(s) for s in strings])[inverse]
+            self.text[i] = strings[inverse]
+        return self
+
+    def write(self, path, formats=SOIL_FORMATS):
+        """写出为空格分隔的土壤参数文件；.npz/.parquet 路径按列原样写出 (忽略 formats)。"""
+        suffix = str(path).lower()
+        if suffix.endswith('.npz'):
+            np.savez(path, **{name: self.values[:, i] for i, name in enumerate(SOIL_COLUMNS)})
+            return path
+        if suffix.endswith('.parquet'):
+            pd.DataFrame(self.values, columns=SOIL_COLUMNS).to_parquet(path, index=False)
+            return path
+        with open(path, 'w') as f:
+            f.write(self.to_text(formats))
+        return path
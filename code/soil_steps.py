@@ -0,0 +1,187 @@
+import math
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+import rioxarray  # 注册 .rio 访问器
+from rasterio.enums import Resampling
+
+from climatology import read_climatology
+from cmfd_io import subset_to_bounds
+from soil_params import SoilParamTable
+
+# 土壤参数各填充步骤的计算部分，每一步都直接修改内存中的 SoilParamTable。
+# fill_parameters*.py 各脚本和 build_soil_params.py 共用这些函数，两者的结果因此完全一致。
+
+
+def grid_table(nc_path):
+    """framework.py: 由 NC 文件中的有效格网 (先行后列) 建立土壤参数表框架。"""
+    with xr.open_dataset(nc_path) as ds:
+        grid_points = ds[list(ds.data_vars)[0]].stack(gridcell=('y', 'x')).dropna('gridcell', how='all')
+        return SoilParamTable.new(grid_points.coords['y'].values, grid_points.coords['x'].values)
+
+
+def fill_constants(soil, constants):
+    """fill_parameters2.py、3.py、5.py: 把 {列名: 值} 中的常量写入整列。"""
+    for column, value in constants.items():
+        soil[column] = value
+    return soil
+
+
+def fill_elevation(soil, elev_nc, template_nc):
+    """fill_parameters.py: 把高程按区域平均重采样到模板格网，再按最近邻取每个格网的值 (缺测为 0)。"""
+    with xr.open_dataset(elev_nc) as ds_elev_raw, xr.open_dataset(template_nc) as ds_template:
+        # 为模板指定CRS，以解决 Missing dst_crs 错误
+        ds_template = ds_template.rio.write_crs("EPSG:4326")
+        elev_var = list(ds_elev_raw.data_vars)[0]
+        # 只读取主格网范围 (外扩一圈) 内的全国高程数据
+        ds_elev_raw = subset_to_bounds(ds_elev_raw, ds_template.rio.bounds(), halo=0.2)
+        ds_elev_raw = ds_elev_raw.rio.write_crs("EPSG:4326")
+        reprojected_elev = ds_elev_raw[elev_var].rio.reproject_match(ds_template, resampling=Resampling.average)
+        elev_values = reprojected_elev.sel(y=xr.DataArray(soil['lat'], dims="points"),
+                                           x=xr.DataArray(soil['lon'], dims="points"), method='nearest')
+        soil['elev'] = elev_values.fillna(0.0).values
+    return soil
+
+
+def _nearest_values(da, soil):
+    """按最近邻取每个格网的值，缺测为 0。"""
+    values = da.sel(y=xr.DataArray(soil['lat'], dims="points"), x=xr.DataArray(soil['lon'], dims="points"), method="nearest")
+    return values.fillna(0.0).values
+
+
+def fill_annual_prec(soil, met_dir, pattern="prec_*_huai.nc", climatology_file=None):
+    """fill_parameters4.py: 由多年平均降水率 (mm/s) 计算年平均降水量 (mm/year)，填入 annual_prec。
+
+    climatology_file 为 forcing.py 写出的气候统计文件，存在时直接读取其中的多年平均，不再扫描全部降水文件。
+    """
+    if climatology_file is not None and climatology_file.exists():
+        mean_prec_rate_mm_per_sec = read_climatology(climatology_file)['prec_mean']
+    else:
+        with xr.open_mfdataset(str(met_dir / pattern), chunks='auto') as ds_prec:
+            prec_var = list(ds_prec.data_vars)[0]
+            mean_prec_rate_mm_per_sec = ds_prec[prec_var].mean(dim='time').compute()
+    # mm/s -> mm/day (86400 秒) -> mm/year (365.25 天)
+    annual_prec = mean_prec_rate_mm_per_sec * 86400 * 365.25
+    soil['annual_prec'] = _nearest_values(annual_prec, soil)
+    return soil
+
+
+def fill_avg_temp(soil, climatology_file):
+    """fill_parameters9.py: 由 forcing.py 写出的气候统计中的多年平均气温 (K) 填入 avg_T (°C)。"""
+    soil['avg_T'] = _nearest_values(read_climatology(climatology_file)['temp_mean'] - 273.15, soil)
+    return soil
+
+
+def interpolate_global_params(soil, global_file, source_cols, target_cols, on_error=None):
+    """fill_parameters9.py: 从全球 5 分土壤数据线性插值到每个格网。
+
+    source_cols 为 {参数名: 全球文件中的列索引} (须包含 'lat'、'lon')，
+    target_cols 为 {参数名: 土壤参数表中的列名}；插值产生的 NaN 填 0。
+    某个参数处理出错时调用 on_error(参数名, 异常)，该列保持不变。
+    """
+    df_global = pd.read_csv(global_file, sep=r'\s+', header=None, usecols=list(source_cols.values()))
+    df_global.columns = source_cols.keys()
+    lats_to_find = xr.DataArray(soil['lat'], dims="points")
+    lons_to_find = xr.DataArray(soil['lon'], dims="points")
+    for param_name, vic_column in target_cols.items():
+        try:
+            # 为当前参数构建专用的2D数据，纬度从小到大排列后执行线性插值
+            df_param_pivot = df_global.pivot_table(index='lat', columns='lon', values=param_name)
+            source_da = xr.DataArray(df_param_pivot.values, coords=[df_param_pivot.index, df_param_pivot.columns],
+                                     dims=['lat', 'lon'])
+            source_da = source_da.reindex(lat=list(reversed(source_da.lat)))
+            interp_values = source_da.interp(lat=lats_to_find, lon=lons_to_find, method="linear")
+            soil[vic_column] = interp_values.fillna(0.0).values
+        except Exception as e:
+            if on_error is None:
+                raise
+            on_error(param_name, e)
+    return soil
+
+
+# --- PTF(土壤转换函数) 定义，基于 Saxton & Rawls (2006) ---
+# 质地无效 (缺测、砂粒与粘粒之和超过 100 或为负) 时使用的默认参数
+PTF_DEFAULTS = {'expt': 4.0, 'bulk_density': 1300, 'Wpwp_FRACT': 0.1, 'Wcr_FRACT': 0.25, 'Ksat': 10}
+# 逐元素调用 C 库的 pow：numpy 的 ** 对数组使用 SIMD 实现，与逐个格网计算时的结果有末位差异
+_pow = np.frompyfunc(math.pow, 2, 1)
+
+
+def calculate_soil_params_from_texture(sand, clay):
+    """由砂粒、粘粒含量 (%，等长数组) 逐元素计算 PTF 参数，返回 {参数名: 数组}。"""
+    sand = np.asarray(sand, dtype=np.float64)
+    clay = np.asarray(clay, dtype=np.float64)
+    invalid = np.isnan(sand) | np.isnan(clay) | (sand + clay > 100) | (sand < 0) | (clay < 0)
+
+    # 无效质地的元素也参与计算 (可能产生 NaN)，最后统一替换为默认参数
+    with np.errstate(invalid='ignore', divide='ignore'):
+        sand_frac = np.maximum(0.01, sand / 100.0)
+        clay_frac = np.maximum(0.01, clay / 100.0)
+
+        # 凋零点 (Wilting Point, 1500 kPa)
+        wp_t1 = -0.024 * sand_frac + 0.487 * clay_frac + 0.006 * (sand_frac * clay_frac) + 0.005 * (sand_frac**2) * clay_frac + 0.013 * sand_frac * (clay_frac**2)
+        Wpwp_FRACT = np.maximum(0.01, wp_t1 + 0.14 * wp_t1 - 0.02)
+
+        # 田间持水量 (Field Capacity, 33 kPa)
+        fc_t1 = -0.251 * sand_frac + 0.195 * clay_frac + 0.011 * (sand_frac * clay_frac) + 0.006 * (sand_frac**2) * clay_frac - 0.027 * sand_frac * (clay_frac**2)
+        Wcr_FRACT = np.maximum(0.02, fc_t1 + 0.14 * fc_t1 - 0.02)
+
+        Wcr_FRACT = np.where(Wcr_FRACT <= Wpwp_FRACT, Wpwp_FRACT + 0.02, Wcr_FRACT)
+
+        # 孔隙度 (Porosity)
+        porosity_t = 0.332 - 0.7251 * sand_frac + 0.1276 * np.log10(clay_frac)
+        porosity = np.maximum(0.01, porosity_t + (0.02 * porosity_t**2) * np.exp(-2.5 * sand_frac))
+
+        porosity = np.where(porosity <= Wcr_FRACT, Wcr_FRACT + 0.02, porosity)
+
+        # Expt (b) - Clapp and Hornberger "b" parameter
+        b = (np.log(1500) - np.log(33)) / (np.log(Wcr_FRACT) - np.log(Wpwp_FRACT))
+        expt = 2 * b + 3
+        expt = np.where(expt <= 3.0, 3.1, expt) # 强制确保expt > 3.0
+
+        # Ksat (饱和导水率, mm/day)
+        lambda_param = 1 / b
+        Ksat_mm_hr = np.maximum(0.1, 1930 * _pow(porosity - Wcr_FRACT, 3 - lambda_param).astype(np.float64))
+
+        # 容重 (Bulk Density)
+        bulk_density = (1 - porosity) * 2650 # kg/m3
+
+    params = {
+        'expt': expt, 'bulk_density': bulk_density, 'Wpwp_FRACT': Wpwp_FRACT,
+        'Wcr_FRACT': Wcr_FRACT, 'Ksat': Ksat_mm_hr * 24
+    }
+    return {name: np.where(invalid, PTF_DEFAULTS[name], values) for name, values in params.items()}
+
+
+def dominant_texture(arcgis_file):
+    """每个 grid_id 中 SHARE 最大的土壤的表层 (T_) 和底层 (S_) 砂粒/粘粒含量 (%)。"""
+    df_arcgis = pd.read_csv(arcgis_file, sep=',')
+    max_share_indices = df_arcgis.groupby('grid_id')['SHARE'].idxmax(skipna=True).dropna()
+    dominant_soil_info = df_arcgis.loc[max_share_indices]
+    return dominant_soil_info.set_index('grid_id')[['T_SAND', 'T_CLAY', 'S_SAND', 'S_CLAY']]
+
+
+def fill_ptf_params(soil, texture):
+    """fill_parameters10.5.py: 由主导土壤质地按 PTF 公式计算并填充 Expt、Ksat、容重、Wcr、Wpwp 和 init_moist。
+
+    texture 为 dominant_texture() 的结果；按网格号 (第2列) 对应到每个格网，找不到的格网使用默认参数。
+    第1、2层使用表层 (T_) 质地，第3层使用底层 (S_) 质地。
+    """
+    texture = texture.reindex(soil['gridcel'].astype(int))
+    params_t = calculate_soil_params_from_texture(texture['T_SAND'], texture['T_CLAY'])
+    params_s = calculate_soil_params_from_texture(texture['S_SAND'], texture['S_CLAY'])
+
+    # 填充 Expt, Ksat, Bulk Density, Wcr, Wpwp
+    for param in ['expt', 'Ksat', 'bulk_density', 'Wcr_FRACT', 'Wpwp_FRACT']:
+        soil[[f'{param}_1', f'{param}_2']] = params_t[param][:, None]; soil[f'{param}_3'] = params_s[param]
+    # 填充 init_moist
+    soil[['init_moist_1', 'init_moist_2']] = params_t['Wcr_FRACT'][:, None] * 0.5
+    soil['init_moist_3'] = params_s['Wcr_FRACT'] * 0.5
+    return soil
+
+
+def shift_coordinates(soil, lat_shift, lon_shift):
+    """fill_parameters12.py: 平移所有格网的经纬度。"""
+    soil['lat'] += lat_shift
+    soil['lon'] += lon_shift
+    return soil
@@ -0,0 +1,468 @@
+import os
+import re
+import traceback
+from concurrent.futures import ProcessPoolExecutor, wait, as_completed, FIRST_COMPLETED
+from multiprocessing import shared_memory
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+# 需要从 CMFD 读取的变量
+CMFD_VARIABLES = ['prec', 'temp', 'pres', 'srad', 'lrad', 'wind', 'shum']
+
+# VIC 气象驱动文件的列顺序 (与全局参数文件中 FORCE_TYPE 的顺序一致)
+FORCING_COLUMNS = ['air_temp', 'prec', 'pressure', 'swdown', 'lwdown', 'vp', 'wind']
+
+# 文本驱动文件的数值格式，与 DataFrame.to_csv(sep='\t', float_format='%.4f') 相同
+FLOAT_FORMAT = '%.4f'
+# 每次格式化并写出的行数
+WRITE_BLOCK_ROWS = 8192
+
+# VIC 4 二进制驱动文件中各列的 (FORCE_TYPE 名称, 是否有符号, 乘数)，顺序同 FORCING_COLUMNS。
+# 每个数值按 round(值 × 乘数) 存为 2 字节整数，VIC 读取时再除以乘数；
+# 乘数决定精度和可表示范围 (有符号 ±32767/乘数，无符号 0~65535/乘数)。
+BINARY_FORCE_TYPES = [
+    ('AIR_TEMP', True, 100),     # °C, 精度 0.01, 范围 ±327.67
+    ('PREC', False, 40),         # mm/day, 精度 0.025, 最大 1638
+    ('PRESSURE', False, 100),    # kPa, 精度 0.01, 最大 655
+    ('SHORTWAVE', False, 50),    # W/m2, 精度 0.02, 最大 1310
+    ('LONGWAVE', False, 80),     # W/m2, 精度 0.0125, 最大 819
+    ('VP', False, 1000),         # kPa, 精度 0.001, 最大 65.5
+    ('WIND', False, 100),        # m/s, 精度 0.01, 最大 655
+]
+
+# VIC 5 image driver 驱动文件中各变量的 (FORCE_TYPE 名称, CF 属性)
+IMAGE_FORCE_TYPES = {
+    'air_temp': ('AIR_TEMP', {'units': 'C', 'long_name': 'air temperature', 'standard_name': 'air_temperature'}),
+    'prec': ('PREC', {'units': 'mm/step', 'long_name': 'total precipitation per time step',
+                      'standard_name': 'precipitation_amount'}),
+    'pressure': ('PRESSURE', {'units': 'kPa', 'long_name': 'surface air pressure', 'standard_name': 'surface_air_pressure'}),
+    'swdown': ('SWDOWN', {'units': 'W m-2', 'long_name': 'incoming shortwave radiation',
+                          'standard_name': 'surface_downwelling_shortwave_flux_in_air'}),
+    'lwdown': ('LWDOWN', {'units': 'W m-2', 'long_name': 'incoming longwave radiation',
+                          'standard_name': 'surface_downwelling_longwave_flux_in_air'}),
+    'vp': ('VP', {'units': 'kPa', 'long_name': 'vapor pressure', 'standard_name': 'water_vapor_partial_pressure_in_air'}),
+    'wind': ('WIND', {'units': 'm/s', 'long_name': 'wind speed', 'standard_name': 'wind_speed'}),
+}
+
+
+def valid_cells(da):
+    """由某一时次的二维场 (y, x) 确定有效 (非 NaN) 格网。
+
+    返回 (行索引, 列索引, 纬度, 经度)，顺序与
+    ``da.stack(gridcell=('y', 'x')).dropna('gridcell')`` 相同 (先行后列)。
+    """
+    da = da.transpose('y', 'x')
+    iy, ix = np.nonzero(np.isfinite(da.values))
+    return iy, ix, da['y'].values[iy], da['x'].values[ix]
+
+
+def convert_to_vic(raw, step_hours=24):
+    """把 CMFD 原始变量换算为 VIC 驱动变量。
+
+    raw 为 {变量名: 数组}，数组形状任意 (如 (时间, 格网))；step_hours 为时间步长 (日尺度 24，3 小时产品 3)。
+    运算顺序和数据类型与原来逐格网的 pandas 计算完全一致，写出的文本逐字节相同。
+    """
+    return {
+        # 气温: K -> °C
+        'air_temp': raw['temp'] - 273.15,
+        # 降水: kg/m2/s (即 mm/s) -> 每个时间步的累计量 (日尺度为 mm/day)
+        'prec': raw['prec'] * (step_hours * 3600),
+        # 气压: Pa -> kPa
+        'pressure': raw['pres'] / 1000.0,
+        # 短波、长波辐射: W/m2，无需换算
+        'swdown': raw['srad'],
+        'lwdown': raw['lrad'],
+        # 水汽压: 由比湿和气压计算，并转换为 kPa
+        'vp': (raw['shum'] * raw['pres']) / (0.622 + 0.378 * raw['shum']) / 1000.0,
+        # 风速: m/s，无需换算
+        'wind': raw['wind'],
+    }
+
+
+def time_blocks(n_time, block_size=None):
+    """把 [0, n_time) 划分为长度不超过 block_size 的时间块；None 表示一次处理全部。"""
+    if not block_size or block_size >= n_time:
+        return [slice(0, n_time)]
+    return [slice(t0, min(t0 + block_size, n_time)) for t0 in range(0, n_time, block_size)]
+
+
+def huai_file_year(path):
+    """由 _huai.nc 文件名 (如 prec_..._025deg_199101-199112_huai.nc 或按月的 ..._199101_huai.nc) 提取年份。"""
+    match = re.search(r'_(\d{4})\d{2}(?:-\d{6})?_huai$', os.path.splitext(os.path.basename(path))[0])
+    return int(match.group(1)) if match else None
+
+
+def forcing_step_hours(times):
+    """由时间坐标识别时间步长 (小时)，须能整除 24 (日尺度为 24，CMFD 3 小时产品为 3)。"""
+    times = np.asarray(times, dtype='datetime64[s]')
+    if len(times) < 2:
+        return 24
+    step = float(np.median(np.diff(times).astype(np.int64))) / 3600
+    if step != int(step) or 24 % int(step):
+        raise ValueError(f"无法识别的时间步长: {step} 小时 (须能整除 24)。")
+    return int(step)
+
+
+def year_blocks(times):
+    """按自然年划分时间轴，返回每年对应的索引切片。"""
+    years = pd.DatetimeIndex(times).year.values
+    starts = np.flatnonzero(np.r_[True, years[1:] != years[:-1]])
+    ends = np.r_[starts[1:], len(years)]
+    return [slice(int(t0), int(t1)) for t0, t1 in zip(starts, ends)]
+
+
+def forcing_dtype(ds, variables=CMFD_VARIABLES):
+    """换算后驱动数据的数据类型 (输入为 float32 时仍为 float32)。"""
+    return np.result_type(*(ds[var].dtype for var in variables), np.float32)
+
+
+def iter_cell_blocks(ds, iy, ix, blocks, variables=CMFD_VARIABLES, step_hours=24):
+    """逐个时间块读取所有格网的数据并完成单位换算。
+
+    对每个块产出 (时间切片, (块内时间, 格网, 7) 数组)，最后一维顺序为 FORCING_COLUMNS。
+    同一时刻内存中只有一个块的数据。
+    """
+    iy = np.asarray(iy)
+    ix = np.asarray(ix)
+    dtype = forcing_dtype(ds, variables)
+    for block in blocks:
+        ds_block = ds[variables].isel(time=block).compute()
+        raw = {var: ds_block[var].transpose('time', 'y', 'x').values[:, iy, ix] for var in variables}
+        converted = convert_to_vic(raw, step_hours)
+        data = np.empty((ds_block.sizes['time'], len(iy), len(FORCING_COLUMNS)), dtype=dtype)
+        for k, col in enumerate(FORCING_COLUMNS):
+            data[:, :, k] = converted[col]
+        yield block, data
+
+
+def iter_store_blocks(store, cells, block_cells=16, start=0, variables=CMFD_VARIABLES, step_hours=24):
+    """从 rechunk_forcing.py 生成的按格网分块的 (time, cell) 数据中逐块读取格网并完成单位换算。
+
+    cells 为格网在 cell 维上的序号。按序号排序后每 block_cells 个一组，
+    每组只读取覆盖它们的连续 cell 范围 (全部时间)，正好对应文件中的少数几个数据块。
+    对每组产出 (该组在 cells 中的位置, (时间, 组内格网, 7) 数组)；
+    start 为起始时间序号，增量追加时只读取新的日期。
+    """
+    cells = np.asarray(cells)
+    order = np.argsort(cells, kind='stable')
+    dtype = forcing_dtype(store, variables)
+    for b0 in range(0, len(order), block_cells):
+        positions = order[b0:b0 + block_cells]
+        wanted = cells[positions]
+        lo, hi = int(wanted.min()), int(wanted.max()) + 1
+        raw = {var: store[var].isel(time=slice(start, None), cell=slice(lo, hi)).values[:, wanted - lo]
+               for var in variables}
+        converted = convert_to_vic(raw, step_hours)
+        data = np.empty(converted['wind'].shape + (len(FORCING_COLUMNS),), dtype=dtype)
+        for k, col in enumerate(FORCING_COLUMNS):
+            data[:, :, k] = converted[col]
+        yield positions, data
+
+
+def extract_cells(ds, iy, ix, block_size=None, variables=CMFD_VARIABLES, out=None, step_hours=24):
+    """一次性 (或按时间块) 读取所有格网的数据并完成单位换算。
+
+    返回形状为 (时间, 格网, 7) 的数组，最后一维顺序为 FORCING_COLUMNS。
+    每个时间块只读取一次数据立方体，换算以整块数组运算完成，
+    代替逐格网 ``sel(...).compute()`` 反复计算整个 dask 图。
+    out 为预先分配好的数组 (如 SharedCube.array) 时直接写入其中。
+    """
+    n_time = ds.sizes['time']
+    if out is None:
+        out = np.empty((n_time, len(iy), len(FORCING_COLUMNS)), dtype=forcing_dtype(ds, variables))
+    cube = out
+    for block, data in iter_cell_blocks(ds, iy, ix, time_blocks(n_time, block_size), variables, step_hours):
+        cube[block] = data
+    return cube
+
+
+def format_rows(block, float_format=FLOAT_FORMAT, sep='\t', line_terminator=os.linesep):
+    """把 (行, 列) 浮点数组格式化为文本，与 ``to_csv(sep=sep, header=False, index=False,
+    float_format=float_format)`` 的输出逐字节相同 (NaN 写为空字符串，行尾为 os.linesep)。
+
+    整块数据只做一次 ``%`` 格式化 (由 C 完成)，不再逐个数值调用 Python。
+    """
+    block = np.asarray(block)
+    row_format = sep.join([float_format] * block.shape[1]) + line_terminator
+    finite_rows = np.isfinite(block).all(axis=1)
+    if finite_rows.all():
+        return (row_format * len(block)) % tuple(block.ravel().tolist())
+    # 含 NaN/inf 的行 (很少出现) 逐个数值处理: NaN 与 pandas 一样写为空字符串
+    lines = []
+    for row, finite in zip(block.tolist(), finite_rows):
+        if finite:
+            lines.append(row_format % tuple(row))
+        else:
+            lines.append(sep.join('' if v != v else float_format % v for v in row) + line_terminator)
+    return ''.join(lines)
+
+
+def write_forcing_file(path, data, append=False, block_rows=WRITE_BLOCK_ROWS):
+    """把 (时间, 变量) 数组写为 VIC ASCII 驱动文件，按行块格式化并大块写出。
+
+    append=True 时接在已有文件末尾，用于逐年追加。
+    """
+    data = np.asarray(data)
+    with open(path, 'ab' if append else 'wb', buffering=1024 ** 2) as f:
+        for start in range(0, len(data), block_rows):
+            f.write(format_rows(data[start:start + block_rows]).encode('ascii'))
+    return path
+
+
+def existing_rows(path, binary=False, force_types=BINARY_FORCE_TYPES):
+    """已有驱动文件中完整记录 (天) 的数目，用于增量追加。
+
+    文件不存在，或末尾有写了一半的行/记录 (例如上次运行中断) 时返回 None。
+    """
+    try:
+        size = os.path.getsize(path)
+    except OSError:
+        return None
+    if binary:
+        record_size = 2 * len(force_types)
+        return size // record_size if size % record_size == 0 else None
+    if size == 0:
+        return 0
+    n_lines = 0
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 ** 2), b''):
+            n_lines += chunk.count(b'\n')
+            last = chunk
+    return n_lines if last.endswith(b'\n') else None
+
+
+def pack_binary(data, force_types=BINARY_FORCE_TYPES):
+    """把 (时间, 变量) 数组按乘数换算为小端 16 位整数记录 (每行一条记录)。
+
+    超出可表示范围或含 NaN 的数值无法写入二进制文件，直接报错而不是静默截断。
+    """
+    data = np.asarray(data, dtype=np.float64)
+    record = np.dtype([(name, '<i2' if signed else '<u2') for name, signed, _ in force_types])
+    packed = np.empty(len(data), dtype=record)
+    for k, (name, signed, multiplier) in enumerate(force_types):
+        scaled = np.rint(data[:, k] * multiplier)
+        info = np.iinfo(record[name])
+        bad = ~np.isfinite(scaled) | (scaled < info.min) | (scaled > info.max)
+        if bad.any():
+            first = int(np.flatnonzero(bad)[0])
+            raise ValueError(f"{name} 第 {first + 1} 行的值 {data[first, k]} 超出 "
+                             f"{'SIGNED' if signed else 'UNSIGNED'} × {multiplier} 的可表示范围 (共 {int(bad.sum())} 个)。")
+        packed[name] = scaled
+    return packed
+
+
+def write_binary_forcing_file(path, data, append=False, force_types=BINARY_FORCE_TYPES):
+    """把 (时间, 变量) 数组写为 VIC 4 二进制驱动文件 (FORCE_FORMAT BINARY)。"""
+    packed = pack_binary(data, force_types)
+    with open(path, 'ab' if append else 'wb') as f:
+        f.write(packed.tobytes())
+    return path
+
+
+def binary_global_snippet(forcing_prefix, start_date, force_types=BINARY_FORCE_TYPES, force_dt=24):
+    """与二进制驱动文件配套的全局参数文件片段 (VIC 4 格式)。"""
+    lines = [
+        f"FORCING1\t{forcing_prefix}",
+        "FORCE_FORMAT\tBINARY",
+        "FORCE_ENDIAN\tLITTLE",
+        f"N_TYPES\t{len(force_types)}",
+    ]
+    lines += [f"FORCE_TYPE\t{name}\t{'SIGNED' if signed else 'UNSIGNED'}\t{multiplier}"
+              for name, signed, multiplier in force_types]
+    lines += [
+        f"FORCE_DT\t{force_dt}",
+        f"FORCEYEAR\t{start_date.year}",
+        f"FORCEMONTH\t{start_date.month}",
+        f"FORCEDAY\t{start_date.day}",
+        "FORCEHOUR\t0",
+        "GRID_DECIMAL\t4",
+    ]
+    return "\n".join(lines) + "\n"
+
+
+def _write_job(writer, path, data):
+    writer(path, data)
+    return path
+
+
+def write_forcing_files(jobs, num_workers=1, on_done=None, max_in_flight=None, writer=write_forcing_file):
+    """写出一批驱动文件。jobs 产出 (key, 输出路径, (时间, 变量) 数组)。
+
+    writer 为单个文件的写出函数 (文本 write_forcing_file 或二进制 write_binary_forcing_file)。
+
+    num_workers > 1 时交给进程池并行格式化和写出，同时在途的任务数受 max_in_flight
+    限制以控制内存。每个文件写完后在主进程中调用 on_done(key, path)。
+    返回失败列表 [(key, 错误信息, 堆栈)]。
+    """
+    errors = []
+    if num_workers <= 1:
+        for key, path, data in jobs:
+            try:
+                writer(path, data)
+            except Exception as e:
+                errors.append((key, f"{type(e).__name__}: {e}", traceback.format_exc()))
+            else:
+                if on_done is not None:
+                    on_done(key, path)
+        return errors
+
+    max_in_flight = max_in_flight or 2 * num_workers
+    jobs = iter(jobs)
+    in_flight = {}
+
+    def collect(done):
+        for future in done:
+            key = in_flight.pop(future)
+            try:
+                path = future.result()
+            except Exception as e:
+                tb = "".join(traceback.format_exception(type(e), e, e.__traceback__))
+                errors.append((key, f"{type(e).__name__}: {e}", tb))
+            else:
+                if on_done is not None:
+                    on_done(key, path)
+
+    with ProcessPoolExecutor(max_workers=num_workers) as pool:
+        for key, path, data in jobs:
+            if len(in_flight) >= max_in_flight:
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                collect(done)
+            in_flight[pool.submit(_write_job, writer, path, np.ascontiguousarray(data))] = key
+        collect(wait(in_flight).done)
+    return errors
+
+
+class SharedCube:
+    """放在共享内存中的 (时间, 格网, 变量) 数组。
+
+    子进程按名称附加到同一块内存，只读取自己负责的格网列，不复制整个数组。
+    """
+
+    def __init__(self, shape, dtype):
+        self.shape = tuple(int(n) for n in shape)
+        self.dtype = np.dtype(dtype)
+        size = max(int(np.prod(self.shape)) * self.dtype.itemsize, 1)
+        self._shm = shared_memory.SharedMemory(create=True, size=size)
+        self.array = np.ndarray(self.shape, dtype=self.dtype, buffer=self._shm.buf)
+
+    @property
+    def spec(self):
+        """子进程附加时需要的 (名称, 形状, 数据类型)。"""
+        return self._shm.name, self.shape, self.dtype.str
+
+    def close(self):
+        """释放共享内存。必须在所有子进程结束后调用。"""
+        self.array = None
+        self._shm.close()
+        self._shm.unlink()
+
+
+# 子进程中附加的共享数组 (每个进程附加一次)
+_shared_shm = None
+_shared_cube = None
+
+
+def _attach_shared_cube(spec):
+    global _shared_shm, _shared_cube
+    name, shape, dtype = spec
+    try:
+        # Python 3.13+: 子进程不登记该内存，避免退出时被资源跟踪器误删
+        _shared_shm = shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        _shared_shm = shared_memory.SharedMemory(name=name)
+    _shared_cube = np.ndarray(shape, dtype=np.dtype(dtype), buffer=_shared_shm.buf)
+
+
+def _write_shared_partition(writer, columns, paths):
+    """子进程: 写出共享数组中若干格网列，逐个文件返回 (错误信息, 堆栈)，成功时为 (None, None)。"""
+    results = []
+    for k, path in zip(columns, paths):
+        try:
+            writer(path, _shared_cube[:, k, :])
+        except Exception as e:
+            results.append((f"{type(e).__name__}: {e}", traceback.format_exc()))
+        else:
+            results.append((None, None))
+    return results
+
+
+def write_cells_shared(shared, jobs, num_workers, on_done=None, writer=write_forcing_file, partition_size=None):
+    """由进程池并行写出共享数组中的格网。jobs 为 [(key, 输出路径, 格网列序号)]。
+
+    每个任务只传递列序号和路径 (几十字节)，数据由子进程直接从共享内存读取；
+    进度和错误在主进程中汇总，每个文件写完后在主进程中调用 on_done(key, path)。
+    返回失败列表 [(key, 错误信息, 堆栈)]。
+    """
+    jobs = list(jobs)
+    if not jobs:
+        return []
+    partition_size = partition_size or max(1, -(-len(jobs) // (num_workers * 8)))
+    partitions = [jobs[p:p + partition_size] for p in range(0, len(jobs), partition_size)]
+    errors, n_done = [], 0
+    with ProcessPoolExecutor(max_workers=num_workers, initializer=_attach_shared_cube, initargs=(shared.spec,)) as pool:
+        futures = {pool.submit(_write_shared_partition, writer, [k for _, _, k in part], [path for _, path, _ in part]): part
+                   for part in partitions}
+        for future in as_completed(futures):
+            part = futures[future]
+            try:
+                results = future.result()
+            except Exception as e:
+                # 子进程崩溃等进程池级别的错误，整个分区记为失败
+                results = [(f"{type(e).__name__}: {e}", "")] * len(part)
+            for (key, path, _), (message, tb) in zip(part, results):
+                if message is None:
+                    if on_done is not None:
+                        on_done(key, path)
+                else:
+                    errors.append((key, message, tb))
+            n_done += len(part)
+            print(f"  已写出 {n_done}/{len(jobs)} 个文件" + (f" ({len(errors)} 个失败)" if errors else ""))
+    return errors
+
+
+def image_forcing_dataset(ds, variables=CMFD_VARIABLES, step_hours=24):
+    """把一段时间的 (time, y, x) CMFD 数据换算为 VIC 5 image driver 使用的 CF 数据集。
+
+    换算与文本驱动文件共用 convert_to_vic；流域外的格网保持 NaN (由 domain 文件的掩膜排除)。
+    """
+    ds = ds[variables].compute()
+    raw = {var: ds[var].transpose('time', 'y', 'x').values for var in variables}
+    converted = convert_to_vic(raw, step_hours)
+    coords = {
+        'time': ('time', ds['time'].values, {'standard_name': 'time', 'long_name': 'time'}),
+        'lat': ('lat', ds['y'].values, {'standard_name': 'latitude', 'long_name': 'latitude', 'units': 'degrees_north'}),
+        'lon': ('lon', ds['x'].values, {'standard_name': 'longitude', 'long_name': 'longitude', 'units': 'degrees_east'}),
+    }
+    data_vars = {col: (('time', 'lat', 'lon'), converted[col].astype(np.float32, copy=False), IMAGE_FORCE_TYPES[col][1])
+                 for col in FORCING_COLUMNS}
+    return xr.Dataset(data_vars, coords=coords, attrs={
+        'title': 'VIC 5 image driver meteorological forcing',
+        'source': 'CMFD, clipped and resampled to 0.25 degree',
+        'Conventions': 'CF-1.6',
+    })
+
+
+def write_image_forcing_file(ds_image, path):
+    """写出一个 VIC 5 image driver 驱动文件 (NetCDF4)。
+
+    image driver 每个时间步读取整个格网，因此按 (1, nlat, nlon) 分块，每次读取正好一个块。
+    """
+    year = pd.Timestamp(ds_image['time'].values[0]).year
+    chunks = (1, ds_image.sizes['lat'], ds_image.sizes['lon'])
+    encoding = {col: {'dtype': 'float32', 'chunksizes': chunks, '_FillValue': np.float32(1e20)} for col in FORCING_COLUMNS}
+    encoding['time'] = {'units': f'days since {year}-01-01', 'calendar': 'standard', 'dtype': 'float64'}
+    ds_image.to_netcdf(path, format='NETCDF4', encoding=encoding)
+    return path
+
+
+def image_global_snippet(forcing_prefix, wind_height=10.0):
+    """与 image driver 驱动文件配套的全局参数文件片段 (VIC 5 格式)。
+
+    VIC 会在 FORCING1 之后接 年份 和 .nc 组成每年的文件名。
+    """
+    lines = [f"FORCING1\t{forcing_prefix}"]
+    lines += [f"FORCE_TYPE\t{force_type}\t{col}" for col, (force_type, _) in IMAGE_FORCE_TYPES.items()]
+    lines += [f"WIND_H\t{wind_height}"]
+    return "\n".join(lines) + "\n"